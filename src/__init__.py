@@ -1,2 +1,4 @@
-__all__ = ["config", "controller", "enum", "input", "log", "panel",
-           "popup", "setup", "tools", "version"]
+__all__ = ["artifact", "compilercache", "config", "controller", "download",
+           "enum", "extract", "history", "input", "log", "logstore", "panel",
+           "popup", "process", "scheduler", "setup", "stamp", "stats", "tools",
+           "version"]
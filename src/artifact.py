@@ -0,0 +1,134 @@
+"""
+Cache of installed setup steps. After a step is installed the files it added
+to the prefix are saved as a compressed archive named after the step's
+fingerprint, and a later setup with the same fingerprint unpacks that archive
+into the prefix instead of downloading and compiling the step. Archives are
+only ever written under a temporary name and renamed into place, so a cache
+directory on a shared filesystem can be used by several hosts at once.
+"""
+
+import os
+import socket
+import tarfile
+
+# suffix of the archives in the cache
+ARTIFACT_SUFFIX = ".tar.gz"
+
+def getPrefixSnapshot(prefix):
+    """
+    Provides a mapping of the files and symlinks under prefix (relative to it)
+    to their (size, modification time), used to find what an install added.
+
+    Arguments:
+      prefix - install prefix to be listed
+    """
+
+    snapshot = {}
+    for root, dirs, files in os.walk(prefix):
+        # symlinks to directories are listed with the directories
+        for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            path = os.path.join(root, name)
+            try: st = os.lstat(path)
+            except OSError: continue
+            snapshot[os.path.relpath(path, prefix)] = (st.st_size, st.st_mtime)
+    return snapshot
+
+def getInstalledFiles(before, after):
+    """
+    Provides the sorted files that are new or changed between two snapshots.
+
+    Arguments:
+      before - snapshot taken before installing
+      after  - snapshot taken after installing
+    """
+
+    return sorted([path for path in after if before.get(path) != after[path]])
+
+class ArtifactCache():
+    """
+    Directory of artifacts, one compressed tar archive per step fingerprint.
+    """
+
+    def __init__(self, path):
+        """
+        Creates a cache in the given directory.
+
+        Arguments:
+          path - directory holding the artifacts
+        """
+
+        self.path = os.path.abspath(path)
+        if not os.path.exists(self.path): os.makedirs(self.path)
+
+    def getPath(self, name, fingerprint):
+        """
+        Provides the path of the artifact for the given step.
+
+        Arguments:
+          name        - name of the setup step
+          fingerprint - fingerprint of the step
+        """
+
+        return os.path.join(self.path, name + "-" + fingerprint + ARTIFACT_SUFFIX)
+
+    def has(self, name, fingerprint):
+        """
+        True if there is an artifact for the given step.
+
+        Arguments:
+          name        - name of the setup step
+          fingerprint - fingerprint of the step
+        """
+
+        return os.path.exists(self.getPath(name, fingerprint))
+
+    def store(self, name, fingerprint, prefix, files):
+        """
+        Saves the given installed files as the step's artifact. This raises an
+        IOError or OSError if it can't be written.
+
+        Arguments:
+          name        - name of the setup step
+          fingerprint - fingerprint of the step
+          prefix      - install prefix the files are relative to
+          files       - files the step installed, relative to prefix
+        """
+
+        path = self.getPath(name, fingerprint)
+
+        # unique per host and process so writers on a shared cache never collide
+        tmpPath = "%s.%s.%i.tmp" % (path, socket.gethostname(), os.getpid())
+        try:
+            tar = tarfile.open(tmpPath, "w:gz")
+            try:
+                for f in files: tar.add(os.path.join(prefix, f), arcname=f, recursive=False)
+            finally:
+                tar.close()
+            os.rename(tmpPath, path)
+        finally:
+            if os.path.exists(tmpPath): os.remove(tmpPath)
+
+    def restore(self, name, fingerprint, prefix):
+        """
+        Unpacks the step's artifact into the prefix, providing the number of
+        files restored. This raises a tarfile.TarError if the artifact is
+        invalid, a ValueError if it has paths outside of the prefix, and an
+        IOError or OSError if it can't be read or unpacked.
+
+        Arguments:
+          name        - name of the setup step
+          fingerprint - fingerprint of the step
+          prefix      - install prefix the files are unpacked to
+        """
+
+        tar = tarfile.open(self.getPath(name, fingerprint), "r:gz")
+        try:
+            members = tar.getmembers()
+            for member in members:
+                path = os.path.normpath(member.name)
+                if os.path.isabs(path) or path == ".." or path.startswith("../"):
+                    raise ValueError("unsafe path in artifact: %s" % member.name)
+            tar.extractall(prefix, members)
+            return len(members)
+        finally:
+            tar.close()
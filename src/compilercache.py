@@ -0,0 +1,131 @@
+"""
+Compiler cache (ccache or sccache) support for the setup steps. The cache is
+put in front of the compiler through CC and CXX, which autotools and cmake
+both pick up, and keeps its objects under the setup cache so rebuilding after
+wiping a build directory or changing a single flag is mostly cache hits.
+"""
+
+import os
+import re
+import subprocess
+from distutils.spawn import find_executable
+
+# supported compiler caches, in order of preference when picking automatically
+COMPILER_CACHES = ["ccache", "sccache"]
+
+# environment variable each tool reads its cache directory from
+CACHE_DIR_VARIABLES = {"ccache": "CCACHE_DIR", "sccache": "SCCACHE_DIR"}
+
+# patterns of the hit and miss counts in the tools' statistics for ccache 3.x,
+# ccache 4.x and sccache. The first match of each pattern in a group is summed,
+# and the first group with a match is used (ccache 4 repeats its counts per
+# storage backend further down).
+HIT_PATTERNS = [[r"^cache hit \(direct\)\s+(\d+)", r"^cache hit \(preprocessed\)\s+(\d+)"],
+                [r"^\s*Hits:\s+(\d+)"],
+                [r"^Cache hits\s+(\d+)"]]
+MISS_PATTERNS = [[r"^cache miss\s+(\d+)"],
+                 [r"^\s*Misses:\s+(\d+)"],
+                 [r"^Cache misses\s+(\d+)"]]
+
+def findCompilerCache(choice):
+    """
+    Provides the name of the compiler cache to use, None if there is none.
+
+    Arguments:
+      choice - 'auto' for the first installed cache, 'none' to disable it, or
+               the name of a specific cache
+    """
+
+    choice = choice.strip().lower()
+    if choice in ("", "none", "false", "no"): return None
+    candidates = COMPILER_CACHES if choice == "auto" else [choice]
+    for name in candidates:
+        if name in COMPILER_CACHES and find_executable(name): return name
+    return None
+
+class CompilerCache():
+    """
+    Compiler cache used by the setup steps, keeping its files in a directory
+    of its own.
+    """
+
+    def __init__(self, name, path):
+        """
+        Creates an interface to the given compiler cache.
+
+        Arguments:
+          name - 'ccache' or 'sccache'
+          path - directory the cache keeps its files in
+        """
+
+        self.name = name
+        self.path = os.path.abspath(path)
+        if not os.path.exists(self.path): os.makedirs(self.path)
+
+    def getEnvironment(self, env):
+        """
+        Provides a copy of the given environment with the compilers wrapped in
+        the cache.
+
+        Arguments:
+          env - environment the build commands would otherwise use
+        """
+
+        env = dict(env)
+        env[CACHE_DIR_VARIABLES[self.name]] = self.path
+
+        # cmake splits these into the compiler (the cache) and its first
+        # argument, so setting CMAKE_<LANG>_COMPILER_LAUNCHER as well would run
+        # the cache on itself
+        for var, compiler in [("CC", "cc"), ("CXX", "c++")]:
+            current = env.get(var, compiler)
+            if not current.split()[0].endswith(self.name): env[var] = self.name + " " + current
+        return env
+
+    def start(self, env):
+        """
+        Resets the statistics so the summary only covers this setup run.
+
+        Arguments:
+          env - environment from getEnvironment()
+        """
+
+        self._run(["--zero-stats"], env)
+
+    def stop(self, env):
+        """
+        Provides the (hits, misses) since start(), None for counts that could
+        not be determined. This also shuts down the sccache server, which would
+        otherwise keep running with our cache directory.
+
+        Arguments:
+          env - environment from getEnvironment()
+        """
+
+        output = self._run(["--show-stats"], env) or ""
+        if self.name == "sccache": self._run(["--stop-server"], env)
+        return (self._getCount(output, HIT_PATTERNS), self._getCount(output, MISS_PATTERNS))
+
+    def _getCount(self, output, patternGroups):
+        """
+        Provides the count matched by the first group of patterns that matches
+        anything.
+        """
+
+        for group in patternGroups:
+            matches = [re.search(pattern, output, re.MULTILINE) for pattern in group]
+            matches = [m for m in matches if m]
+            if matches: return sum([int(m.group(1)) for m in matches])
+        return None
+
+    def _run(self, args, env):
+        """
+        Runs the cache tool, providing its output or None if it failed.
+        """
+
+        try:
+            p = subprocess.Popen([self.name] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = p.communicate()[0]
+        except OSError:
+            return None
+        return output if p.returncode == 0 else None
@@ -1,7 +1,7 @@
 '''
 Default configs.
 '''
-import os, curses
+import os, re, curses
 from ConfigParser import SafeConfigParser
 from tools import *
 from enum import *
@@ -15,6 +15,11 @@ CONFIG = None
 DEFAULT_CONFIG_PATH = os.path.abspath(os.path.dirname(__file__) + "/../config/shadow-cli.conf.default")
 DEFAULT_CONFIG = None
 
+# variants of a matrix build are configured in sections overlaying [setup],
+# for instance [variant.debug] for the variant named 'debug'
+VARIANT_SECTION_PREFIX = "variant."
+VARIANT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
 def _loadConfig(readCache=True):
     d = SafeConfigParser()
     d.read(DEFAULT_CONFIG_PATH)
@@ -29,7 +34,8 @@ def _loadConfig(readCache=True):
     for section in d.sections():
         if not c.has_section(section): c.add_section(section)
         for option in d.options(section):
-            default = d.get(section, option)
+            # raw, so references like %(cache)s pick up our own values
+            default = d.get(section, option, raw=True)
             if not c.has_option(section, option): c.set(section, option, default)
 
     return c
@@ -47,6 +53,40 @@ def getConfig():
     if CONFIG is None: CONFIG = _loadConfig(True)
     return CONFIG
 
+def getVariantConfigs(config):
+    """
+    Provides a list of (name, config) tuples for the variants named by the
+    'variants' setup option, which is empty if there are none. Each config is a
+    copy of the given one with the variant's section overlaid on [setup]. The
+    cache is shared by all variants, so it can't be overlaid. This raises a
+    ValueError if a variant is misconfigured.
+
+    Arguments:
+      config - configuration listing the variants
+    """
+
+    names = []
+    if config.has_option("setup", "variants"): names = config.get("setup", "variants").replace(",", " ").split()
+
+    variants = []
+    for name in names:
+        section = VARIANT_SECTION_PREFIX + name
+        if not VARIANT_NAME_PATTERN.match(name): raise ValueError("invalid variant name '%s'" % name)
+        if name in [n for n, _ in variants]: raise ValueError("variant '%s' is listed twice" % name)
+        if not config.has_section(section): raise ValueError("variant '%s' has no [%s] section" % (name, section))
+
+        # copy the raw values so options like includepaths pick up the
+        # variant's prefix when they are interpolated
+        c = SafeConfigParser()
+        for s in config.sections():
+            c.add_section(s)
+            for option, value in config.items(s, True): c.set(s, option, value)
+        for option, value in config.items(section, True):
+            if option != "cache": c.set("setup", option, value)
+        variants.append((name, c))
+
+    return variants
+
 def isConfigured(): 
     return os.path.exists(CONFIG_PATH)
 
@@ -259,6 +259,19 @@ class Controller:
     def getToolBar(self):
         return self._toolBar
 
+    def setToolBarDefault(self, msg):
+        """
+        Changes the default message of the toolbar, for instance to show the
+        progress of a running task.
+
+        Arguments:
+          msg - default message for the toolbar
+        """
+
+        if msg != self._toolBarMsg:
+            self._toolBarMsg = msg
+            self.setToolBarMessage()
+
     def setToolBarMessage(self, msg=None, attr=None, redraw=False):
         """
         Sets the message displayed in the interfaces control panel. This uses our
@@ -0,0 +1,245 @@
+"""
+Download management for setup. Archives are prefetched in background threads
+so that the network is busy while the CPU compiles earlier steps, and are kept
+in a content addressed cache so they are only downloaded once.
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+# name of the file mapping urls to the digests of the archives they served
+DOWNLOAD_INDEX_NAME = "index"
+# directory in the download cache holding unfinished downloads
+DOWNLOAD_INCOMING_NAME = "incoming"
+
+class Prefetcher():
+    """
+    Fetches a list of resources in the background, in the order they were given,
+    using a small pool of threads. Steps ask for their resource with get(), which
+    only blocks on that one resource. If nobody started fetching it yet then the
+    caller fetches it right away rather than waiting in line.
+    """
+
+    def __init__(self, fetch, numThreads, logger):
+        """
+        Creates a prefetcher that isn't yet running.
+
+        Arguments:
+          fetch      - function taking a key and returning the fetched path, or
+                       None if the fetch failed
+          numThreads - number of resources fetched concurrently in the background
+          logger     - log panel used to report progress
+        """
+
+        self.fetch = fetch
+        self.numThreads = max(1, numThreads)
+        self.logger = logger
+
+        self._queue = []                    # keys not yet claimed by any thread
+        self._results = {}                  # key -> fetched path (or None)
+        self._done = {}                     # key -> event set once fetched
+        self._inFlight = set()              # keys currently being fetched
+        self._halt = False
+        self._cond = threading.Condition()  # guards all of the above
+
+    def start(self, keys):
+        """
+        Starts fetching the given resources in the background.
+
+        Arguments:
+          keys - resources in the order they will be needed
+        """
+
+        self._cond.acquire()
+        for key in keys:
+            if key in self._done: continue
+            self._done[key] = threading.Event()
+            self._queue.append(key)
+        self._cond.release()
+
+        for i in range(min(self.numThreads, len(keys))):
+            t = threading.Thread(target=self._work, name="prefetch-%i" % i)
+            t.setDaemon(True)
+            t.start()
+
+    def get(self, key):
+        """
+        Provides the fetched path of the given resource, blocking until it is
+        available. This returns None if fetching it failed.
+
+        Arguments:
+          key - resource to be provided
+        """
+
+        self._cond.acquire()
+        if key not in self._done: self._done[key] = threading.Event()
+        event = self._done[key]
+
+        # nobody is working on it yet, so do it ourselves
+        isClaimed = not event.isSet() and not key in self._inFlight
+        if isClaimed:
+            if key in self._queue: self._queue.remove(key)
+            self._inFlight.add(key)
+        self._cond.release()
+
+        if isClaimed: self._fetch(key)
+        else: event.wait()
+
+        return self._results.get(key)
+
+    def stop(self):
+        """
+        Stops fetching resources that have not yet been started.
+        """
+
+        self._cond.acquire()
+        self._halt = True
+        self._cond.release()
+
+    def _fetch(self, key):
+        """
+        Fetches a resource that was claimed by adding it to the in-flight set.
+        """
+
+        result = None
+        try:
+            result = self.fetch(key)
+        finally:
+            self._cond.acquire()
+            self._inFlight.discard(key)
+            self._results[key] = result
+            self._done[key].set()
+            self._cond.release()
+
+    def _work(self):
+        while True:
+            self._cond.acquire()
+            if self._halt or not self._queue:
+                self._cond.release()
+                return
+            key = self._queue.pop(0)
+            self._inFlight.add(key)
+            self._cond.release()
+
+            self.logger.debug("prefetching resource \'%s\'" % key)
+            self._fetch(key)
+
+class DownloadCache():
+    """
+    Content addressed store for downloaded archives. Each archive is saved under
+    the SHA-256 digest of its contents, and a small index maps the url it was
+    downloaded from to that digest. The index also records the size of every
+    archive so a cached archive can be checked against an expected digest
+    without reading it again.
+    """
+
+    def __init__(self, path):
+        """
+        Creates a cache in the given directory, loading its index if there is
+        one.
+
+        Arguments:
+          path - directory holding the cached archives
+        """
+
+        self.path = os.path.abspath(path)
+        self.indexPath = os.path.join(self.path, DOWNLOAD_INDEX_NAME)
+        self.incomingPath = os.path.join(self.path, DOWNLOAD_INCOMING_NAME)
+        for d in [self.path, self.incomingPath]:
+            if not os.path.exists(d): os.makedirs(d)
+
+        self._lock = threading.RLock()
+        self._index = {}                    # url -> {"digest": ..., "size": ...}
+        if os.path.exists(self.indexPath):
+            try:
+                with open(self.indexPath) as f: self._index = json.load(f)
+            except ValueError:
+                # a corrupt index only costs us a download
+                self._index = {}
+
+    def getDigest(self, url):
+        """
+        Provides the digest of the archive last downloaded from the url, None if
+        it isn't cached.
+
+        Arguments:
+          url - location the archive was downloaded from
+        """
+
+        self._lock.acquire()
+        entry = self._index.get(url)
+        self._lock.release()
+        return str(entry["digest"]) if entry else None
+
+    def lookup(self, url, expectedDigest=None):
+        """
+        Provides the path of the cached archive for the url, None if it isn't
+        cached, is incomplete, or doesn't have the expected digest.
+
+        Arguments:
+          url            - location the archive was downloaded from
+          expectedDigest - SHA-256 hex digest the archive must have, if any
+        """
+
+        self._lock.acquire()
+        entry = self._index.get(url)
+        self._lock.release()
+        if not entry: return None
+
+        if expectedDigest and entry["digest"] != expectedDigest.lower(): return None
+        path = self.getPath(entry["digest"])
+        if not os.path.exists(path) or os.path.getsize(path) != entry["size"]: return None
+        return path
+
+    def getPath(self, digest):
+        """
+        Provides the path where the archive with the given digest is stored.
+
+        Arguments:
+          digest - SHA-256 hex digest of the archive
+        """
+
+        # json provides unicode, which doesn't mix with our byte strings
+        return os.path.join(self.path, str(digest))
+
+    def getIncomingPath(self, url):
+        """
+        Provides the path an archive should be downloaded to before being added
+        to the cache. This is stable for each url so that partial downloads can
+        be resumed.
+
+        Arguments:
+          url - location the archive is downloaded from
+        """
+
+        return os.path.join(self.incomingPath, hashlib.sha256(url).hexdigest())
+
+    def add(self, url, path, digest):
+        """
+        Moves a downloaded archive into the cache and records it in the index,
+        providing its new path.
+
+        Arguments:
+          url    - location the archive was downloaded from
+          path   - downloaded archive, normally from getIncomingPath()
+          digest - SHA-256 hex digest of the archive's contents
+        """
+
+        target = self.getPath(digest)
+        os.rename(path, target)
+
+        self._lock.acquire()
+        try:
+            self._index[url] = {"digest": digest, "size": os.path.getsize(target)}
+            self._saveIndex()
+        finally:
+            self._lock.release()
+        return target
+
+    def _saveIndex(self):
+        # write and rename so a crash never leaves a truncated index behind
+        tmpPath = self.indexPath + ".tmp"
+        with open(tmpPath, 'w') as f: json.dump(self._index, f, indent=1, sort_keys=True)
+        os.rename(tmpPath, self.indexPath)
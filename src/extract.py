@@ -0,0 +1,382 @@
+"""
+Unpacks downloaded archives into the build cache. Tar archives are read
+strictly sequentially, so they can be extracted straight from a download as it
+arrives. The archive format is detected from its first bytes, and compressed
+archives are decompressed by a parallel tool (pigz, pbzip2, xz, zstd) when one
+is installed. A single root directory shared by all files of an archive is
+stripped while extracting (like tar's --strip-components), so every file is
+written exactly once, directly to its final place.
+"""
+
+import os
+import posixpath
+import tarfile
+import zipfile
+import tempfile
+import threading
+import subprocess
+from distutils.spawn import find_executable
+
+from enum import *
+
+ArchiveFormats = Enum("TAR", "GZIP", "BZIP2", "XZ", "ZSTD", "ZIP")
+
+# leading bytes identifying each format, plain tar archives instead have their
+# magic at TAR_MAGIC_OFFSET
+ARCHIVE_MAGIC = [("\x1f\x8b", ArchiveFormats.GZIP),
+                 ("BZh", ArchiveFormats.BZIP2),
+                 ("\xfd7zXZ\x00", ArchiveFormats.XZ),
+                 ("\x28\xb5\x2f\xfd", ArchiveFormats.ZSTD),
+                 ("PK\x03\x04", ArchiveFormats.ZIP)]
+TAR_MAGIC_OFFSET = 257
+TAR_MAGIC = "ustar"
+MAGIC_LENGTH = 512
+
+# external tools decompressing to stdout, in order of preference
+DECOMPRESSORS = {ArchiveFormats.GZIP: [["pigz", "-dc"]],
+                 ArchiveFormats.BZIP2: [["pbzip2", "-dc"]],
+                 ArchiveFormats.XZ: [["xz", "-dc", "-T0"]],
+                 ArchiveFormats.ZSTD: [["zstd", "-dc", "-T0"]]}
+
+# tarfile stream modes for formats python can decompress by itself
+TAR_STREAM_MODES = {ArchiveFormats.TAR: "r|",
+                    ArchiveFormats.GZIP: "r|gz",
+                    ArchiveFormats.BZIP2: "r|bz2"}
+
+# file name endings of archives, used to name the extracted directory
+ARCHIVE_SUFFIXES = [".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tbz", ".tar.xz",
+                    ".txz", ".tar.zst", ".tzst", ".tar", ".zip"]
+
+# bytes read at a time when feeding a decompressor
+EXTRACT_BUFFER_SIZE = 64 * 1024
+
+def getArchiveBaseName(name):
+    """
+    Provides the archive's file name without its archive suffix, for instance
+    "openssl-1.0.0d" for "openssl-1.0.0d.tar.gz".
+
+    Arguments:
+      name - file name of the archive
+    """
+
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.lower().endswith(suffix): return name[:-len(suffix)]
+    return name
+
+def isStreamable(name):
+    """
+    True if an archive with the given file name can be extracted from a stream
+    that does not support seeking, which is the case for everything but zip.
+
+    Arguments:
+      name - file name of the archive
+    """
+
+    return not name.lower().endswith(".zip")
+
+def detectFormat(head):
+    """
+    Provides the ArchiveFormats value matching the leading bytes of an archive,
+    None if the format is not recognized.
+
+    Arguments:
+      head - first MAGIC_LENGTH bytes of the archive (or all of it if shorter)
+    """
+
+    for magic, fmt in ARCHIVE_MAGIC:
+        if head.startswith(magic): return fmt
+    if head[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + len(TAR_MAGIC)] == TAR_MAGIC:
+        return ArchiveFormats.TAR
+    return None
+
+def getDecompressor(fmt):
+    """
+    Provides the command of the installed parallel decompressor for the given
+    format, None if there is none.
+
+    Arguments:
+      fmt - ArchiveFormats value of the archive
+    """
+
+    for cmd in DECOMPRESSORS.get(fmt, []):
+        if find_executable(cmd[0]): return list(cmd)
+    return None
+
+def extractArchive(fileobj, path, logger=None):
+    """
+    Unpacks an archive into the given directory. If everything in the archive
+    is inside of a single root directory then that directory is stripped, so
+    its contents end up directly in path. Tar archives, compressed or not, are
+    only read once front to back, so fileobj does not need to support seeking
+    unless the archive is a zip file. This raises a ValueError if the format
+    is not supported or the archive has unsafe paths, a tarfile.TarError (or
+    zipfile.BadZipfile) if the archive is invalid, and an IOError if reading
+    it fails. This returns True if a root directory was stripped.
+
+    Arguments:
+      fileobj - file-like object providing the archive
+      path    - directory the archive's contents are written to
+      logger  - log panel told which decompressor is used, if any
+    """
+
+    head = _readFully(fileobj, MAGIC_LENGTH)
+    fmt = detectFormat(head)
+    if fmt is None: raise ValueError("unrecognized archive format")
+
+    if fmt == ArchiveFormats.ZIP:
+        if not hasattr(fileobj, "seek"): raise ValueError("zip archives can not be extracted from a stream")
+        fileobj.seek(0)
+        return _extractZip(fileobj, path)
+
+    stream = _PeekedStream(head, fileobj)
+    cmd = getDecompressor(fmt)
+    if cmd:
+        if logger: logger.debug("decompressing with \'" + " ".join(cmd) + "\'")
+        return _extractTarWith(cmd, stream, path)
+    elif fmt in TAR_STREAM_MODES:
+        return _extractTar(stream, TAR_STREAM_MODES[fmt], path)
+    else:
+        return _extractTar(_DecompressedStream(stream, _getPythonDecompressor(fmt)), "r|", path)
+
+def _extractTar(fileobj, mode, path):
+    tar = tarfile.open(fileobj=fileobj, mode=mode)
+    stripper = _RootStripper(path)
+    try:
+        tar.extractall(path=path, members=_stripTarMembers(tar, stripper))
+    finally:
+        tar.close()
+    return stripper.isStripped()
+
+def _stripTarMembers(tar, stripper):
+    """
+    Provides the tar's members, renamed to where they are extracted. This is
+    consumed lazily by extractall(), so in stream mode each member is renamed
+    right before it is extracted.
+    """
+
+    # extractall() sets directory permissions at the very end, using the names
+    # we give them, so those need fixing if we stop stripping
+    directories = []
+
+    for tarinfo in tar:
+        wasStripping = stripper.isStripping
+        name = stripper.getName(tarinfo.name, tarinfo.isdir())
+
+        if wasStripping and not stripper.isStripping:
+            for d in directories: d.name = posixpath.join(stripper.root, d.name)
+        if name is None: continue
+
+        tarinfo.name = name
+        if tarinfo.islnk(): tarinfo.linkname = stripper.getLinkName(tarinfo.linkname)
+        if tarinfo.isdir(): directories.append(tarinfo)
+        yield tarinfo
+
+def _extractTarWith(cmd, fileobj, path):
+    """
+    Extracts a tar archive that is decompressed by an external tool. A thread
+    feeds the archive to the tool while we unpack its output.
+    """
+
+    # stderr would otherwise end up on the curses display. other steps may be
+    # extracting or building at the same time, and the tool holding their pipes
+    # open would keep them from ever seeing the end of their data.
+    errors = tempfile.TemporaryFile()
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errors, close_fds=True)
+    readErrors = []
+
+    def feed():
+        try:
+            while True:
+                try: chunk = fileobj.read(EXTRACT_BUFFER_SIZE)
+                except Exception, exc:
+                    readErrors.append(exc)
+                    break
+                if not chunk: break
+                p.stdin.write(chunk)
+        except IOError:
+            # the tool exited early, which is reported through its return code
+            pass
+        finally:
+            try: p.stdin.close()
+            except IOError: pass
+
+    feeder = threading.Thread(target=feed, name="decompress-feeder")
+    feeder.setDaemon(True)
+    feeder.start()
+
+    try:
+        isStripped = _extractTar(p.stdout, "r|", path)
+        # the tool may still be writing padding after the end of the tar data
+        while p.stdout.read(EXTRACT_BUFFER_SIZE): pass
+    finally:
+        # unblocks the tool and the feeder if we stopped reading early
+        p.stdout.close()
+        feeder.join()
+        returncode = p.wait()
+
+    # problems reading the archive itself are what broke the tool
+    if readErrors: raise readErrors[0]
+    if returncode != 0:
+        errors.seek(0)
+        msg = errors.read().strip()
+        raise IOError("\'%s\' failed with return code %i%s" % (" ".join(cmd), returncode, ": " + msg if msg else ""))
+    return isStripped
+
+def _extractZip(fileobj, path):
+    archive = zipfile.ZipFile(fileobj)
+    stripper = _RootStripper(path)
+    try:
+        for info in archive.infolist():
+            isDir = info.filename.endswith("/")
+            name = stripper.getName(info.filename, isDir)
+            if name is None: continue
+
+            # zipfile reads the member by its original name, so renaming is safe,
+            # though it recognizes directories by their trailing slash
+            info.filename = name + "/" if isDir else name
+            archive.extract(info, path)
+
+            # zipfile doesn't restore permissions, which breaks configure scripts
+            mode = (info.external_attr >> 16) & 0777
+            if mode: os.chmod(os.path.join(path, name), mode)
+    finally:
+        archive.close()
+    return stripper.isStripped()
+
+def _getPythonDecompressor(fmt):
+    """
+    Provides a decompressor object (having a decompress() method) for formats
+    tarfile doesn't handle itself, raising a ValueError if the needed module
+    isn't available.
+    """
+
+    if fmt == ArchiveFormats.XZ:
+        try:
+            import lzma
+        except ImportError:
+            try: from backports import lzma
+            except ImportError: raise ValueError("xz archives need the xz tool or the lzma module")
+        return lzma.LZMADecompressor()
+    elif fmt == ArchiveFormats.ZSTD:
+        try: import zstandard
+        except ImportError: raise ValueError("zstd archives need the zstd tool or the zstandard module")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError("unsupported archive format: %s" % fmt)
+
+def _readFully(fileobj, size):
+    """
+    Reads up to size bytes, retrying short reads until the end of the file.
+    """
+
+    data = ""
+    while len(data) < size:
+        chunk = fileobj.read(size - len(data))
+        if not chunk: break
+        data += chunk
+    return data
+
+class _PeekedStream():
+    """
+    Puts bytes we already read to detect the format back in front of a stream.
+    """
+
+    def __init__(self, head, fileobj):
+        self.head = head
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        if self.head:
+            if size < 0: size = len(self.head)
+            chunk, self.head = self.head[:size], self.head[size:]
+            return chunk
+        return self.fileobj.read(size)
+
+class _DecompressedStream():
+    """
+    Stream providing the decompressed contents of another stream.
+    """
+
+    def __init__(self, fileobj, decompressor):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self.buffer = ""
+
+    def read(self, size=-1):
+        if size < 0: size = EXTRACT_BUFFER_SIZE
+        while len(self.buffer) < size:
+            chunk = self.fileobj.read(EXTRACT_BUFFER_SIZE)
+            if not chunk: break
+            self.buffer += self.decompressor.decompress(chunk)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+class _RootStripper():
+    """
+    Strips the root directory from the names of archive members as long as
+    every member seen so far shares it. If a member outside of it turns up,
+    what was already extracted is moved into a directory named after the root
+    (a single rename) and later names are left alone.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = None
+        self.isStripping = True
+
+    def getName(self, name, isDir):
+        """
+        Provides the name the member should be extracted as, None if it should
+        be skipped (the root directory itself). This raises a ValueError if
+        the name would escape the extraction directory.
+
+        Arguments:
+          name  - name of the member in the archive
+          isDir - True if the member is a directory
+        """
+
+        name = posixpath.normpath(name)
+        if name == ".": return None
+        if name.startswith("/") or name == ".." or name.startswith("../"):
+            raise ValueError("unsafe path in archive: %s" % name)
+        if not self.isStripping: return name
+
+        parts = name.split("/", 1)
+        if self.root is None: self.root = parts[0]
+
+        if parts[0] == self.root:
+            if len(parts) == 2: return parts[1]
+            if isDir: return None
+
+        # something besides the root directory, stop stripping
+        self._unstrip()
+        return name
+
+    def isStripped(self):
+        """
+        True if every member was inside of the root directory, which was
+        stripped.
+        """
+
+        return self.isStripping and self.root is not None
+
+    def getLinkName(self, linkname):
+        """
+        Provides the target of a hard link, which names another member.
+
+        Arguments:
+          linkname - name of the linked member in the archive
+        """
+
+        linkname = posixpath.normpath(linkname)
+        if self.isStripping and self.root and linkname.startswith(self.root + "/"):
+            return linkname[len(self.root) + 1:]
+        return linkname
+
+    def _unstrip(self):
+        self.isStripping = False
+        if self.root is None or not os.listdir(self.path): return
+
+        tmpPath = self.path + ".unstrip"
+        os.rename(self.path, tmpPath)
+        os.makedirs(self.path)
+        os.rename(tmpPath, os.path.join(self.path, self.root))
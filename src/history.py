@@ -0,0 +1,191 @@
+"""
+History of past setup runs, used to predict how long a setup will take. The
+duration of every step is stored per host and fingerprint in a small SQLite
+database, and the progress of a running setup is estimated by replaying the
+remaining steps on the worker pool with their expected durations.
+"""
+
+import os
+import time
+import socket
+import sqlite3
+import threading
+
+# name of the database file under the shadow config directory
+HISTORY_FILE_NAME = "history.sqlite"
+
+# number of recent runs averaged for a step's expected duration
+HISTORY_SAMPLES = 5
+
+# expected seconds for steps that were never run before, by how they're done
+DEFAULT_DURATIONS = {"built": 120.0, "restored": 5.0, "skipped": 0.0}
+
+class HistoryStore():
+    """
+    Durations of setup steps from earlier runs. The database is opened for each
+    query so it can be used from any of the setup threads.
+    """
+
+    def __init__(self, path):
+        """
+        Opens the database at the given path, creating it if needed.
+
+        Arguments:
+          path - location of the SQLite database
+        """
+
+        self.path = os.path.abspath(path)
+        self.host = socket.gethostname()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory): os.makedirs(directory)
+        self._execute("CREATE TABLE IF NOT EXISTS steps (host TEXT, name TEXT, fingerprint TEXT, status TEXT, duration REAL, finished REAL)")
+        self._execute("CREATE INDEX IF NOT EXISTS steps_by_name ON steps (name, status, host, fingerprint)")
+
+    def record(self, name, fingerprint, status, duration):
+        """
+        Stores how long a step took.
+
+        Arguments:
+          name        - name of the setup step
+          fingerprint - fingerprint of the step
+          status      - how the step was done, 'built' or 'restored'
+          duration    - seconds the step took
+        """
+
+        self._execute("INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?)", (self.host, name, fingerprint, status, duration, time.time()))
+
+    def getEstimate(self, name, fingerprint, status="built"):
+        """
+        Provides the expected duration of a step, None if it has no history. This
+        prefers earlier runs of the same fingerprint on this host, then runs of
+        the step with other fingerprints on this host, then runs on any host.
+
+        Arguments:
+          name        - name of the setup step
+          fingerprint - fingerprint of the step
+          status      - how the step will be done, 'built' or 'restored'
+        """
+
+        query = "SELECT AVG(duration) FROM (SELECT duration FROM steps WHERE name = ? AND status = ?%s ORDER BY finished DESC LIMIT %i)"
+        for condition, args in [(" AND host = ? AND fingerprint = ?", (self.host, fingerprint)),
+                                (" AND host = ?", (self.host,)),
+                                ("", ())]:
+            rows = self._execute(query % (condition, HISTORY_SAMPLES), (name, status) + args)
+            if rows and rows[0][0] is not None: return rows[0][0]
+        return None
+
+    def _execute(self, statement, args=()):
+        self._lock.acquire()
+        try:
+            connection = sqlite3.connect(self.path, timeout=30)
+            try:
+                rows = connection.execute(statement, args).fetchall()
+                connection.commit()
+                return rows
+            finally:
+                connection.close()
+        finally:
+            self._lock.release()
+
+class ProgressEstimator():
+    """
+    Predicts when a setup will finish. The remaining steps are scheduled on a
+    simulated worker pool in the same way the StepScheduler would (ready steps
+    start in order as workers become free) using their expected durations.
+    """
+
+    def __init__(self, steps, durations, numWorkers):
+        """
+        Creates an estimator for a setup that is about to start.
+
+        Arguments:
+          steps      - ordered list of SetupStep instances
+          durations  - mapping of step names to their expected seconds
+          numWorkers - number of steps that may run at once
+        """
+
+        self.steps = list(steps)
+        self.durations = dict(durations)
+        self.numWorkers = max(1, numWorkers)
+        self.startTime = time.time()
+
+        self._started = {}                  # step name -> start time
+        self._finished = set()
+        self._isFailed = False
+        self._lock = threading.Lock()
+
+    def start(self, name):
+        """
+        Marks a step as running.
+
+        Arguments:
+          name - name of the setup step
+        """
+
+        self._lock.acquire()
+        self._started[name] = time.time()
+        self._lock.release()
+
+    def finish(self, name, success):
+        """
+        Marks a step as done.
+
+        Arguments:
+          name    - name of the setup step
+          success - False if the step failed, which ends the setup
+        """
+
+        self._lock.acquire()
+        self._finished.add(name)
+        if not success: self._isFailed = True
+        self._lock.release()
+
+    def getProgress(self):
+        """
+        Provides a tuple of the fraction of the setup that is done and the
+        expected seconds until it finishes. The latter is None if the setup
+        failed.
+        """
+
+        self._lock.acquire()
+        try:
+            if self._isFailed: return (float(len(self._finished)) / max(1, len(self.steps)), None)
+            remaining = self._simulate(time.time())
+        finally:
+            self._lock.release()
+
+        elapsed = time.time() - self.startTime
+        fraction = elapsed / (elapsed + remaining) if elapsed + remaining > 0 else 1.0
+        return (fraction, remaining)
+
+    def _simulate(self, now):
+        """
+        Provides the seconds until all steps are done. This must be called while
+        holding the lock.
+        """
+
+        names = set([step.name for step in self.steps])
+        done = set(self._finished)
+
+        # running steps keep a worker until their expected end
+        running = {}                        # step name -> seconds until it ends
+        for name, startTime in self._started.items():
+            if name not in done: running[name] = max(0.0, self.durations.get(name, 0.0) - (now - startTime))
+        pending = [step for step in self.steps if step.name not in done and step.name not in running]
+
+        clock = 0.0
+        while True:
+            for step in list(pending):
+                if len(running) >= self.numWorkers: break
+                if [d for d in step.depends if d in names and d not in done]: continue
+                pending.remove(step)
+                running[step.name] = clock + self.durations.get(step.name, 0.0)
+            # nothing left that could ever run
+            if not running: break
+
+            name = min(running, key=running.get)
+            clock = max(clock, running.pop(name))
+            done.add(name)
+        return clock
@@ -3,6 +3,9 @@
   (www.atagar.com - atagar@torproject.org)
 """
 
+import re
+import sys
+import zlib
 import curses
 import threading
 from time import gmtime, strftime
@@ -10,6 +13,7 @@ from time import gmtime, strftime
 from panel import *
 from enum import *
 from tools import *
+from logstore import *
 
 LogLevels = Enum("ERROR", "INFO", "DEBUG")
 LogColors = {LogLevels.ERROR : "red",
@@ -29,6 +33,12 @@ LogDescriptions = {LogLevels.ERROR : "displays only error messages",
 CONTENT_HEIGHT_REDRAW_THRESHOLD = 3
 # spaces an entry's message is indented after the first line
 ENTRY_INDENT = 2
+# most characters of the search pattern shown in the title
+SEARCH_TITLE_WIDTH = 30
+# entries copied from the log at a time while saving a snapshot (the log is
+# locked while they're copied), and the size of the snapshot's write buffer
+SNAPSHOT_BATCH_SIZE = 2000
+SNAPSHOT_BUFFER_SIZE = 1048576
 
 class LogEntry():
     """
@@ -45,6 +55,7 @@ class LogEntry():
         self.msg = msg
         self.color = color
         self._displayMessage = None
+        self._fileRecord = None             # (LogFile, offset, length) once written to disk
 
     def getDisplayMessage(self, includeDate=False):
         """
@@ -66,12 +77,239 @@ class LogEntry():
 
         return self._displayMessage
 
+def _getSnapshotCompressor(path):
+    """
+    Provides a compressor (having compress() and flush() methods) for the
+    snapshot's file extension, None if it isn't compressed. This raises a
+    ValueError if the needed module isn't available.
+    """
+
+    if path.endswith(".gz"):
+        # window bits over 16 make zlib write a gzip header and trailer
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif path.endswith(".zst"):
+        try: import zstandard
+        except ImportError: raise ValueError("zstd snapshots need the zstandard module")
+        return zstandard.ZstdCompressor().compressobj()
+    return None
+
+def getEntryMeasure(entry):
+    """
+    Provides the measure the number of lines an entry is drawn with depends on
+    (see LogPanel._getEntryHeight()). This is the length of its displayed
+    message, or -1 if the message has several lines.
+
+    Arguments:
+      entry - entry to be measured
+    """
+
+    msg = entry.getDisplayMessage()
+    return -1 if "\n" in msg else len(msg.strip())
+
+def encodeLogEntry(entry):
+    """
+    Provides the bytes of an entry in a disk-backed log, which is the line it
+    has in a log snapshot.
+
+    Arguments:
+      entry - entry to be encoded
+    """
+
+    return entry.getDisplayMessage(True) + "\n"
+
+def decodeLogEntry(data, timestamp):
+    """
+    Provides the entry of the bytes from encodeLogEntry().
+
+    Arguments:
+      data      - bytes of the entry
+      timestamp - unix timestamp of the entry, which is kept by the store as
+                  parsing it from the bytes is slow
+    """
+
+    _, _, levelLabel, msg = (data[:-1] + " ").split(" ", 3)
+    level = LogLevels.values()[LogLevels.indexOf(levelLabel[1:-1])]
+    return LogEntry(timestamp, level, msg[:-1], LogColors[level])
+
+class SnapshotWriter(threading.Thread):
+    """
+    Saves the entries of a log to a file in the background. The snapshot is of
+    the entries logged before it was created, which are copied from the log in
+    small batches so the log (and the threads logging to it) are only held up
+    briefly. Entries the log drops before they're copied are left out. Paths
+    ending in '.gz' or '.zst' are compressed with gzip or zstd.
+    """
+
+    def __init__(self, path, log, lock, logger=None):
+        """
+        Opens the snapshot file, raising an IOError if it can't be created or a
+        ValueError if its compression isn't available. This must be called
+        while holding the lock.
+
+        Arguments:
+          path   - path where to save the log snapshot
+          log    - LogStore or DiskLogStore being saved
+          lock   - lock guarding the log
+          logger - notified of how saving the snapshot went, if provided
+        """
+
+        threading.Thread.__init__(self, name="log-snapshot")
+        self.setDaemon(True)
+
+        self.path = path
+        self.log = log
+        self.lock = lock
+        self.logger = logger
+        self.skipped = 0                    # entries dropped before they were copied
+        self.error = None                   # problem that ended the snapshot
+
+        # the snapshot ends with the newest entry as of now
+        self._start = log.total - len(log)
+        self._end = log.total
+        self._next = self._start            # sequence number of the next entry copied
+
+        self._compressor = _getSnapshotCompressor(path)
+        self._file = open(path, "wb", SNAPSHOT_BUFFER_SIZE)
+
+    def getProgress(self):
+        """
+        Provides the fraction of the snapshot that has been written.
+        """
+
+        if self._end == self._start: return 1.0
+        return float(self._next - self._start) / (self._end - self._start)
+
+    def run(self):
+        try:
+            try:
+                while self._next < self._end:
+                    self.lock.acquire()
+                    try:
+                        # entries dropped (or cleared) since the snapshot began
+                        start = max(self._next, self.log.total - len(self.log))
+                        start = min(start, self._end)
+                        end = min(start + SNAPSHOT_BATCH_SIZE, self._end)
+
+                        # disk-backed logs are already stored as snapshot lines
+                        if isinstance(self.log, DiskLogStore): data = self.log.readRange(start, end)
+                        else: entries = self.log.getEntries(start, end)
+                    finally:
+                        self.lock.release()
+
+                    if not isinstance(self.log, DiskLogStore):
+                        data = "".join([entry.getDisplayMessage(True) + "\n" for entry in entries])
+
+                    if self._compressor: data = self._compressor.compress(data)
+                    self._file.write(data)
+                    self.skipped += start - self._next
+                    self._next = end
+
+                if self._compressor: self._file.write(self._compressor.flush())
+            finally:
+                self._file.close()
+        except IOError, exc:
+            self.error = exc
+
+        if self.logger is None: return
+        elif self.error is not None:
+            self.logger.error("unable to save log snapshot: %s" % getFileErrorMsg(self.error))
+        elif self.skipped:
+            self.logger.info("saved log as '%s' (%i entries were dropped before they were saved)" % (self.path, self.skipped))
+        else: self.logger.info("saved log as '%s'" % self.path)
+
+class StreamLogger():
+    """
+    Logger with the same interface as the LogPanel that writes entries to the
+    terminal instead, for running without curses. Errors go to stderr and
+    everything else to stdout.
+    """
+
+    def __init__(self, level, out=sys.stdout, err=sys.stderr):
+        """
+        Creates a logger for entries up to the given level.
+
+        Arguments:
+          level - most verbose LogLevels value that is written
+          out   - file entries are written to
+          err   - file error entries are written to
+        """
+
+        self.level = level
+        self.out = out
+        self.err = err
+        self._lock = threading.Lock()
+
+    def _log(self, message, level):
+        self._logLines([message], level)
+
+    def _logLines(self, messages, level):
+        if LogLevels.indexOf(level) > LogLevels.indexOf(self.level): return
+        now = time.time()
+        entries = [LogEntry(now, level, getPrintable(message), LogColors[level]) for message in messages]
+        f = self.err if level is LogLevels.ERROR else self.out
+
+        # lines of concurrently running steps must not be interleaved
+        self._lock.acquire()
+        try:
+            f.write("".join([entry.getDisplayMessage() + "\n" for entry in entries]))
+            f.flush()
+        finally:
+            self._lock.release()
+
+    def error(self, message):
+        self._log(message, LogLevels.ERROR)
+
+    def info(self, message):
+        self._log(message, LogLevels.INFO)
+
+    def debug(self, message):
+        self._log(message, LogLevels.DEBUG)
+
+    def debugLines(self, messages):
+        self._logLines(messages, LogLevels.DEBUG)
+
+    def isPaused(self):
+        return False
+
+class VariantLogger():
+    """
+    Logger for one variant of a matrix build, prefixing its messages with the
+    variant's name before passing them on to the shared logger.
+    """
+
+    def __init__(self, name, logger):
+        """
+        Creates a logger for the named variant.
+
+        Arguments:
+          name   - name of the variant
+          logger - logger the messages are passed on to
+        """
+
+        self.name = name
+        self.logger = logger
+
+    def error(self, message):
+        self.logger.error("[%s] %s" % (self.name, message))
+
+    def info(self, message):
+        self.logger.info("[%s] %s" % (self.name, message))
+
+    def debug(self, message):
+        self.logger.debug("[%s] %s" % (self.name, message))
+
+    def debugLines(self, messages):
+        self.logger.debugLines(["[%s] %s" % (self.name, message) for message in messages])
+
+    def isPaused(self):
+        return self.logger.isPaused()
+
 class LogPanel(Panel, threading.Thread):
     """
     Listens for and displays logs.
     """
 
-    def __init__(self, stdscr, level, popupManager):
+    def __init__(self, stdscr, level, popupManager, capacity=DEFAULT_LOG_CAPACITY, logFile=None):
         Panel.__init__(self, stdscr, "log", 0)
         threading.Thread.__init__(self)
         self.setDaemon(True)
@@ -79,8 +317,20 @@ class LogPanel(Panel, threading.Thread):
         self.popupManager = popupManager
 
         self.setPauseAttr("msgLog")         # tracks the message log when we're paused
-        self.msgLog = []                    # log entries, sorted by the timestamp
-        self.backlog = []                   # all events for all levels
+        self.capacity = capacity            # most entries kept by each log
+        self.logFile = logFile              # LogFile holding the entries, None to keep them in memory
+
+        # each level has a view of its own with the entries it displays, which
+        # is kept up to date as entries are logged so changing the level only
+        # switches views
+        self.views = dict([(l, self._createStore()) for l in LogLevels.values()])
+        self._viewsByLevel = {}             # level -> views its entries belong to
+        for l in LogLevels.values():
+            self._viewsByLevel[l] = [self.views[v] for v in LogLevels.values() if LogLevels.indexOf(l) <= LogLevels.indexOf(v)]
+
+        # all events for all levels, and the log entries displayed (newest first)
+        self.backlog = self.views[LogLevels.values()[-1]]
+        self.msgLog = self.views[level]
         self.level = level                  # events we display
         self.lastContentHeight = 0          # height of the rendered content when last drawn
         self.scroll = 0
@@ -95,26 +345,46 @@ class LogPanel(Panel, threading.Thread):
         self.valsLock = threading.RLock()
 
         # cached parameters (invalidated if arguments for them change)
-        # last set of events we've drawn with
-        self._lastLoggedEvents = []
+        # revision of the message log we've last drawn
+        self._lastLoggedRevision = -1
+        # line heights of each view's entries, for the width we last drew with
+        self._heightIndexKey = None
+        self._heightIndices = {}
+        # log we last drew, either a view or the matches of the search in it
+        self._displayedLog = self.msgLog
+
+        # search of the log, the selected match and whether only matches are
+        # shown. every view keeps an index of its matches while it's searched.
+        self._searchPattern = None          # compiled regular expression
+        self._searchIndices = {}            # view -> SearchIndex of the pattern
+        self._searchMatch = None            # sequence number of the selected match
+        self.isFiltered = False
+
+        # SnapshotWriter of the last snapshot, saved in the background
+        self._snapshotWriter = None
 
         # leaving lastContentHeight as being too low causes initialization problems
         self.lastContentHeight = len(self.msgLog)
 
-    def repopulate(self):
+    def _createStore(self):
         """
-        Clears the event log and repopulates it from the backlog.
+        Provides a new, empty store for log entries.
         """
 
-        self.valsLock.acquire()
+        if self.logFile is None: return LogStore(self.capacity, getEntryMeasure)
+        return DiskLogStore(self.logFile, encodeLogEntry, decodeLogEntry, self.capacity, getEntryMeasure)
 
-        # clears the event log
-        self.msgLog = []
+    def repopulate(self):
+        """
+        Switches the event log to the view of the current level.
+        """
 
-        # refill from the master backlog if the level is correct
-        for entry in self.backlog:
-            if LogLevels.indexOf(entry.level) <= LogLevels.indexOf(self.level): self.msgLog.append(entry)
+        self.valsLock.acquire()
+        self.msgLog = self.views[self.level]
 
+        # sequence numbers are the view's own, so the selected match doesn't
+        # carry over
+        self._searchMatch = None
         self.valsLock.release()
 
     def _log(self, message, level):
@@ -126,19 +396,33 @@ class LogPanel(Panel, threading.Thread):
           message = message to log
         """
 
+        self._logLines([message], level)
+
+    def _logLines(self, messages, level):
+        """
+        Notes several messages at once, taking the lock and waking the display
+        only once for all of them.
+
+        Arguments:
+          level    - log level for these log entries
+          messages - messages to log, oldest first
+        """
+
         if not level in LogLevels.values() or not level in LogColors: return
+        if not messages: return
 
         # strips control characters to avoid screwing up the terminal
-        entry = LogEntry(time.time(), level, getPrintable(message), LogColors[level])
+        now = time.time()
+        entries = [LogEntry(now, level, getPrintable(message), LogColors[level]) for message in messages]
 
         self.valsLock.acquire()
 
-        # always into the backlog
-        self.backlog.insert(0, entry)
+        # into the view of every level that displays them, which always
+        # includes the backlog
+        for view in self._viewsByLevel[level]: view.extend(entries)
 
-        # only in the actual log based on the level
-        if LogLevels.indexOf(entry.level) <= LogLevels.indexOf(self.level):
-            self.msgLog.insert(0, entry)
+        # only redraw if the current level displays them
+        if self.msgLog in self._viewsByLevel[level]:
 
             # notifies the display that it has new content
             self._cond.acquire()
@@ -156,6 +440,9 @@ class LogPanel(Panel, threading.Thread):
     def debug(self, message):
         self._log(message, LogLevels.DEBUG)
         
+    def debugLines(self, messages):
+        self._logLines(messages, LogLevels.DEBUG)
+        
     def setLevel(self, level):
         """
         Sets the event types recognized by the panel.
@@ -172,7 +459,7 @@ class LogPanel(Panel, threading.Thread):
 
         self.debug("set new log level '%s'" % (level))
 
-        # must release valsLock for repopulate
+        # must release valsLock for repopulate, which just switches views
         self.repopulate()
 
         self.valsLock.acquire()
@@ -227,16 +514,23 @@ class LogPanel(Panel, threading.Thread):
         """
         Lets user enter a path to take a snapshot, canceling if left blank.
         """
+
+        if self.isSavingSnapshot():
+            self.popupManager.showMsg("Still saving the last log snapshot", 2)
+            return
+
         id = strftime("%Y%m%d%H%M%S", gmtime())
         suggestion = os.path.abspath(os.path.expanduser("~/shadow-cli." + id + ".log"))
-        pathInput = self.popupManager.inputPopup("Path to save log snapshot: ", initialValue=suggestion)
+        pathInput = self.popupManager.inputPopup("Path to save log snapshot (.gz or .zst to compress): ", initialValue=suggestion)
 
         if pathInput:
             try:
                 self.saveSnapshot(pathInput)
-                self.popupManager.showMsg("Saved log as: %s" % pathInput, 2)
+                self.popupManager.showMsg("Saving log as: %s" % pathInput, 2)
             except IOError, exc:
                 self.popupManager.showMsg("Unable to save snapshot: %s" % getFileErrorMsg(exc), 2)
+            except ValueError, exc:
+                self.popupManager.showMsg("Unable to save snapshot: %s" % exc, 2)
 
     def clear(self):
         """
@@ -244,38 +538,53 @@ class LogPanel(Panel, threading.Thread):
         """
 
         self.valsLock.acquire()
-        self.msgLog = []
+        for view in self.views.values(): view.clear()
         self.redraw(True)
         self.valsLock.release()
 
     def saveSnapshot(self, path):
         """
-        Saves the log events currently being displayed to the given path.This
-        overwrites the file if it already exists, and raises an IOError if
-        there's a problem.
+        Starts saving the log events currently being displayed to the given
+        path, oldest first, providing the SnapshotWriter doing so. This
+        overwrites the file if it already exists, and raises an IOError if it
+        can't be created, a ValueError if its compression isn't available or
+        another snapshot is still being saved.
 
         Arguments:
           path - path where to save the log snapshot
         """
 
+        if self.isSavingSnapshot(): raise ValueError("another snapshot is still being saved")
+
         # make dir if the path doesn't already exist
         baseDir = os.path.dirname(path)
         if not os.path.exists(baseDir): os.makedirs(baseDir)
 
-        snapshotFile = open(path, "w")
         self.valsLock.acquire()
-        try:
-            # we want to save the log top-down instead of bottom-up like its displayed
-            i = len(self.msgLog) - 1
-            while i >= 0:
-                entry = self.msgLog[i]
-                snapshotFile.write(entry.getDisplayMessage(True) + "\n")
-                i -= 1
+        try: writer = SnapshotWriter(path, self.msgLog, self.valsLock, self)
+        finally: self.valsLock.release()
 
-            self.valsLock.release()
-        except Exception, exc:
-            self.valsLock.release()
-            raise exc
+        self._snapshotWriter = writer
+        writer.start()
+        return writer
+
+    def isSavingSnapshot(self):
+        """
+        True if a snapshot is being saved, False otherwise.
+        """
+
+        writer = self._snapshotWriter
+        return writer is not None and writer.isAlive()
+
+    def getSnapshotLabel(self):
+        """
+        Provides a toolbar label with the progress of the snapshot being saved,
+        None if there isn't one.
+        """
+
+        writer = self._snapshotWriter
+        if writer is None or not writer.isAlive(): return None
+        return "saving snapshot %i%%" % int(100 * writer.getProgress())
 
     def handleKey(self, key):
         isKeystrokeConsumed = True
@@ -296,6 +605,15 @@ class LogPanel(Panel, threading.Thread):
             self.showLevelSelectionPrompt()
         elif key == ord('s') or key == ord('S'):
             self.showSnapshotPrompt()
+        elif key == ord('/'):
+            self.showSearchPrompt()
+        elif key == ord('n') or key == ord('N'):
+            # n goes down the log to older matches, N up to newer ones
+            if self._searchPattern is None: self.popupManager.showMsg("No search, press / to search the log", 2)
+            elif not self.selectMatch(key == ord('n')): self.popupManager.showMsg("No more matches", 2)
+        elif key == ord('f') or key == ord('F'):
+            if self._searchPattern is None: self.popupManager.showMsg("No search, press / to search the log", 2)
+            else: self.setFiltered(not self.isFiltered)
         else: isKeystrokeConsumed = False
 
         return isKeystrokeConsumed
@@ -307,8 +625,138 @@ class LogPanel(Panel, threading.Thread):
         options.append(("c", "clear log", None))
         options.append(("l", "change log level displayed", None))
         options.append(("s", "save log snapshot", None))
+        options.append(("/", "search log", None))
+        options.append(("n / N", "next (older) / previous search match", None))
+        options.append(("f", "only show search matches", "on" if self.isFiltered else "off"))
         return options
 
+    def showSearchPrompt(self):
+        """
+        Lets user enter a regular expression to search the log for, clearing the
+        search if left blank.
+        """
+
+        initialValue = self._searchPattern.pattern if self._searchPattern is not None else ""
+        patternInput = self.popupManager.inputPopup("Search (regular expression): ", initialValue=initialValue)
+        if patternInput is None: return
+
+        try: self.setSearch(patternInput)
+        except re.error, exc: self.popupManager.showMsg("Invalid search pattern: %s" % exc, 2)
+
+    def setSearch(self, pattern):
+        """
+        Searches the log for the given regular expression, raising a re.error if
+        it's invalid. Entries are matched once, as they're logged.
+
+        Arguments:
+          pattern - regular expression searched for, no search if empty
+        """
+
+        compiled = re.compile(pattern) if pattern else None
+
+        self.valsLock.acquire()
+        self._searchPattern = compiled
+        self._searchIndices = {}
+        self._searchMatch = None
+        if compiled is None: self.isFiltered = False
+        self.redraw(True)
+        self.valsLock.release()
+
+    def setFiltered(self, isFiltered):
+        """
+        Sets if only the matches of the search are shown, keeping the selected
+        match in view.
+
+        Arguments:
+          isFiltered - only shows matches if True
+        """
+
+        self.valsLock.acquire()
+        self.isFiltered = isFiltered and self._searchPattern is not None
+        self.scroll = 0
+        if self._searchMatch is not None: self._scrollToMatch(self.getAttr("msgLog"))
+        self.redraw(True)
+        self.valsLock.release()
+
+    def selectMatch(self, isOlder):
+        """
+        Selects the next match of the search and scrolls to it, returning False
+        if there's no further match. Without a selected match this starts from
+        the top of the screen.
+
+        Arguments:
+          isOlder - selects the next older match if True, the next newer one
+                    otherwise
+        """
+
+        self.valsLock.acquire()
+        try:
+            log = self.getAttr("msgLog")
+            searchIndex = self._getSearchIndex(log)
+            if searchIndex is None: return False
+
+            current = self._searchMatch
+            if current is not None and current < log.total - len(log): current = None
+            if current is None:
+                # the entry at the top of the screen counts as the next match
+                displayed, heightIndex = self._displayedLog, self._heightIndices.get(self._displayedLog)
+                if heightIndex is not None and heightIndex.find(self.scroll) < len(displayed):
+                    top = displayed.getSequence(heightIndex.find(self.scroll))
+                    current = top + 1 if isOlder else top - 1
+                else: current = log.total if isOlder else -1
+
+            match = searchIndex.getMatchBefore(current) if isOlder else searchIndex.getMatchAfter(current)
+            if match is None: return False
+            self._searchMatch = match
+            self._scrollToMatch(log)
+            self.redraw(True)
+            return True
+        finally:
+            self.valsLock.release()
+
+    def _scrollToMatch(self, log):
+        """
+        Scrolls so the selected match is at the top of the screen. This must be
+        called while holding valsLock.
+        """
+
+        # the match may have been dropped from the log since it was selected, in
+        # which case the oldest match that's left takes its place
+        oldest = log.total - len(log)
+        if self._searchMatch is not None and self._searchMatch < oldest:
+            searchIndex = self._getSearchIndex(log)
+            self._searchMatch = searchIndex.getMatchAfter(oldest - 1) if searchIndex is not None else None
+
+        if self._searchMatch is None or self._heightIndexKey is None: return
+        displayed = self._getSearchIndex(log) if self.isFiltered else log
+        heightIndex = self._getHeightIndex(displayed, *self._heightIndexKey)
+        self.scroll = heightIndex.getTop(displayed.getIndex(self._searchMatch))
+
+    def _getSearchIndex(self, log):
+        """
+        Provides the up to date SearchIndex of the given log, None if there's no
+        search. This must be called while holding valsLock.
+        """
+
+        if self._searchPattern is None: return None
+
+        # forget indices of logs we no longer draw, like an old pause buffer
+        for l in self._searchIndices.keys():
+            if l is not log and not self._isView(l): del self._searchIndices[l]
+
+        if log not in self._searchIndices:
+            self._searchIndices[log] = SearchIndex(log, self._searchPattern, lambda entry: entry.msg)
+        index = self._searchIndices[log]
+        index.update()
+        return index
+
+    def _isView(self, log):
+        """
+        True if the given log is one of the level views.
+        """
+
+        return bool([v for v in self.views.values() if v is log])
+
     def draw(self, width, height):
         """
         Redraws message log. Entries stretch to use available space and may
@@ -319,7 +767,7 @@ class LogPanel(Panel, threading.Thread):
 
         # we will be messing with the backlog
         self.valsLock.acquire()
-        self._lastLoggedEvents, self._lastUpdate = list(currentLog), time.time()
+        self._lastLoggedRevision, self._lastUpdate = self.msgLog.revision, time.time()
 
         # draws the top label
         if self.isTitleVisible():
@@ -335,52 +783,34 @@ class LogPanel(Panel, threading.Thread):
             msgIndent = 3
             self.addScrollBar(self.scroll, self.scroll + height - 1, self.lastContentHeight, 1)
 
-        # draws log entries
-        lineCount = 1 - self.scroll
-
-        for entry in currentLog:
-            # entry contents to be displayed, tuples of the form:
-            # (msg, formatting, includeLinebreak)
-            displayQueue = []
-
-            msgComp = entry.getDisplayMessage().split("\n")
-            for i in range(len(msgComp)):
-                font = curses.A_BOLD if entry.level is LogLevels.ERROR else curses.A_NORMAL # emphasizes ERR messages
-                displayQueue.append((msgComp[i].strip(), font | getColor(entry.color), i != len(msgComp) - 1))
-
-            cursorLoc, lineOffset = msgIndent, 0
-            maxEntriesPerLine = 2
-            while displayQueue:
-                msg, format, includeBreak = displayQueue.pop(0)
+        # when filtering, the matches of the search are drawn just like a view
+        searchIndex = self._getSearchIndex(currentLog)
+        if self.isFiltered and searchIndex is not None: currentLog = searchIndex
+        self._displayedLog = currentLog
+
+        # draws only the log entries on screen, starting with the one at the
+        # scroll position
+        heightIndex = self._getHeightIndex(currentLog, width, msgIndent)
+        entryIndex = heightIndex.find(self.scroll)
+        if entryIndex < len(currentLog): lineCount = 1 + heightIndex.getTop(entryIndex) - self.scroll
+
+        while entryIndex < len(currentLog) and lineCount < height:
+            pieces, entryHeight = self._getEntryLayout(currentLog[entryIndex], width, msgIndent)
+            # highlights the selected match
+            isSelected = self._searchMatch is not None and currentLog.getSequence(entryIndex) == self._searchMatch
+            for lineOffset, cursorLoc, msg, format in pieces:
                 drawLine = lineCount + lineOffset
-                if lineOffset == maxEntriesPerLine: break
-
-                maxMsgSize = width - cursorLoc - 1
-                if len(msg) > maxMsgSize:
-                # message is too long - break it up
-                    if lineOffset == maxEntriesPerLine - 1:
-                        msg = cropStr(msg, maxMsgSize)
-                    else:
-                        msg, remainder = cropStr(msg, maxMsgSize, 4, 4, Ending.HYPHEN, True)
-                        displayQueue.insert(0, (remainder.strip(), format, includeBreak))
-
-                    includeBreak = True
-
+                if isSelected: format |= curses.A_REVERSE
                 if drawLine < height and drawLine >= 1:
                     self.addstr(drawLine, cursorLoc, msg, format)
 
-                cursorLoc += len(msg)
-
-                if includeBreak or not displayQueue:
-                    lineOffset += 1
-                    cursorLoc = msgIndent + ENTRY_INDENT
-
-            lineCount += lineOffset
+            lineCount += entryHeight
+            entryIndex += 1
 
         # redraw the display if...
         # - lastContentHeight was off by too much
         # - we're off the bottom of the page
-        newContentHeight = lineCount + self.scroll - 1
+        newContentHeight = heightIndex.getTotal()
         contentHeightDelta = abs(self.lastContentHeight - newContentHeight)
         forceRedraw, forceRedrawReason = True, ""
 
@@ -403,6 +833,84 @@ class LogPanel(Panel, threading.Thread):
         # done modifying list
         self.valsLock.release()
 
+    def _getEntryLayout(self, entry, width, msgIndent):
+        """
+        Provides how an entry is drawn, as a tuple of its pieces and the number
+        of lines it takes. Pieces are tuples of the form...
+          (line offset, column, message, formatting)
+
+        Arguments:
+          entry     - log entry to be drawn
+          width     - width of the panel
+          msgIndent - column entries start at
+        """
+
+        # entry contents to be displayed, tuples of the form:
+        # (msg, formatting, includeLinebreak)
+        displayQueue = []
+        pieces = []
+
+        msgComp = entry.getDisplayMessage().split("\n")
+        for i in range(len(msgComp)):
+            font = curses.A_BOLD if entry.level is LogLevels.ERROR else curses.A_NORMAL # emphasizes ERR messages
+            displayQueue.append((msgComp[i].strip(), font | getColor(entry.color), i != len(msgComp) - 1))
+
+        cursorLoc, lineOffset = msgIndent, 0
+        maxEntriesPerLine = 2
+        while displayQueue:
+            msg, format, includeBreak = displayQueue.pop(0)
+            if lineOffset == maxEntriesPerLine: break
+
+            maxMsgSize = width - cursorLoc - 1
+            if len(msg) > maxMsgSize:
+            # message is too long - break it up
+                if lineOffset == maxEntriesPerLine - 1:
+                    msg = cropStr(msg, maxMsgSize)
+                else:
+                    msg, remainder = cropStr(msg, maxMsgSize, 4, 4, Ending.HYPHEN, True)
+                    displayQueue.insert(0, (remainder.strip(), format, includeBreak))
+
+                includeBreak = True
+
+            pieces.append((lineOffset, cursorLoc, msg, format))
+            cursorLoc += len(msg)
+
+            if includeBreak or not displayQueue:
+                lineOffset += 1
+                cursorLoc = msgIndent + ENTRY_INDENT
+
+        return (pieces, lineOffset)
+
+    def _getEntryHeight(self, measure, width, msgIndent):
+        """
+        Provides the number of lines _getEntryLayout() draws an entry with,
+        from its getEntryMeasure(). Entries take a second line if their message
+        has several lines or doesn't fit on the first, and are cropped to those
+        two lines.
+        """
+
+        return 1 if 0 <= measure <= width - msgIndent - 1 else 2
+
+    def _getHeightIndex(self, log, width, msgIndent):
+        """
+        Provides the up to date HeightIndex of the given log for this width.
+        Indices are kept for every view, and dropped when the width changes.
+        """
+
+        key = (width, msgIndent)
+        if key != self._heightIndexKey: self._heightIndexKey, self._heightIndices = key, {}
+
+        # forget indices of logs we no longer draw, like an old pause buffer
+        for l in self._heightIndices.keys():
+            if l is not log and not self._isView(l) and not [s for s in self._searchIndices.values() if s is l]:
+                del self._heightIndices[l]
+
+        if log not in self._heightIndices:
+            self._heightIndices[log] = HeightIndex(log, lambda measure: self._getEntryHeight(measure, width, msgIndent))
+        index = self._heightIndices[log]
+        index.update()
+        return index
+
     def redraw(self, forceRedraw=False, block=False):
         # determines if the content needs to be redrawn or not
         Panel.redraw(self, forceRedraw, block)
@@ -419,7 +927,7 @@ class LogPanel(Panel, threading.Thread):
             maxLogUpdateRate = 1.0
 
             sleepTime = 0
-            if (self.msgLog == self._lastLoggedEvents) or self.isPaused():
+            if (self.msgLog.revision == self._lastLoggedRevision) or self.isPaused():
                 sleepTime = 5
             elif timeSinceReset < maxLogUpdateRate:
                 sleepTime = max(0.05, maxLogUpdateRate - timeSinceReset)
@@ -461,7 +969,15 @@ class LogPanel(Panel, threading.Thread):
         # usually the attributes used to make the label are decently static, so
         # provide cached results if they're unchanged
         self.valsLock.acquire()
-        titleLabel = "Log (%s level)" % str(self.level)
+        attributes = ["%s level" % str(self.level)]
+        # older entries no longer fit in the log
+        if self.msgLog.dropped: attributes.append("%i dropped" % self.msgLog.dropped)
+        if self._searchPattern is not None:
+            label = "filter" if self.isFiltered else "search"
+            attributes.append("%s: %s" % (label, cropStr(self._searchPattern.pattern, SEARCH_TITLE_WIDTH)))
+            searchIndex = self._searchIndices.get(self.msgLog)
+            if searchIndex is not None: attributes.append("%i matches" % len(searchIndex))
+        titleLabel = "Log (%s)" % ", ".join(attributes)
         self.valsLock.release()
 
         return titleLabel
@@ -0,0 +1,599 @@
+"""
+Storage for the entries of the log panel. Entries are kept in a ring buffer of
+fixed capacity, so logging is constant time and a long, noisy setup can't grow
+the log without bound. Once full, every new entry replaces the oldest one.
+
+Drawing the log only looks at the entries on screen, which are found through
+prefix sums of the number of lines each entry takes (HeightIndex). Those are
+worked out from a small measure of each entry (see getMeasure()), so the sums
+can be redone for a new width without touching the entries themselves. Searches
+keep the sequence numbers of the matching entries (SearchIndex), which also
+serves as a view of the log with only the matches.
+
+For very long logs the entries can be kept on disk instead (DiskLogStore).
+They're appended to a LogFile as they would appear in a snapshot, memory only
+holds the offset, length, timestamp and measure of each entry, and the entries
+being drawn are read back through mmap.
+"""
+
+import os
+import mmap
+import array
+import bisect
+
+# default number of entries kept by the log
+DEFAULT_LOG_CAPACITY = 100000
+
+class LogStore():
+    """
+    Ring buffer of log entries. Indexing and iteration go from the newest entry
+    to the oldest, the order the log is displayed in. This isn't thread safe,
+    callers are expected to hold their own lock.
+    """
+
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY, measure=None):
+        """
+        Creates an empty store.
+
+        Arguments:
+          capacity - most entries that are kept
+          measure  - function providing the measure of an entry, see
+                     getMeasure()
+        """
+
+        self.capacity = max(1, capacity)
+        self.measure = measure
+        self.dropped = 0                    # entries pushed out by newer ones
+        self.revision = 0                   # incremented on every change
+        self.total = 0                      # entries ever added, never reset
+        self._entries = []                  # ring of entries, oldest at _start
+        self._start = 0
+
+    def append(self, entry):
+        """
+        Adds an entry, dropping the oldest one if the store is full.
+
+        Arguments:
+          entry - entry to be added
+        """
+
+        if len(self._entries) < self.capacity:
+            self._entries.append(entry)
+        else:
+            self._entries[self._start] = entry
+            self._start = (self._start + 1) % self.capacity
+            self.dropped += 1
+        self.total += 1
+        self.revision += 1
+
+    def extend(self, entries):
+        """
+        Adds several entries, oldest first.
+
+        Arguments:
+          entries - entries to be added
+        """
+
+        for entry in entries: self.append(entry)
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+
+        self._entries, self._start = [], 0
+        self.dropped = 0
+        self.revision += 1
+
+    def getSequence(self, index):
+        """
+        Provides the sequence number of an entry, the store's total when it was
+        added.
+
+        Arguments:
+          index - index of the entry (0 being the newest)
+        """
+
+        return self.total - 1 - index
+
+    def getIndex(self, seq):
+        """
+        Provides the index of the entry with the given sequence number.
+
+        Arguments:
+          seq - sequence number of the entry
+        """
+
+        return self.total - 1 - seq
+
+    def getEntries(self, start, end):
+        """
+        Provides the entries with sequence numbers in the given range, oldest
+        first. The range must only include entries that are still kept.
+
+        Arguments:
+          start - sequence number of the first entry
+          end   - sequence number after the last entry
+        """
+
+        return [self[self.total - 1 - seq] for seq in xrange(start, end)]
+
+    def getMeasure(self, index):
+        """
+        Provides the measure of an entry, an integer its height is worked out
+        from (for instance the length of its message), zero if the store has
+        no measure function.
+
+        Arguments:
+          index - index of the entry (0 being the newest)
+        """
+
+        return self.measure(self[index]) if self.measure else 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        # index 0 is the newest entry
+        size = len(self._entries)
+        if index < 0: index += size
+        if index < 0 or index >= size: raise IndexError("log index out of range")
+        return self._entries[(self._start + size - 1 - index) % size]
+
+    def __iter__(self):
+        # newest first
+        size = len(self._entries)
+        for i in xrange(size): yield self._entries[(self._start + size - 1 - i) % size]
+
+    def __reversed__(self):
+        # oldest first
+        size = len(self._entries)
+        for i in xrange(size): yield self._entries[(self._start + i) % size]
+
+    def __copy__(self):
+        # the panel's pause buffer needs a snapshot that later entries don't change
+        store = LogStore(self.capacity, self.measure)
+        store.dropped, store.revision, store.total = self.dropped, self.revision, self.total
+        store._entries, store._start = list(self._entries), self._start
+        return store
+
+class LogFile():
+    """
+    Append-only file holding the entries of the disk-backed stores of all log
+    levels, each entry written once no matter how many stores include it. This
+    isn't thread safe, callers are expected to hold their own lock.
+    """
+
+    def __init__(self, path):
+        """
+        Creates a new log file at the given path, replacing any existing one.
+        This raises an IOError or OSError if it can't be created.
+
+        Arguments:
+          path - location of the log file
+        """
+
+        self.path = os.path.abspath(path)
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory): os.makedirs(directory)
+
+        self._file = open(self.path, "w+b")
+        self._size = 0
+        self._map = None                    # read-only mapping of the file
+        self._mapSize = 0
+
+    def append(self, data):
+        """
+        Adds data to the end of the file, providing its offset.
+
+        Arguments:
+          data - bytes to be written
+        """
+
+        offset = self._size
+        self._file.write(data)
+        self._size += len(data)
+        return offset
+
+    def read(self, offset, length):
+        """
+        Provides the bytes at the given offset.
+
+        Arguments:
+          offset - position in the file
+          length - number of bytes read
+        """
+
+        if offset + length > self._mapSize:
+            # the mapping only covers the file's size when it was made
+            self._file.flush()
+            if self._map is not None: self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+            self._mapSize = self._size
+        return self._map[offset:offset + length]
+
+    def close(self):
+        if self._map is not None: self._map.close()
+        self._map, self._mapSize = None, 0
+        self._file.close()
+
+class DiskLogStore():
+    """
+    LogStore with its entries in a LogFile, holding just the offset, length,
+    timestamp and measure of each entry in memory. Entries are converted to and
+    from the bytes in the file with the given functions, and every access to an
+    entry reads it back from the file. Measures are kept so heights can be
+    worked out without reading any entries. Indexing and iteration go from the newest entry to the
+    oldest. This isn't thread safe, callers are expected to hold their own lock.
+    """
+
+    def __init__(self, logFile, encode, decode, capacity=DEFAULT_LOG_CAPACITY, measure=None):
+        """
+        Creates an empty store.
+
+        Arguments:
+          logFile  - LogFile the entries are written to
+          encode   - function providing the bytes of an entry
+          decode   - function providing the entry of the given bytes and
+                     timestamp
+          capacity - most entries that are kept
+          measure  - function providing the measure of an entry, see
+                     LogStore.getMeasure()
+        """
+
+        self.logFile = logFile
+        self.encode = encode
+        self.decode = decode
+        self.capacity = max(1, capacity)
+        self.measure = measure
+        self.dropped = 0                    # entries pushed out by newer ones
+        self.revision = 0                   # incremented on every change
+        self.total = 0                      # entries ever added, never reset
+        self._offsets = array.array("L")    # file offset of each entry, oldest first
+        self._lengths = array.array("L")
+        self._timestamps = array.array("d")
+        self._measures = array.array("l")
+        self._first = 0                     # index of the oldest entry still kept
+
+    def append(self, entry):
+        """
+        Adds an entry, dropping the oldest one if the store is full. The entry
+        is written to the log file unless another store already did.
+
+        Arguments:
+          entry - entry to be added
+        """
+
+        if entry._fileRecord is None or entry._fileRecord[0] is not self.logFile:
+            data = self.encode(entry)
+            entry._fileRecord = (self.logFile, self.logFile.append(data), len(data))
+        _, offset, length = entry._fileRecord
+
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        self._timestamps.append(entry.timestamp)
+        self._measures.append(self.measure(entry) if self.measure else 0)
+        if len(self) > self.capacity:
+            self._first += 1
+            self.dropped += 1
+
+            # trimming once half of the index is stale keeps this amortized constant
+            if self._first > len(self._offsets) / 2:
+                for values in (self._offsets, self._lengths, self._timestamps, self._measures):
+                    del values[:self._first]
+                self._first = 0
+        self.total += 1
+        self.revision += 1
+
+    def extend(self, entries):
+        """
+        Adds several entries, oldest first.
+
+        Arguments:
+          entries - entries to be added
+        """
+
+        for entry in entries: self.append(entry)
+
+    def clear(self):
+        """
+        Removes all entries. They stay in the log file, which is only appended to.
+        """
+
+        self._offsets, self._lengths = array.array("L"), array.array("L")
+        self._timestamps, self._measures = array.array("d"), array.array("l")
+        self._first = 0
+        self.dropped = 0
+        self.revision += 1
+
+    def readRange(self, start, end):
+        """
+        Provides the bytes of the entries with sequence numbers in the given
+        range as they're stored, oldest first. Entries that are next to each
+        other in the log file are read in one go. The range must only include
+        entries that are still kept.
+
+        Arguments:
+          start - sequence number of the first entry
+          end   - sequence number after the last entry
+        """
+
+        chunks, chunkStart, chunkEnd = [], None, None
+        base = len(self._offsets) - self.total
+        for i in xrange(base + start, base + end):
+            offset, length = self._offsets[i], self._lengths[i]
+            if offset != chunkEnd:
+                if chunkStart is not None: chunks.append(self.logFile.read(chunkStart, chunkEnd - chunkStart))
+                chunkStart = offset
+            chunkEnd = offset + length
+        if chunkStart is not None: chunks.append(self.logFile.read(chunkStart, chunkEnd - chunkStart))
+        return "".join(chunks)
+
+    def getSequence(self, index):
+        """
+        Provides the sequence number of an entry, the store's total when it was
+        added.
+
+        Arguments:
+          index - index of the entry (0 being the newest)
+        """
+
+        return self.total - 1 - index
+
+    def getIndex(self, seq):
+        """
+        Provides the index of the entry with the given sequence number.
+
+        Arguments:
+          seq - sequence number of the entry
+        """
+
+        return self.total - 1 - seq
+
+    def getMeasure(self, index):
+        """
+        Provides the measure of an entry, see LogStore.getMeasure().
+
+        Arguments:
+          index - index of the entry (0 being the newest)
+        """
+
+        if index < 0 or index >= len(self): raise IndexError("log index out of range")
+        return self._measures[len(self._offsets) - 1 - index]
+
+    def __len__(self):
+        return len(self._offsets) - self._first
+
+    def __getitem__(self, index):
+        # index 0 is the newest entry
+        size = len(self)
+        if index < 0: index += size
+        if index < 0 or index >= size: raise IndexError("log index out of range")
+        i = len(self._offsets) - 1 - index
+        entry = self.decode(self.logFile.read(self._offsets[i], self._lengths[i]), self._timestamps[i])
+        entry._fileRecord = (self.logFile, self._offsets[i], self._lengths[i])
+        return entry
+
+    def __iter__(self):
+        # newest first
+        for i in xrange(len(self)): yield self[i]
+
+    def __reversed__(self):
+        # oldest first
+        for i in xrange(len(self) - 1, -1, -1): yield self[i]
+
+    def __copy__(self):
+        # the panel's pause buffer needs a snapshot that later entries don't
+        # change, the log file itself is only ever appended to
+        store = DiskLogStore(self.logFile, self.encode, self.decode, self.capacity, self.measure)
+        store.dropped, store.revision, store.total = self.dropped, self.revision, self.total
+        store._offsets, store._lengths = self._offsets[self._first:], self._lengths[self._first:]
+        store._timestamps, store._measures = self._timestamps[self._first:], self._measures[self._first:]
+        return store
+
+class HeightIndex():
+    """
+    Prefix sums of the number of lines the entries of a LogStore take when
+    drawn. Every entry is identified by its sequence number (the value of the
+    store's total when it was added), and the sums are kept oldest first so
+    new entries only append to them. This lets the panel find the entry at a
+    scroll position by bisection and compute the height of the whole log in
+    constant time. Heights are only computed for entries added since the last
+    update(), and from the measures of the entries rather than the entries
+    themselves.
+    """
+
+    def __init__(self, store, getHeight):
+        """
+        Creates an index of the given store.
+
+        Arguments:
+          store     - LogStore being indexed
+          getHeight - function providing the number of lines an entry takes
+                      from its measure
+        """
+
+        self.store = store
+        self.getHeight = getHeight
+        self._oldest = store.total - len(store) # oldest sequence number in the store
+        self._base = self._oldest           # sequence number of _sums[0]
+        self._sums = [0]                    # lines taken by entries before _base + i
+
+    def update(self):
+        """
+        Adds the entries logged since the last update and forgets the ones the
+        store dropped.
+        """
+
+        store = self.store
+        oldest = store.total - len(store)
+
+        # entries dropped before we ever indexed them start the sums over
+        if oldest > self._base + len(self._sums) - 1:
+            self._base, self._sums = oldest, [0]
+
+        for seq in xrange(self._base + len(self._sums) - 1, store.total):
+            self._sums.append(self._sums[-1] + self.getHeight(store.getMeasure(store.total - 1 - seq)))
+        self._oldest = oldest
+
+        # trimming once half of the sums are stale keeps this amortized constant
+        stale = oldest - self._base
+        if stale > len(self._sums) / 2:
+            del self._sums[:stale]
+            self._base = oldest
+
+    def getTotal(self):
+        """
+        Provides the number of lines taken by all of the store's entries.
+        """
+
+        return self._sums[-1] - self._sums[self._oldest - self._base]
+
+    def getTop(self, index):
+        """
+        Provides the line an entry starts on, counting from the newest entry.
+
+        Arguments:
+          index - index of the entry in the store (0 being the newest)
+        """
+
+        seq = self.store.total - 1 - index
+        return self._sums[-1] - self._sums[seq + 1 - self._base]
+
+    def find(self, line):
+        """
+        Provides the index of the entry drawn on the given line, counting from
+        the newest entry. This is the number of entries if the line is past the
+        end of the log.
+
+        Arguments:
+          line - line of the log, 0 being the first line of the newest entry
+        """
+
+        if line >= self.getTotal(): return len(self.store)
+        lo = self._oldest - self._base
+        # the newest entry whose lines end after the given line
+        i = bisect.bisect_left(self._sums, self._sums[-1] - line, lo) - 1
+        return self.store.total - 1 - (self._base + max(i, lo))
+
+class SearchIndex():
+    """
+    Sequence numbers of the entries of a store that match a regular expression.
+    Entries are matched once, as they're added, so keeping up with the log
+    only costs matching its new entries. This is also a read-only view of the
+    store with only the matches, having the same interface for drawing (and
+    HeightIndex) as the store itself. Its own sequence numbers are the match
+    ordinals, while getSequence() and getIndex() go by the store's sequence
+    numbers.
+    """
+
+    def __init__(self, store, pattern, getText):
+        """
+        Creates an index of the store's entries matching the pattern.
+
+        Arguments:
+          store   - LogStore or DiskLogStore being searched
+          pattern - compiled regular expression
+          getText - function providing the text of an entry that's searched
+        """
+
+        self.store = store
+        self.pattern = pattern
+        self.getText = getText
+        self._matches = []                  # sequence numbers of matches, ascending
+        self._first = 0                     # index of the oldest match still in the store
+        self._trimmed = 0                   # matches removed from the front of _matches
+        self._next = store.total - len(store) # next sequence number to be matched
+        self.total = 0                      # matches ever found, as of the last update
+
+    def update(self):
+        """
+        Matches the entries added since the last update and forgets the ones
+        the store dropped.
+        """
+
+        store = self.store
+        oldest = store.total - len(store)
+        for seq in xrange(max(self._next, oldest), store.total):
+            if self.pattern.search(self.getText(store[store.total - 1 - seq])): self._matches.append(seq)
+        self._next = store.total
+        self._first = bisect.bisect_left(self._matches, oldest, self._first)
+
+        # trimming once half of the matches are stale keeps this amortized constant
+        if self._first > len(self._matches) / 2:
+            del self._matches[:self._first]
+            self._trimmed += self._first
+            self._first = 0
+        self.total = self._trimmed + len(self._matches)
+
+    def getMatchBefore(self, seq):
+        """
+        Provides the sequence number of the newest match older than the given
+        sequence number, None if there is none.
+
+        Arguments:
+          seq - store's sequence number to search from
+        """
+
+        i = bisect.bisect_left(self._matches, seq, self._first) - 1
+        return self._matches[i] if i >= self._first else None
+
+    def getMatchAfter(self, seq):
+        """
+        Provides the sequence number of the oldest match newer than the given
+        sequence number, None if there is none.
+
+        Arguments:
+          seq - store's sequence number to search from
+        """
+
+        i = bisect.bisect_right(self._matches, seq, self._first)
+        return self._matches[i] if i < len(self._matches) else None
+
+    def getSequence(self, index):
+        """
+        Provides the store's sequence number of a match.
+
+        Arguments:
+          index - index of the match (0 being the newest)
+        """
+
+        return self._matches[len(self._matches) - 1 - index]
+
+    def getIndex(self, seq):
+        """
+        Provides the index of the match with the given store's sequence number.
+
+        Arguments:
+          seq - store's sequence number of the match
+        """
+
+        return len(self._matches) - 1 - bisect.bisect_left(self._matches, seq, self._first)
+
+    def getMeasure(self, index):
+        """
+        Provides the measure of a match, see LogStore.getMeasure().
+
+        Arguments:
+          index - index of the match (0 being the newest)
+        """
+
+        return self.store.getMeasure(self.store.getIndex(self.getSequence(index)))
+
+    def __len__(self):
+        return len(self._matches) - self._first
+
+    def __getitem__(self, index):
+        # index 0 is the newest match
+        size = len(self)
+        if index < 0: index += size
+        if index < 0 or index >= size: raise IndexError("log index out of range")
+        return self.store[self.store.getIndex(self.getSequence(index))]
+
+    def __iter__(self):
+        # newest first
+        for i in xrange(len(self)): yield self[i]
+
+    def __reversed__(self):
+        # oldest first
+        for i in xrange(len(self) - 1, -1, -1): yield self[i]
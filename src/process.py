@@ -0,0 +1,164 @@
+"""
+Collects the output of the commands run by the setup steps. A single thread
+waits on the output pipes of all running commands at once with poll (select
+where poll isn't available), reads whatever is available in large chunks and
+hands the complete lines to each command's callback in batches, so a noisy
+build costs a log update per chunk rather than per line.
+"""
+
+import os
+import errno
+import select
+import threading
+
+# most bytes read from a pipe at once
+PUMP_READ_SIZE = 65536
+
+class OutputPump(threading.Thread):
+    """
+    Thread pumping the output of any number of pipes to their callbacks. The
+    thread is started along with the first pipe.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="output-pump")
+        self.setDaemon(True)
+
+        self._streams = {}                  # fd -> _PumpStream
+        self._lock = threading.Lock()       # guards _streams and starting the thread
+        self._isStarted = False
+
+        # written to whenever the pipes change, so poll wakes up and picks up
+        # the new set
+        self._wakeRead, self._wakeWrite = os.pipe()
+
+    def add(self, fileobj, callback):
+        """
+        Starts pumping the output of the given pipe. This provides an event that
+        is set once the end of the output is reached and all of it was handed to
+        the callback.
+
+        Arguments:
+          fileobj  - file (or file descriptor) of the read end of the pipe
+          callback - function taking a list of lines (without line endings),
+                     called from the pump's thread
+        """
+
+        stream = _PumpStream(_getFileDescriptor(fileobj), callback)
+
+        self._lock.acquire()
+        try:
+            self._streams[stream.fd] = stream
+            if not self._isStarted:
+                self._isStarted = True
+                self.start()
+        finally:
+            self._lock.release()
+
+        self._wake()
+        return stream.done
+
+    def remove(self, fileobj):
+        """
+        Stops pumping the output of the given pipe, for instance because the
+        command was killed while something else still holds the pipe open. Any
+        unfinished last line is handed to the callback.
+
+        Arguments:
+          fileobj - file (or file descriptor) given to add()
+        """
+
+        self._lock.acquire()
+        try: stream = self._streams.pop(_getFileDescriptor(fileobj), None)
+        finally: self._lock.release()
+
+        if stream is not None:
+            self._wake()
+            stream.close()
+
+    def run(self):
+        while True:
+            self._lock.acquire()
+            fds = list(self._streams)
+            self._lock.release()
+
+            for fd in self._wait([self._wakeRead] + fds):
+                if fd == self._wakeRead:
+                    os.read(self._wakeRead, PUMP_READ_SIZE)
+                    continue
+
+                self._lock.acquire()
+                stream = self._streams.get(fd)
+                self._lock.release()
+                # removed while we were waiting
+                if stream is None: continue
+
+                try: data = os.read(fd, PUMP_READ_SIZE)
+                except OSError, exc:
+                    if exc.errno in (errno.EINTR, errno.EAGAIN): continue
+                    data = ""
+
+                if data: stream.feed(data)
+                else:
+                    # end of the output, the pipe is done once it's unregistered
+                    self._lock.acquire()
+                    self._streams.pop(fd, None)
+                    self._lock.release()
+                    stream.close()
+
+    def _wait(self, fds):
+        """
+        Blocks until some of the given file descriptors are readable (or
+        closed), providing those.
+        """
+
+        try:
+            if hasattr(select, "poll"):
+                poller = select.poll()
+                # hangups and errors are always reported
+                for fd in fds: poller.register(fd, select.POLLIN | select.POLLPRI)
+                return [fd for fd, _ in poller.poll()]
+            return select.select(fds, [], [])[0]
+        except (select.error, OSError), exc:
+            if exc.args[0] == errno.EINTR: return []
+            raise
+
+    def _wake(self):
+        os.write(self._wakeWrite, "x")
+
+class _PumpStream():
+    """
+    Output of a single pipe, splitting the chunks read from it into lines.
+    """
+
+    def __init__(self, fd, callback):
+        self.fd = fd
+        self.callback = callback
+        self.done = threading.Event()
+        self._partial = ""                  # start of a line that isn't complete yet
+        self._lock = threading.Lock()
+
+    def feed(self, data):
+        self._lock.acquire()
+        try:
+            if self.done.isSet(): return
+            lines = (self._partial + data).split("\n")
+            self._partial = lines.pop()
+        finally:
+            self._lock.release()
+
+        if lines: self.callback([line.rstrip("\r") for line in lines])
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self.done.isSet(): return
+            partial, self._partial = self._partial, ""
+        finally:
+            self._lock.release()
+
+        if partial: self.callback([partial.rstrip("\r")])
+        self.done.set()
+
+def _getFileDescriptor(fileobj):
+    return fileobj if isinstance(fileobj, int) else fileobj.fileno()
@@ -0,0 +1,252 @@
+"""
+Runs the setup steps as a dependency graph. Each step is started on a pool of
+worker threads as soon as all of the steps it depends on have succeeded, so
+independent dependencies (openssl, libevent, glib, cmake, ...) are built at
+the same time. A shared job budget keeps the concurrently running builds
+from oversubscribing the machine.
+"""
+
+import os
+import threading
+
+# placeholder in setup commands that is replaced with the number of parallel
+# jobs the command may use (for instance "make -j<jobs>")
+JOBS_TAG = "<jobs>"
+
+# placeholder in setup commands that is replaced with the path of the pristine
+# source tree. Steps using it build out of tree in an empty build directory
+# (for instance "<source>/configure"), others build in a copy of the source.
+SOURCE_TAG = "<source>"
+
+class SetupStep():
+    """
+    Single node in the setup graph, having the following attributes:
+      name    - identifier of the step, referenced by other steps' dependencies
+      key     - option in the setup config section holding the archive's URL
+      cmdlist - commands that build and install the extracted archive
+      depends - names of the steps that must succeed before this one starts
+      outputs - glob patterns, relative to the install prefix, of files the
+                step installs
+    """
+
+    def __init__(self, name, key, cmdlist, depends=[], outputs=[]):
+        self.name = name
+        self.key = key
+        self.cmdlist = cmdlist
+        self.depends = list(depends)
+        self.outputs = list(outputs)
+
+class StepScheduler():
+    """
+    Worker pool that runs setup steps once their dependencies have finished.
+    Steps that are ready at the same time are started in the order they were
+    given. After any step fails no new steps are started, though steps that
+    are already running are allowed to finish.
+    """
+
+    def __init__(self, steps, runner, numWorkers, logger, isStopped=None):
+        """
+        Creates a scheduler for the given steps. Dependencies on steps that are
+        not part of the graph (for instance because they were disabled in the
+        config) are ignored.
+
+        Arguments:
+          steps      - ordered list of SetupStep instances
+          runner     - function taking a step and returning True on success
+          numWorkers - maximum number of steps that run concurrently
+          logger     - log panel used to report scheduling decisions
+          isStopped  - function returning True if no new steps should start
+        """
+
+        self.steps = list(steps)
+        self.runner = runner
+        self.numWorkers = max(1, numWorkers)
+        self.logger = logger
+        self.isStopped = isStopped
+
+        names = [step.name for step in self.steps]
+        self._waiting = {}                  # step name -> unfinished dependencies
+        for step in self.steps:
+            self._waiting[step.name] = set([d for d in step.depends if d in names])
+
+        self._pending = list(self.steps)    # steps that have not been started
+        self._running = 0                   # number of steps currently running
+        self._failed = False                # set once any step fails
+        self._cond = threading.Condition()  # guards all of the above
+
+    def run(self):
+        """
+        Runs all steps, blocking until they are finished or the scheduler gave up
+        on the remaining ones. This returns True if every step succeeded.
+        """
+
+        numThreads = min(self.numWorkers, len(self.steps))
+        self.logger.debug("running %i setup steps with %i workers" % (len(self.steps), numThreads))
+
+        workers = []
+        for i in range(numThreads):
+            t = threading.Thread(target=self._work, name="setup-worker-%i" % i)
+            t.setDaemon(True)
+            workers.append(t)
+            t.start()
+        for t in workers: t.join()
+
+        if not self._failed and self._pending:
+            names = ", ".join([step.name for step in self._pending])
+            if not self._isStopped(): self.logger.error("unable to resolve dependencies of setup steps: " + names)
+            return False
+        return not self._failed
+
+    def _isStopped(self):
+        return self.isStopped is not None and self.isStopped()
+
+    def _nextReadyStep(self):
+        """
+        Provides the first pending step without unfinished dependencies, None if
+        there is none. This must be called while holding the condition.
+        """
+
+        for step in self._pending:
+            if not self._waiting[step.name]: return step
+        return None
+
+    def _work(self):
+        while True:
+            self._cond.acquire()
+            try:
+                while True:
+                    if self._failed or self._isStopped(): return
+                    step = self._nextReadyStep()
+                    if step is not None: break
+                    # nothing left that could ever become ready
+                    if self._running == 0: return
+                    self._cond.wait()
+
+                self._pending.remove(step)
+                self._running += 1
+            finally:
+                self._cond.release()
+
+            self.logger.debug("starting setup step \'%s\'" % step.name)
+            success = False
+            try:
+                success = self.runner(step)
+            finally:
+                self.logger.debug("finished setup step \'%s\' (%s)" % (step.name, "succeeded" if success else "failed"))
+
+                self._cond.acquire()
+                self._running -= 1
+                if success:
+                    for waiting in self._waiting.values(): waiting.discard(step.name)
+                else:
+                    self._failed = True
+                self._cond.notifyAll()
+                self._cond.release()
+
+class JobBudget():
+    """
+    Global budget of parallel compile jobs (make -jN) shared between all of the
+    setup steps that are running at the same time. A command asks for jobs
+    right before it starts and gets a fair share of the budget, at least one
+    job, without ever pushing the total above the budget. The jobs that are
+    free get split between the running steps that don't hold any yet, so a
+    step running alone gets all of them, and jobs handed back by finished
+    commands go to the steps still wanting them.
+    """
+
+    def __init__(self, total):
+        """
+        Creates a budget with the given number of jobs.
+
+        Arguments:
+          total - number of compile jobs that may run at once
+        """
+
+        self.total = max(1, total)
+        self._free = self.total
+        self._clients = 0                   # steps currently sharing the budget
+        self._holders = 0                   # claims not yet handed back
+        self._cond = threading.Condition()
+
+    def getTotal(self):
+        """
+        Provides the number of jobs in the budget.
+        """
+
+        return self.total
+
+    def addClient(self):
+        """
+        Registers a step that shares the budget while it is running.
+        """
+
+        self._cond.acquire()
+        self._clients += 1
+        self._cond.release()
+
+    def removeClient(self):
+        """
+        Unregisters a step, letting the remaining steps claim bigger shares.
+        """
+
+        self._cond.acquire()
+        self._clients = max(0, self._clients - 1)
+        self._cond.notifyAll()
+        self._cond.release()
+
+    def acquire(self):
+        """
+        Claims a share of the budget, blocking until at least one job is free.
+        This returns the number of jobs claimed, which must be handed back with
+        release() once the command finished.
+        """
+
+        self._cond.acquire()
+        try:
+            while self._free < 1: self._cond.wait()
+            share = max(1, self._free / max(1, self._clients - self._holders))
+            jobs = min(self._free, share)
+            self._free -= jobs
+            self._holders += 1
+            return jobs
+        finally:
+            self._cond.release()
+
+    def release(self, jobs):
+        """
+        Hands back jobs previously claimed with acquire().
+
+        Arguments:
+          jobs - number of jobs being returned
+        """
+
+        self._cond.acquire()
+        self._free = min(self.total, self._free + jobs)
+        self._holders = max(0, self._holders - 1)
+        self._cond.notifyAll()
+        self._cond.release()
+
+class PathLocks():
+    """
+    Locks for paths that concurrently running setups work on, such as an
+    archive being downloaded, a source tree being extracted or a prefix being
+    installed to. The same path always provides the same lock.
+    """
+
+    def __init__(self):
+        self._locks = {}                    # absolute path -> lock
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Provides the lock of the given path. Locks are reentrant, so a thread
+        holding a path's lock may acquire it again.
+
+        Arguments:
+          path - path to be locked
+        """
+
+        path = os.path.abspath(path)
+        self._lock.acquire()
+        try: return self._locks.setdefault(path, threading.RLock())
+        finally: self._lock.release()
@@ -2,7 +2,7 @@
 Provides user prompts for setting up shadow.
 """
 
-import curses, shutil, threading, sys, os
+import curses, shutil, threading, multiprocessing, hashlib, zlib, zipfile, sqlite3, glob, sys, os
 
 from controller import *
 from panel import *
@@ -11,24 +11,59 @@ from log import *
 from config import *
 from enum import *
 from input import *
+from scheduler import *
+from download import *
+from extract import *
+from stamp import *
+from compilercache import *
+from artifact import *
+from stats import *
+from history import *
+from process import *
 
 SetupModes = Enum("LAST", "DEFAULT", "CUSTOM", "UNINSTALL", "CANCEL",)
 CONTROLLER = None
 
+# seconds between log messages about the progress of a download
+DOWNLOAD_PROGRESS_RATE = 5
+
+# number of hex digits of digests and fingerprints used in directory names
+PATH_DIGEST_LENGTH = 16
+
+# setup steps the shadowdebug option builds differently
+DEBUG_STEPS = ["shadow", "scallion"]
+
+# seconds between checks for stopping, pausing or timeouts while a command runs
+COMMAND_POLL_RATE = 0.5
+
+# seconds a terminated command has to exit before it's killed
+COMMAND_KILL_DELAY = 10
+
+# directory in the cache holding disk-backed logs, and how many are kept
+LOG_DIRECTORY_NAME = "logs"
+LOG_FILES_KEPT = 5
+
+# default toolbar text, and the width of the progress bar shown in front of it
+TOOLBAR_MESSAGE = "p: pause, h: help, q: quit"
+PROGRESS_BAR_WIDTH = 20
+
 def start(stdscr):
     global CONTROLLER, CURSES_LOCK
 
     # main controller that handles all the panels, popups, etc
-    CONTROLLER = Controller(stdscr, "p: pause, h: help, q: quit")
+    CONTROLLER = Controller(stdscr, TOOLBAR_MESSAGE)
 
     # setup the log panel as its own page
     configLogLevel = LogLevels.values()[LogLevels.indexOf(toCamelCase(getConfig().get("general", "loglevel")))]
-    lp = LogPanel(stdscr, configLogLevel, CONTROLLER.getPopupManager())
+    logFile, logFileError = _createLogFile(getConfig())
+    lp = LogPanel(stdscr, configLogLevel, CONTROLLER.getPopupManager(), getConfig().getint("general", "logcapacity"), logFile)
     CONTROLLER.addPagePanels([lp])
 
     # start the threaded panels (e.g. log panel)
     for p in CONTROLLER.getDaemonPanels(): p.start()
     lp.info("shadow-cli initialized")
+    if logFile is not None: lp.info("writing the log to \'" + logFile.path + "\'")
+    if logFileError is not None: lp.error("problem creating the log file, keeping the log in memory: " + logFileError)
 
     # make sure toolbar is drawn
     CONTROLLER.redraw(True)
@@ -46,11 +81,11 @@ def start(stdscr):
         # selectively create and start the setup thread
         if mode == SetupModes.DEFAULT: 
             # setup using default config
-            setupThread = SetupThread(getDefaultConfig(), lp)
+            setupThread = _createSetupThread(getDefaultConfig(), lp)
         elif mode == SetupModes.CUSTOM: 
             # use the wizard to configure and store custom options
             askMode = wizardAskConfigure(stdscr, lp)
-            setupThread = SetupThread(getConfig(), lp)
+            setupThread = _createSetupThread(getConfig(), lp)
         elif mode == SetupModes.UNINSTALL: 
             wizardDoUninstall(getConfig(), lp)
         else:
@@ -66,7 +101,11 @@ def start(stdscr):
 
     helpkey = None
     while not CONTROLLER.isDone():
-
+        
+        toolBarMsg = _getProgressLabel(setupThread) if setupThread is not None else TOOLBAR_MESSAGE
+        snapshotLabel = lp.getSnapshotLabel()
+        if snapshotLabel: toolBarMsg = "%s - %s" % (snapshotLabel, toolBarMsg)
+        CONTROLLER.setToolBarDefault(toolBarMsg)
         CONTROLLER.redraw(False)
         CURSES_LOCK.acquire()
         stdscr.refresh()
@@ -102,6 +141,90 @@ def start(stdscr):
         setupThread.stop()
         setupThread.join()
     
+def startBatch():
+    """
+    Runs the setup with the saved configuration (or the default one if there is
+    none) without the interface, logging to the terminal. This returns True if
+    the setup succeeded.
+    """
+    
+    config = getConfig()
+    configLogLevel = LogLevels.values()[LogLevels.indexOf(toCamelCase(config.get("general", "loglevel")))]
+    logger = StreamLogger(configLogLevel)
+    logger.info("shadow-cli initialized in batch mode")
+    
+    setupThread = _createSetupThread(config, logger)
+    if setupThread is None: return False
+    setupThread.start()
+    try:
+        # joining with a timeout lets us receive keyboard interrupts
+        while setupThread.isAlive(): setupThread.join(1)
+    except KeyboardInterrupt:
+        logger.error("interrupted, stopping setup... (CTRL-C to kill)")
+        setupThread.stop()
+        while setupThread.isAlive(): setupThread.join(1)
+        return False
+    
+    return setupThread.isSuccessful()
+
+def _createLogFile(config):
+    """
+    Provides a tuple of the LogFile the log panel keeps its entries in (None if
+    they're kept in memory) and the reason it couldn't be created (None if
+    there was no problem). Only the most recent log files are kept.
+    """
+    
+    if config.get("general", "logstorage").strip().lower() != "disk": return (None, None)
+    directory = os.path.abspath(os.path.expanduser(config.get("setup", "cache")) + "/" + LOG_DIRECTORY_NAME)
+    
+    try:
+        previous = sorted(glob.glob(directory + "/shadow-cli-*.log"))
+        for path in previous[:max(0, len(previous) - LOG_FILES_KEPT + 1)]: os.remove(path)
+        return (LogFile(directory + "/shadow-cli-" + time.strftime("%Y%m%d-%H%M%S") + ".log"), None)
+    except (IOError, OSError), exc:
+        return (None, str(exc))
+
+def _createSetupThread(config, logger):
+    """
+    Provides the thread running the setup of the given configuration, which
+    builds all of its variants at once if it has any. This returns None if the
+    variants are misconfigured.
+    """
+    
+    try: variants = getVariantConfigs(config)
+    except ValueError, exc:
+        logger.error("problem with the setup variants: " + str(exc))
+        return None
+    
+    if variants: return MatrixSetupThread(config, variants, logger)
+    return SetupThread(config, logger)
+
+def _getProgressLabel(setupThread):
+    """
+    Provides the toolbar message with a progress bar and the time left for the
+    given setup.
+    """
+    
+    progress = setupThread.getProgress()
+    if progress is None: return TOOLBAR_MESSAGE
+    fraction, remaining = progress
+    
+    filled = int(PROGRESS_BAR_WIDTH * fraction)
+    bar = "[" + "#" * filled + "-" * (PROGRESS_BAR_WIDTH - filled) + "] %i%%" % int(100 * fraction)
+    if not setupThread.isAlive(): status = "finished" if setupThread.isSuccessful() else "failed"
+    elif remaining is None: status = "failed"
+    else: status = "ETA " + getShortTimeLabel(int(remaining))
+    
+    # matrix builds also show how far along each variant is
+    if isinstance(setupThread, MatrixSetupThread):
+        variants = []
+        for name, variantProgress in setupThread.getVariantProgress():
+            if variantProgress is None: variants.append(name + " -")
+            elif variantProgress[1] is None: variants.append(name + " failed")
+            else: variants.append("%s %i%%" % (name, int(100 * variantProgress[0])))
+        status += " (" + ", ".join(variants) + ")"
+    return "%s %s - %s" % (bar, status, TOOLBAR_MESSAGE)
+    
 def finish():
     global HALT_ACTIVITY
     HALT_ACTIVITY = True
@@ -237,26 +360,198 @@ def wizardDoUninstall(config, logger):
 def _clearCacheHelper(config, logger, clearShadowCache=True, clearBuildCache=False, clearDownloadCache=False):
     cachedir = os.path.expanduser(config.get("setup", "cache"))
     buildcachedir = os.path.abspath(cachedir + "/build")
+    sourcecachedir = os.path.abspath(cachedir + "/source")
     downloadcachedir = os.path.abspath(cachedir + "/download")
     
-    shadowcachedir = os.path.abspath(buildcachedir + "/shadow-release")
-    scallioncachedir = os.path.abspath(buildcachedir + "/shadow-scallion-release")
+    # sources and builds of each archive are suffixed with digests
+    shadowcachedirs = []
+    for d in [sourcecachedir, buildcachedir]:
+        for name in ["shadow-release-", "shadow-scallion-release-"]:
+            shadowcachedirs += glob.glob(d + "/" + name + "*")
     
-    for (clear, d) in [(clearShadowCache, shadowcachedir), (clearShadowCache, scallioncachedir), (clearBuildCache, buildcachedir), (clearDownloadCache, downloadcachedir)]:
+    toClear = [(clearShadowCache, d) for d in shadowcachedirs]
+    toClear += [(clearBuildCache, buildcachedir), (clearBuildCache, sourcecachedir), (clearDownloadCache, downloadcachedir)]
+    for (clear, d) in toClear:
         if clear and os.path.exists(d): 
             shutil.rmtree(d)
             logger.debug("removed directory: " + d)
 
+class SetupResources():
+    """
+    Everything shared by the setups of all variants of a matrix build: the
+    compile job budget, the download cache and the compiler cache, along with
+    the locks that keep the variants from working on the same archive, source
+    tree, build directory or prefix at the same time.
+    """
+    
+    def __init__(self, config):
+        self.cache = os.path.abspath(os.path.expanduser(config.get("setup", "cache")))
+        self.compilerCacheName = config.get("setup", "compilercache")
+        
+        # compile jobs shared by all steps, defaulting to one per cpu
+        jobs = config.getint("setup", "jobs")
+        if jobs < 1: jobs = multiprocessing.cpu_count()
+        self.jobBudget = JobBudget(jobs)
+        self.pathLocks = PathLocks()
+        
+        # a single thread logs the output of every running command
+        self.outputPump = OutputPump()
+        
+        # set up by start()
+        self.downloadCache = None
+        self.compilerCache = None
+        self._env = None
+        
+    def start(self, logger):
+        """
+        Prepares the cache for the setups to run.
+        """
+        
+        # make sure the shared cache directories exist before the workers race to create them
+        for d in [self.cache + "/download", self.cache + "/source", self.cache + "/build"]:
+            if not os.path.exists(d): os.makedirs(d)
+        self.downloadCache = DownloadCache(self.cache + "/download")
+        
+        # put ccache or sccache in front of the compilers if there is one
+        name = findCompilerCache(self.compilerCacheName)
+        if name is not None:
+            self.compilerCache = CompilerCache(name, self.cache + "/" + name)
+            self._env = self.compilerCache.getEnvironment(os.environ)
+            self.compilerCache.start(self._env)
+            logger.info("using compiler cache \'" + name + "\' in \'" + self.compilerCache.path + "\'")
+        else: logger.debug("not using a compiler cache")
+        
+    def getEnvironment(self, env):
+        """
+        Provides a copy of the given environment for running build commands.
+        """
+        
+        if self.compilerCache is None: return dict(env)
+        return self.compilerCache.getEnvironment(env)
+    
+    def finish(self, logger):
+        """
+        Logs the statistics of the setups once they are all done.
+        """
+        
+        if self.compilerCache is None: return
+        hits, misses = self.compilerCache.stop(self._env)
+        if hits is None or misses is None: logger.info("compiler cache statistics are not available")
+        else:
+            rate = 100.0 * hits / (hits + misses) if hits + misses > 0 else 0.0
+            logger.info("compiler cache: %i hits, %i misses (%.1f%% hit rate)" % (hits, misses, rate))
+
+class MatrixSetupThread(threading.Thread):
+    """
+    Sets up several variants of the configuration at the same time, for
+    instance debug and release builds each in a prefix of their own. The
+    variants share downloads, extracted sources and the compile job budget,
+    while each is built in its own build directories.
+    """
+    
+    def __init__(self, config, variants, logger):
+        """
+        Creates a thread for the given variants.
+
+        Arguments:
+          config   - configuration the variants are based on
+          variants - list of (name, config) tuples, from getVariantConfigs()
+          logger   - logger shared by all variants
+        """
+        
+        super(MatrixSetupThread, self).__init__()
+        self.logger = logger
+        self.resources = SetupResources(config)
+        self.variants = [SetupThread(c, VariantLogger(name, logger), self.resources, name) for name, c in variants]
+        self.setDaemon(True)
+        
+    def run(self):
+        self.logger.info("setting up variants " + ", ".join([v.variant for v in self.variants]))
+        self.resources.start(self.logger)
+        for v in self.variants: v.start()
+        for v in self.variants: v.join()
+        self.resources.finish(self.logger)
+        
+        for v in self.variants:
+            self.logger.info("variant \'%s\' %s" % (v.variant, "succeeded" if v.isSuccessful() else "failed"))
+        
+    def getProgress(self):
+        """
+        Provides a tuple of the fraction of all variants that is done and the
+        expected seconds until the last one finishes (None if any failed), or
+        None if none of them started yet.
+        """
+        
+        progress = [v.getProgress() for v in self.variants]
+        if not [p for p in progress if p is not None]: return None
+        
+        fraction = sum([p[0] for p in progress if p is not None]) / len(progress)
+        remaining = [p[1] if p is not None else 0.0 for p in progress]
+        if None in remaining: return (fraction, None)
+        return (fraction, max(remaining))
+    
+    def getVariantProgress(self):
+        """
+        Provides a list of (name, progress) tuples with the getProgress() of each
+        variant.
+        """
+        
+        return [(v.variant, v.getProgress()) for v in self.variants]
+    
+    def stop(self):
+        for v in self.variants: v.stop()
+        
+    def isStopped(self):
+        return not [v for v in self.variants if not v.isStopped()]
+    
+    def isSuccessful(self):
+        """
+        True if the setups of all variants succeeded.
+        """
+        
+        return not [v for v in self.variants if not v.isSuccessful()]
+
 class SetupThread(threading.Thread):
     """Thread class with a stop() method. The thread itself has to check
     regularly for the isStopped() condition."""
 
-    def __init__(self, config, logger):
+    def __init__(self, config, logger, resources=None, variant=None):
         super(SetupThread, self).__init__()
         self._stop = threading.Event()
         self.config = config
         self.logger = logger
         
+        # variants of a matrix build share their resources, otherwise the
+        # thread has resources of its own
+        self.variant = variant
+        self.resources = resources
+        self._ownsResources = resources is None
+        if self._ownsResources: self.resources = SetupResources(config)
+        self.jobBudget = self.resources.jobBudget
+        
+        # archives are fetched through the prefetcher, so only the first step has
+        # to wait for its download before building
+        fetch = lambda key: self._fetchHelper(self.config, key, self.logger)
+        self.prefetcher = Prefetcher(fetch, config.getint("setup", "prefetch"), logger)
+        self.downloadCache = None
+        
+        # environment of the build commands, set up when the thread starts
+        self.env = None
+        self.success = False
+        
+        # installs to the prefix are serialized (see _getInstallLock) so we can
+        # tell which files each step installed
+        self.prefix = None
+        self.artifactCache = None
+        
+        # resource usage of the run, and of each step by its url option
+        self.stats = SetupStats()
+        self.stepStats = {}
+        
+        # durations of earlier runs, for predicting how long this one takes
+        self.history = None
+        self.progress = None
+        
         self.setDaemon(True)
         
     def run(self):
@@ -265,8 +560,14 @@ class SetupThread(threading.Thread):
         
         # use the configured options to actually do the downloads, configure, make, etc
         prefix = os.path.abspath(os.path.expanduser(config.get("setup", "prefix")))
+        self.prefix = prefix
+        
+        if self._ownsResources: self.resources.start(logger)
+        self.downloadCache = self.resources.downloadCache
+        
         # make sure the shadow builder knows where to find cmake, etc...
-        os.environ["PATH"] += ":" + os.path.abspath(prefix + "/bin")
+        self.env = self.resources.getEnvironment(os.environ)
+        self.env["PATH"] = self.env.get("PATH", os.defpath) + ":" + os.path.abspath(prefix + "/bin")
         
         # extra flags for building
         extraIncludePaths = os.path.abspath(os.path.expanduser(config.get("setup", "includepaths")))
@@ -280,182 +581,727 @@ class SetupThread(threading.Thread):
         extraLibFlags = " ".join(extraLibFlagList)
         logger.debug("using linker flags \'" + extraLibFlags + "\'")
         
-        # lets be optimistic ;)
-        success = True
-        
-        if success and config.getboolean("setup", "doopenssl"):
+        # the setup steps, in the order they are consumed by the build. shadow
+        # needs all of its dependencies, while the dependencies themselves can
+        # all be built at the same time.
+        steps = []
+        if config.getboolean("setup", "doopenssl"):
             # openssl (-DPURIFY is needed to run in valgrind if plugin uses openssl)
-            cmdlist = ["./config --prefix=" + prefix + " -fPIC shared -DPURIFY", "make", "make install"]
-            success = self._setupHelper(config, "opensslurl", cmdlist, logger)
+            cmdlist = ["./config --prefix=" + prefix + " -fPIC shared -DPURIFY", "make -j" + JOBS_TAG, "make install -j" + JOBS_TAG]
+            steps.append(SetupStep("openssl", "opensslurl", cmdlist, outputs=["lib/libssl.*", "lib/libcrypto.*", "include/openssl"]))
         
-        if success and config.getboolean("setup", "dolibevent"):
+        if config.getboolean("setup", "dolibevent"):
             # libevent
-            cmdlist = ["./configure --prefix=" + prefix + " CFLAGS=\"-fPIC " + extraIncludeFlags + "\" LDFLAGS=\"" + extraLibFlags + "\"", "make", "make install"]
-            success = self._setupHelper(config, "libeventurl", cmdlist, logger)
+            cmdlist = [SOURCE_TAG + "/configure --prefix=" + prefix + " CFLAGS=\"-fPIC " + extraIncludeFlags + "\" LDFLAGS=\"" + extraLibFlags + "\"", "make -j" + JOBS_TAG, "make install -j" + JOBS_TAG]
+            steps.append(SetupStep("libevent", "libeventurl", cmdlist, outputs=["lib/libevent.*", "include/event2"]))
             
-        if success and config.getboolean("setup", "doglib"):
-            cmdList = ["./configure --prefix=" + prefix, "make", "make install"]
-            success = self._setupHelper(config, "gliburl", cmdList, logger)
+        if config.getboolean("setup", "doglib"):
+            cmdList = [SOURCE_TAG + "/configure --prefix=" + prefix, "make -j" + JOBS_TAG, "make install -j" + JOBS_TAG]
+            steps.append(SetupStep("glib", "gliburl", cmdList, outputs=["lib/libglib-2.0.*", "include/glib-2.0"]))
             
-        if success and config.getboolean("setup", "docmake"):
-            cmdList = ["./bootstrap --prefix=" + prefix, "make", "make install"]
-            success = self._setupHelper(config, "cmakeurl", cmdList, logger)
+        if config.getboolean("setup", "docmake"):
+            cmdList = [SOURCE_TAG + "/bootstrap --prefix=" + prefix + " --parallel=" + JOBS_TAG, "make -j" + JOBS_TAG, "make install -j" + JOBS_TAG]
+            steps.append(SetupStep("cmake", "cmakeurl", cmdList, outputs=["bin/cmake"]))
         
         # build shadow
-        if success:
-            do_debug = config.getboolean("setup", "shadowdebug")
-            cmdList = ["python setup.py build -p " + prefix + " -i " + extraIncludePaths + " -l " + extraLibPaths, "python setup.py install"]
-            if do_debug: cmdList[0] += " -g"
-            success = self._setupHelper(config, "shadowurl", cmdList, logger)
+        do_debug = config.getboolean("setup", "shadowdebug")
+        cmdList = ["python setup.py build -p " + prefix + " -i " + extraIncludePaths + " -l " + extraLibPaths + " -j " + JOBS_TAG, "python setup.py install"]
+        if do_debug: cmdList[0] += " -g"
+        steps.append(SetupStep("shadow", "shadowurl", cmdList, ["openssl", "libevent", "glib", "cmake"], ["bin/shadow*", "lib/libshadow*"]))
             
         # TODO fix scallion support
         sitepkg = None
-        if success and config.getboolean("setup", "doscallion"):
-            if success and config.getboolean("setup", "dopygeoip"):
+        if config.getboolean("setup", "doscallion"):
+            if config.getboolean("setup", "dopygeoip"):
                 sitepkg = os.path.abspath(prefix + "/lib/python2.7/site-packages")
                 if not os.path.exists(sitepkg): os.makedirs(sitepkg)
                 cmdList = ["python setup.py install --prefix=" + prefix]
-                success = self._setupHelper(config, "pygeoipurl", cmdList, logger)
+                steps.append(SetupStep("pygeoip", "pygeoipurl", cmdList, outputs=["lib/python2.7/site-packages/pygeoip*"]))
                 
-            if success:
-                torversion = config.get("setup", "torversion")
-                # TODO this assumes openssl and libevent are always installed to prefix...
-                cmdList = ["python setup.py build -p " + prefix + " -i " + extraIncludePaths + " -l " + extraLibPaths + " -v " + torversion + " --libevent-prefix " + prefix + " --openssl-prefix " + prefix, "python setup.py install -v " + torversion]
-                success = self._setupHelper(config, "scallionurl", cmdList, logger)
+            torversion = config.get("setup", "torversion")
+            # TODO this assumes openssl and libevent are always installed to prefix...
+            cmdList = ["python setup.py build -p " + prefix + " -i " + extraIncludePaths + " -l " + extraLibPaths + " -v " + torversion + " --libevent-prefix " + prefix + " --openssl-prefix " + prefix, "python setup.py install -v " + torversion]
+            steps.append(SetupStep("scallion", "scallionurl", cmdList, ["shadow", "pygeoip", "openssl", "libevent"], ["lib/libshadow-plugin-scallion*"]))
+        
+        # steps that already succeeded with the same inputs are skipped. each
+        # variant has stamps of its own, as they all use the same step names.
+        cache = self.resources.cache
+        stampPath = cache + "/" + STAMP_DIRECTORY_NAME
+        if self.variant is not None: stampPath += "/" + self.variant
+        stamps = StampStore(stampPath)
+        fingerprints = self._getFingerprints(config, steps, prefix, extraIncludeFlags, extraLibFlags)
+        current = set([step.name for step in steps if stamps.isCurrent(step.name, fingerprints[step.name], prefix, step.outputs)])
+        
+        # steps installed before with the same fingerprint (on this host or any
+        # other sharing the artifacts path) are unpacked instead of built
+        restorable = set()
+        artifacts = config.get("setup", "artifacts").strip()
+        if artifacts:
+            self.artifactCache = ArtifactCache(os.path.expanduser(artifacts))
+            logger.debug("using artifact cache \'" + self.artifactCache.path + "\'")
+            restorable = set([step.name for step in steps if self.artifactCache.has(step.name, fingerprints[step.name])])
+        
+        for step in steps: self.stepStats[step.key] = self.stats.addStep(step.name)
+        self._startProgressHelper(steps, current, restorable, fingerprints, config.getint("setup", "workers"), logger)
+        runner = lambda step: self._runStepHelper(config, step, step.name in current, stamps, fingerprints[step.name], logger)
+        scheduler = StepScheduler(steps, runner, config.getint("setup", "workers"), logger, self.isStopped)
+        
+        # start downloading everything in the order the build needs it
+        # (unless the archives are unpacked while being downloaded)
+        if config.getint("setup", "prefetch") > 0 and not config.getboolean("setup", "pipeline"):
+            self.prefetcher.start([step.key for step in steps if step.name not in current and step.name not in restorable])
         
-        if success:
+        logger.debug("sharing a budget of %i parallel compile jobs between setup steps" % self.jobBudget.getTotal())
+        # a setup stopped between steps has no failed ones, so check the stop flag too
+        self.success = scheduler.run() and not self.isStopped()
+        self.stats.finish()
+        if self._ownsResources: self.resources.finish(logger)
+        
+        if self.success:
             logger.info("**************************************************")
             logger.info("setup succeeded! please check \'" + prefix + "/bin\' for binaries.")
             logger.info("please add \'" + prefix + "/bin\' to your PATH")
             if sitepkg is not None: logger.info("please add " + sitepkg + " to your PYTHONPATH")
             logger.info("**************************************************")
+        elif self.isStopped(): logger.info("setup stopped before it finished.")
         else: logger.info("setup failed... please check the log file.")
         
-    def _setupHelper(self, config, key, cmdlist, logger):
-        archive = self._downloadHelper(config, key, logger)
-        if archive is None: 
-            logger.error("cannot proceed: problem downloading " + archive)
-            return False
-        path = self._extractHelper(config, archive, logger)
-        if path is None: 
-            logger.error("cannot proceed: problem extracting " + archive)
+        for line in self.stats.getSummary(): logger.info(line)
+        try:
+            info = {"success": self.success, "variant": self.variant, "setup": dict(config.items("setup", True))}
+            reportPath = self.stats.writeReport(cache + "/" + REPORT_DIRECTORY_NAME, info, self.variant)
+            logger.info("wrote setup report to \'" + reportPath + "\'")
+        except (IOError, OSError), exc:
+            logger.error("problem writing setup report: " + str(exc))
+        
+    def _getFingerprints(self, config, steps, prefix, includeFlags, libFlags):
+        """
+        Provides a mapping of step names to their fingerprints. A step's
+        fingerprint covers its own inputs and the fingerprints of the steps it
+        depends on, so a change to a dependency rebuilds everything using it.
+        """
+        
+        compilerVersion = getCompilerVersion()
+        isDebug = str(config.getboolean("setup", "shadowdebug"))
+        fingerprints = {}
+        for step in steps:
+            # steps are listed after their dependencies
+            url = config.get("setup", step.key)
+            inputs = [url, self._getExpectedDigest(config, step.key) or "", prefix, includeFlags, libFlags,
+                      compilerVersion, step.cmdlist, [fingerprints[d] for d in step.depends if d in fingerprints]]
+            if step.name in DEBUG_STEPS: inputs.append(isDebug)
+            fingerprints[step.name] = getFingerprint(inputs)
+        return fingerprints
+    
+    def _runStepHelper(self, config, step, isCurrent, stamps, fingerprint, logger):
+        stats = self.stepStats[step.key]
+        stats.start()
+        if self.progress is not None: self.progress.start(step.name)
+        status = "failed"
+        try: status = self._installStepHelper(config, step, isCurrent, stamps, fingerprint, logger)
+        finally:
+            stats.finish(status)
+            if self.progress is not None: self.progress.finish(step.name, status != "failed")
+        
+        if self.history is not None and status in ("built", "restored"):
+            try: self.history.record(step.name, fingerprint, status, stats.wallTime)
+            except sqlite3.Error, exc: logger.debug("unable to record setup history: " + str(exc))
+        return status != "failed"
+    
+    def _startProgressHelper(self, steps, current, restorable, fingerprints, numWorkers, logger):
+        """
+        Sets up the prediction of how long the steps take from the durations of
+        earlier runs.
+        """
+        
+        try: self.history = HistoryStore(os.path.expanduser(CONFIG_BASE) + "/" + HISTORY_FILE_NAME)
+        except (sqlite3.Error, OSError), exc:
+            logger.debug("unable to open setup history: " + str(exc))
+            self.history = None
+        
+        durations = {}
+        for step in steps:
+            if step.name in current: status = "skipped"
+            elif step.name in restorable: status = "restored"
+            else: status = "built"
+            
+            estimate = None
+            if self.history is not None and status != "skipped":
+                try: estimate = self.history.getEstimate(step.name, fingerprints[step.name], status)
+                except sqlite3.Error, exc: logger.debug("unable to read setup history: " + str(exc))
+            if estimate is None: estimate = DEFAULT_DURATIONS[status]
+            durations[step.name] = estimate
+            logger.debug("expecting setup step \'%s\' to take %is" % (step.name, estimate))
+        
+        self.progress = ProgressEstimator(steps, durations, numWorkers)
+    
+    def getProgress(self):
+        """
+        Provides a tuple of the fraction of the setup that is done and the
+        expected seconds left (None if it failed), or None if the setup hasn't
+        started yet.
+        """
+        
+        if self.progress is None: return None
+        return self.progress.getProgress()
+    
+    def _installStepHelper(self, config, step, isCurrent, stamps, fingerprint, logger):
+        """
+        Brings the step up to date, providing how: 'skipped', 'restored',
+        'built' or 'failed'.
+        """
+        
+        if isCurrent:
+            logger.info("skipping setup step \'" + step.name + "\', it is already up to date")
+            return "skipped"
+        
+        # a step that fails half way through must not look up to date
+        stamps.remove(step.name)
+        
+        if self.artifactCache is not None and self.artifactCache.has(step.name, fingerprint):
+            if self._restoreArtifactHelper(step, fingerprint, logger):
+                stamps.write(step.name, fingerprint)
+                if stamps.isCurrent(step.name, fingerprint, self.prefix, step.outputs): return "restored"
+                logger.info("artifact of setup step \'" + step.name + "\' is missing some of its files, building it instead")
+                stamps.remove(step.name)
+        
+        installed = [] if self.artifactCache is not None else None
+        if not self._setupHelper(config, step.key, step.cmdlist, fingerprint, installed, logger): return "failed"
+        if installed: self._storeArtifactHelper(step, fingerprint, installed, logger)
+        stamps.write(step.name, fingerprint)
+        return "built"
+    
+    def _restoreArtifactHelper(self, step, fingerprint, logger):
+        path = self.artifactCache.getPath(step.name, fingerprint)
+        logger.info("installing setup step \'" + step.name + "\' from artifact \'" + path + "\'")
+        
+        # other steps might be installing at the same time
+        installLock = self._getInstallLock()
+        installLock.acquire()
+        try:
+            count = self.artifactCache.restore(step.name, fingerprint, self.prefix)
+        except (ValueError, tarfile.TarError, EOFError, zlib.error, IOError, OSError), exc:
+            logger.error("problem restoring artifact \'" + path + "\': " + str(exc))
             return False
-        success = self._executeHelper(cmdlist, path, logger)
+        finally:
+            installLock.release()
+        
+        logger.debug("restored %i files to \'%s\'" % (count, self.prefix))
+        return True
+    
+    def _storeArtifactHelper(self, step, fingerprint, installed, logger):
+        # a missing artifact only costs a rebuild, so this never fails the step
+        path = self.artifactCache.getPath(step.name, fingerprint)
+        files = sorted(set(installed))
+        try:
+            self.artifactCache.store(step.name, fingerprint, self.prefix, files)
+            logger.info("saved %i installed files of setup step \'%s\' to artifact \'%s\'" % (len(files), step.name, path))
+        except (tarfile.TarError, IOError, OSError), exc:
+            logger.error("problem saving artifact \'" + path + "\': " + str(exc))
+        
+    def _setupHelper(self, config, key, cmdlist, fingerprint, installed, logger):
+        self.jobBudget.addClient()
+        try: return self._setupStepHelper(config, key, cmdlist, fingerprint, installed, logger)
+        finally: self.jobBudget.removeClient()
+        
+    def _setupStepHelper(self, config, key, cmdlist, fingerprint, installed, logger):
+        url = config.get("setup", key)
+        stats = self.stepStats[key]
+        
+        # first time installs may unpack the archive while it is downloaded
+        source = None
+        if self._isPipelined(config, key): source = self._pipelineHelper(config, key, logger)
+        
+        if source is None:
+            archive = self._downloadHelper(config, key, logger)
+            if archive is None: 
+                logger.error("cannot proceed: problem downloading " + url)
+                return False
+            startTime = time.time()
+            source = self._extractHelper(config, archive, url, logger)
+            stats.addExtraction(time.time() - startTime)
+            if source is None: 
+                logger.error("cannot proceed: problem extracting " + archive)
+                return False
+        
+        # variants with the same configuration would share a build directory
+        buildLock = self.resources.pathLocks.get(self._getBuildPath(config, source, fingerprint))
+        buildLock.acquire()
+        try:
+            path = self._buildDirectoryHelper(config, source, cmdlist, fingerprint, logger)
+            if path is None:
+                logger.error("cannot proceed: problem preparing a build directory for " + source)
+                return False
+            cmdlist = [cmd.replace(SOURCE_TAG, source) for cmd in cmdlist]
+            success = self._executeHelper(cmdlist, path, logger, installed, stats)
+        finally:
+            buildLock.release()
+        
         if not success:
             logger.error("cannot proceed: problem building " + path)
             return False
         return True
         
     def _downloadHelper(self, config, key, logger):
+        # blocks only until this one archive is available
+        return self.prefetcher.get(key)
+        
+    def _fetchHelper(self, config, key, logger):
         url = config.get("setup", key)
-        cache = os.path.abspath(os.path.expanduser(config.get("setup", "cache")))
         
-        # make sure directories exist
-        dlPath = os.path.abspath(cache + "/download")
-        if not os.path.exists(dlPath): os.makedirs(dlPath)
-    
-        targetFile = os.path.abspath(dlPath + "/" + os.path.basename(url))
-    
+        # other variants may be fetching the same archive
+        downloadLock = self.resources.pathLocks.get(self.downloadCache.getIncomingPath(url))
+        downloadLock.acquire()
+        try: return self._fetchArchiveHelper(config, key, url, logger)
+        finally: downloadLock.release()
+        
+    def _fetchArchiveHelper(self, config, key, url, logger):
+        expectedDigest = self._getExpectedDigest(config, key)
+        
         # only download if not cached
-        if os.path.exists(targetFile):
-            logger.info("using cached resource " + targetFile)
+        targetFile = self.downloadCache.lookup(url, expectedDigest)
+        if targetFile is not None:
+            logger.info("using cached resource " + targetFile + " for " + url)
+            return targetFile
+        
+        incomingFile = self.downloadCache.getIncomingPath(url)
+        progress = self._getDownloadProgressCallback(os.path.basename(url), logger)
+        
+        # interrupted downloads are kept as partial files, retries resume them
+        attempts = 1 + max(0, config.getint("setup", "downloadretries"))
+        for attempt in range(attempts):
+            if self.isStopped(): return None
+            partSize = 0
+            if os.path.exists(incomingFile + ".part"):
+                partSize = os.path.getsize(incomingFile + ".part")
+                logger.info("resuming download of resource " + url + " ...")
+            else: logger.info("downloading resource " + url + " ...")
+            hasher = hashlib.sha256()
+            
+            startTime = time.time()
+            result = download(url, incomingFile, progress, isStopped=self.isStopped, hasher=hasher)
+            path = incomingFile if result == 0 else incomingFile + ".part"
+            size = os.path.getsize(path) if os.path.exists(path) else partSize
+            self.stepStats[key].addDownload(max(0, size - partSize), time.time() - startTime)
+            if result == 0: break
         else:
-            logger.info("downloading resource " + url + " ...")
-            if download(url, targetFile) != 0: return None
+            logger.error("failed to download resource " + url)
+            return None
+        
+        digest = hasher.hexdigest()
+        if expectedDigest and digest != expectedDigest.lower():
+            logger.error("downloaded resource " + url + " has digest " + digest + " but " + expectedDigest + " was expected")
+            os.remove(incomingFile)
+            return None
+        
+        logger.debug("resource " + url + " has digest " + digest)
+        return self.downloadCache.add(url, incomingFile, digest)
+    
+    def _getExpectedDigest(self, config, key):
+        """
+        Provides the configured SHA-256 digest for the archive of the given url
+        option (for instance 'opensslsha256' for 'opensslurl'), None if unset.
+        """
+        
+        option = key[:-len("url")] + "sha256"
+        if not config.has_option("setup", option): return None
+        return config.get("setup", option).strip() or None
+    
+    def _getDownloadProgressCallback(self, name, logger):
+        """
+        Provides a download callback that periodically logs the progress of the
+        named download.
+        """
+        
+        lastReport = [time.time()]
+        def callback(bytesRead, bytesTotal, rate):
+            now = time.time()
+            if now - lastReport[0] < DOWNLOAD_PROGRESS_RATE: return
+            lastReport[0] = now
+            
+            msg = "downloading " + name + ": " + getSizeLabel(bytesRead, 1)
+            if bytesTotal: msg += " of " + getSizeLabel(bytesTotal, 1)
+            logger.info(msg + " (" + getSizeLabel(rate, 1) + "/s)")
+        return callback
+    
+    def _isPipelined(self, config, key):
+        """
+        True if the archive of the given url option should be extracted while it
+        is downloaded, which is only the case if the archive isn't cached yet.
+        """
+        
+        if not config.getboolean("setup", "pipeline"): return False
+        url = config.get("setup", key)
+        if not isStreamable(os.path.basename(url)): return False
+        return self.downloadCache.lookup(url, self._getExpectedDigest(config, key)) is None
+    
+    def _pipelineHelper(self, config, key, logger):
+        """
+        Downloads and extracts an archive in a single pass, unpacking the data as
+        it arrives while a copy is written to the download cache. This returns
+        the extracted path, or None if anything went wrong in which case the
+        caller should fall back to downloading and extracting separately.
+        """
+        
+        url = config.get("setup", key)
+        expectedDigest = self._getExpectedDigest(config, key)
+        
+        # other variants may be fetching the same archive, in which case it's
+        # cached once we get the lock
+        downloadLock = self.resources.pathLocks.get(self.downloadCache.getIncomingPath(url))
+        downloadLock.acquire()
+        try:
+            if self.downloadCache.lookup(url, expectedDigest) is not None: return None
+            return self._streamHelper(config, key, url, expectedDigest, logger)
+        finally:
+            downloadLock.release()
+    
+    def _streamHelper(self, config, key, url, expectedDigest, logger):
+        # the source tree is named after the archive's digest, which we only
+        # know once it is completely downloaded
+        basePath = self._getSourcePath(config, os.path.basename(url), None)
+        if os.path.exists(basePath): shutil.rmtree(basePath)
+        incomingFile = self.downloadCache.getIncomingPath(url)
+        progress = self._getDownloadProgressCallback(os.path.basename(url), logger)
+        hasher = hashlib.sha256()
+        
+        logger.info("downloading and extracting resource " + url + " ...")
+        try:
+            stream = DownloadStream(url, incomingFile, progress, self.isStopped, hasher, replayPartial=True)
+        except (IOError, OSError, httplib.HTTPException, ValueError), exc:
+            logger.debug("unable to stream resource " + url + ": " + str(exc))
+            return None
+        
+        path = None
+        startTime = time.time()
+        try:
+            path = self._unpackHelper(stream, url, basePath, logger)
+            # whatever follows the end of the tar data still belongs in the cache
+            if path is not None:
+                while stream.read(DOWNLOAD_BUFFER_SIZE): pass
+        except (IOError, OSError, httplib.HTTPException), exc:
+            logger.debug("problem reading the end of resource " + url + ": " + str(exc))
+        stream.close()
+        
+        # downloading and extracting overlap, so it all counts as download time
+        self.stepStats[key].addDownload(stream.bytesDownloaded, time.time() - startTime)
+        if path is None: return None
+        
+        # without the complete archive we don't know the digest to name it by,
+        # so leave it to the regular download to resume it
+        if not stream.commit():
+            logger.debug("download of resource " + url + " was incomplete, not using it")
+            shutil.rmtree(path)
+            return None
         
-        return targetFile
+        digest = hasher.hexdigest()
+        if expectedDigest and digest != expectedDigest.lower():
+            logger.error("downloaded resource " + url + " has digest " + digest + " but " + expectedDigest + " was expected")
+            os.remove(incomingFile)
+            shutil.rmtree(path)
+            return None
+        
+        logger.debug("resource " + url + " has digest " + digest)
+        self.downloadCache.add(url, incomingFile, digest)
+        
+        sourcePath = self._getSourcePath(config, os.path.basename(url), digest)
+        sourceLock = self.resources.pathLocks.get(sourcePath)
+        sourceLock.acquire()
+        try:
+            if os.path.exists(sourcePath): shutil.rmtree(path)
+            else: os.rename(path, sourcePath)
+        finally:
+            sourceLock.release()
+        return sourcePath
     
-    def _extractHelper(self, config, archive, logger):
+    def _getSourcePath(self, config, name, digest):
+        """
+        Provides the directory the archive with the given file name and digest
+        is extracted to. Without a digest this is the directory the archive is
+        extracted to while it is downloaded.
+        """
+        
         cache = os.path.abspath(os.path.expanduser(config.get("setup", "cache")))
         
-        # make sure directories exist
-        buildPath = os.path.abspath(cache + "/build")
-        if not os.path.exists(buildPath): os.makedirs(buildPath)
+        # find the directory given by the archive name (archives in the download
+        # cache are named by their digest, so it comes from the url). the digest
+        # keeps a changed archive behind the same url from reusing stale files.
+        baseDirectory = getArchiveBaseName(name)
+        if digest is None: return os.path.abspath(cache + "/source/" + baseDirectory + ".incoming")
+        return os.path.abspath(cache + "/source/" + baseDirectory + "-" + digest[:PATH_DIGEST_LENGTH])
+    
+    def _getBuildPath(self, config, source, fingerprint):
+        """
+        Provides the build directory of the given source tree and fingerprint.
+        """
         
-        # find the directory given by the tar name
-        baseFilename = os.path.basename(archive)
-        baseDirectory = baseFilename[:baseFilename.rindex(".tar.gz")]
-        basePath = os.path.abspath(buildPath + "/" + baseDirectory)
+        cache = os.path.abspath(os.path.expanduser(config.get("setup", "cache")))
+        buildId = getFingerprint([fingerprint, os.path.basename(source)])[:PATH_DIGEST_LENGTH]
+        return os.path.abspath(cache + "/build/" + os.path.basename(source) + "-" + buildId)
+    
+    def _buildDirectoryHelper(self, config, source, cmdlist, fingerprint, logger):
+        """
+        Provides the directory a step is built in, creating it if needed. Every
+        configuration (fingerprint) of a source tree gets a build directory of its
+        own, so for instance debug and release builds can both be rebuilt
+        incrementally. Steps that build out of tree start with an empty build
+        directory, the others with a copy of the pristine source. This returns
+        None if the directory couldn't be created.
+        """
         
-        # extract only if not already cached
-        if os.path.exists(basePath):
-            logger.info("using cached build files in \'" + basePath + "\'")
-        else:
-            # first extract to temporary directory
-            tmpPath = os.path.abspath(buildPath + "/tmp")
-            if os.path.exists(tmpPath): shutil.rmtree(tmpPath)
-            os.makedirs(tmpPath)
-            
-            logger.info("extracting \'" + archive + "\' to \'" + basePath + "\'")
-            if tarfile.is_tarfile(archive):
-                tar = tarfile.open(archive, "r:gz")
-                tar.extractall(path=tmpPath)
-                tar.close()
-            else: 
-                logger.error("downloded archive \'" + archive + "\' is not a tarfile!")
-                return None
-            
-            # we can not rely on the stuff we extract to be a directory, or if it is, that the
-            # directory is named the same as baseDirectory from above, so we fix it
-            # here by moving contents of single root directories in tmp to the basePath.
-            dlist = os.listdir(tmpPath)
-            if len(dlist) > 1:
-                # must not be single directory, so move tmppath/*
-                logger.debug("the downloded archive \'" + archive + "\' contains more than a single directory")
-                shutil.move(tmpPath, basePath)
-            elif len(dlist) == 1:
-                d = dlist.pop()
-                p = os.path.abspath(tmpPath + "/" + d)
-                if os.path.isdir(p): 
-                    shutil.move(p, basePath)
-                else: 
-                    logger.debug("the downloded archive \'" + archive + "\' contains a single file")
-                    return None
-            else: 
-                logger.error("downloded archive \'" + archive + "\' contains no files")
-                return None
-            
-            # cleanup
-            if os.path.exists(tmpPath): shutil.rmtree(tmpPath)
+        buildPath = self._getBuildPath(config, source, fingerprint)
+        if os.path.exists(buildPath):
+            logger.info("using existing build directory \'" + buildPath + "\'")
+            return buildPath
+        
+        stagingPath = buildPath + ".staging"
+        try:
+            if os.path.exists(stagingPath): shutil.rmtree(stagingPath)
+            if [cmd for cmd in cmdlist if cmd.find(SOURCE_TAG) > -1]:
+                os.makedirs(stagingPath)
+            else:
+                # in-tree builds write to their sources, so they get their own copy
+                logger.info("copying \'" + source + "\' to \'" + buildPath + "\'")
+                shutil.copytree(source, stagingPath, symlinks=True)
+            os.rename(stagingPath, buildPath)
+        except (IOError, OSError, shutil.Error), exc:
+            logger.error("problem creating build directory \'" + buildPath + "\': " + str(exc))
+            if os.path.exists(stagingPath): shutil.rmtree(stagingPath, ignore_errors=True)
+            return None
+        
+        return buildPath
+    
+    def _extractHelper(self, config, archive, url, logger):
+        digest = self.downloadCache.getDigest(url) or os.path.basename(archive)
+        basePath = self._getSourcePath(config, os.path.basename(url), digest)
+        
+        # other variants may be extracting the same archive
+        sourceLock = self.resources.pathLocks.get(basePath)
+        sourceLock.acquire()
+        try:
+            # extract only if not already cached
+            if os.path.exists(basePath):
+                logger.info("using cached source files in \'" + basePath + "\'")
+                return basePath
             
-        # either the path already existed, or we downloaded and successfully extracted
+            f = open(archive, 'rb')
+            try: return self._unpackHelper(f, archive, basePath, logger)
+            finally: f.close()
+        finally:
+            sourceLock.release()
+        
+    def _unpackHelper(self, fileobj, archive, basePath, logger):
+        """
+        Extracts the archive read from fileobj to basePath, returning basePath on
+        success and None otherwise.
+        """
+        
+        # extract to a staging directory of our own next to basePath, other
+        # steps may be extracting their archives at the same time. the archive's
+        # root directory is stripped on the fly, so once extraction is done a
+        # single rename puts everything in place.
+        stagingPath = basePath + ".staging"
+        for p in [stagingPath, stagingPath + ".unstrip"]:
+            if os.path.exists(p): shutil.rmtree(p)
+        os.makedirs(stagingPath)
+        
+        logger.info("extracting \'" + archive + "\' to \'" + basePath + "\'")
+        try:
+            isStripped = extractArchive(fileobj, stagingPath, logger)
+        except (ValueError, tarfile.TarError, zipfile.BadZipfile, EOFError, zlib.error), exc:
+            logger.error("downloded archive \'" + archive + "\' is not a valid archive: " + str(exc))
+            shutil.rmtree(stagingPath)
+            return None
+        except (IOError, OSError, httplib.HTTPException), exc:
+            logger.error("problem extracting \'" + archive + "\': " + str(exc))
+            shutil.rmtree(stagingPath)
+            return None
+        
+        dlist = os.listdir(stagingPath)
+        if len(dlist) == 0:
+            logger.error("downloded archive \'" + archive + "\' contains no files")
+            shutil.rmtree(stagingPath)
+            return None
+        elif not isStripped and len(dlist) == 1 and not os.path.isdir(os.path.join(stagingPath, dlist[0])):
+            logger.debug("the downloded archive \'" + archive + "\' contains a single file")
+            shutil.rmtree(stagingPath)
+            return None
+        
+        os.rename(stagingPath, basePath)
+        
+        # we successfully extracted
         return basePath
     
-    def _executeHelper(self, cmdlist, workingDirectory, logger):
+    def _executeHelper(self, cmdlist, workingDirectory, logger, installed=None, stats=None):
+        """
+        Runs the commands of a step, returning True if they all succeeded. If
+        given a list then the files installed to the prefix by install commands
+        are added to it, and if given a StepStats the resource usage of each
+        command is added to that.
+        """
+        
         for cmd in cmdlist:
-            logger.info("running \'" + cmd + "\' from \'" + workingDirectory + "\'")
-    
-            # run the command in a separate process
-            # use shlex.split to avoid breaking up single args that have spaces in them into two args
-            p = subprocess.Popen(shlex.split(cmd), cwd=workingDirectory, 
-                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        
-            # while the command is executing, watch and log its output
-            while True:
-                # TODO if the command produces no output, can we sleep to avoid spinloop?
-                line = p.stdout.readline()
-                if not line: break
-                logger.debug(line.strip())
-                
-                if self.isStopped():
-                    p.terminate()
-                    break
-                if logger.isPaused():
-                    # TODO do we need os.killpg(pid, signal.SIGCONT) instead? 
-                    p.send_signal(signal.SIGSTOP)
-                    while logger.isPaused(): time.sleep(1)
-                    p.send_signal(signal.SIGCONT)
-        
-            # return the finished processes returncode
-            r = p.wait()
-            logger.info("Command: \'" + cmd + "\' returned \'" + str(r) + "\'")
+            # claim a share of the job budget for commands that build in parallel
+            jobs = 0
+            if cmd.find(JOBS_TAG) > -1:
+                jobs = self.jobBudget.acquire()
+                cmd = cmd.replace(JOBS_TAG, str(jobs))
+            
+            # installs to the prefix never overlap, so the prefix can be compared
+            # before and after installing with nothing else installing in between
+            isInstall = "install" in cmd.split()
+            if isInstall:
+                installLock = self._getInstallLock()
+                installLock.acquire()
+                if installed is not None: before = getPrefixSnapshot(self.prefix)
+            
+            # commands killed by the watchdog may be retried, failures aren't
+            attempts = 1 + max(0, self.config.getint("setup", "commandretries"))
+            try:
+                for attempt in range(attempts):
+                    startTime = time.time()
+                    r, usage, isTimedOut = self._executeCommand(cmd, workingDirectory, logger)
+                    if stats is not None: stats.addCommand(cmd, r, time.time() - startTime, usage)
+                    if not isTimedOut or self.isStopped(): break
+                    if attempt + 1 < attempts: logger.info("retrying \'%s\' (attempt %i of %i)" % (cmd, attempt + 2, attempts))
+            finally:
+                if isInstall:
+                    if installed is not None: installed.extend(getInstalledFiles(before, getPrefixSnapshot(self.prefix)))
+                    installLock.release()
+                if jobs > 0: self.jobBudget.release(jobs)
         
             if r != 0: return False
         return True
+    
+    def _getInstallLock(self):
+        """
+        Provides the lock held while installing to the prefix, which is shared
+        with any other variant using the same prefix.
+        """
+        
+        return self.resources.pathLocks.get(self.prefix)
+    
+    def _executeCommand(self, cmd, workingDirectory, logger):
+        """
+        Runs a single command, logging its output. This returns a tuple of its
+        return code, resource usage (None if unavailable) and whether it was
+        killed for taking too long or stalling.
+        """
+        
+        logger.info("running \'" + cmd + "\' from \'" + workingDirectory + "\'")
+        commandTimeout = self.config.getint("setup", "commandtimeout")
+        stallTimeout = self.config.getint("setup", "stalltimeout")
+
+        # run the command in a separate process
+        # use shlex.split to avoid breaking up single args that have spaces in them into two args
+        # the command leads a process group of its own, so signals reach
+        # everything it started (make's children, configure's tests, ...). it
+        # mustn't inherit the pipes of commands other steps are running, or
+        # their output wouldn't end until this command does.
+        p = subprocess.Popen(shlex.split(cmd), cwd=workingDirectory, env=self.env,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid, close_fds=True)
+        
+        # the output pump logs the command's output in batches as it arrives,
+        # and notes when it last did so for the stall watchdog
+        lastOutput = [time.time()]
+        def logOutput(lines):
+            lastOutput[0] = time.time()
+            logger.debugLines([line.strip() for line in lines])
+        outputDone = self.resources.outputPump.add(p.stdout, logOutput)
+        
+        # this wakes up regularly whether or not the command writes anything,
+        # checking if it should be stopped, paused or killed by the watchdog. a
+        # command may close its output and keep running, or exit while its
+        # children still write to it, so this goes on until it exited and all of
+        # its output was logged.
+        startTime = time.time()
+        isTerminated, isTimedOut = False, False
+        r, usage = None, None
+        while True:
+            # wait4 provides the usage of this command alone, while the usage of
+            # all children would include the commands of other steps running
+            # meanwhile
+            if r is None:
+                try:
+                    pid, status, usage = os.wait4(p.pid, os.WNOHANG)
+                    if pid != 0: r = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+                except OSError:
+                    r, usage = p.wait(), None
+            if r is not None and (outputDone.isSet() or isTerminated): break
+            
+            if outputDone.isSet(): time.sleep(COMMAND_POLL_RATE)
+            else: outputDone.wait(COMMAND_POLL_RATE)
+            # terminated commands are killed by the timer if they don't exit
+            if isTerminated: continue
+            
+            now = time.time()
+            reason = None
+            if commandTimeout > 0 and now - startTime > commandTimeout:
+                reason = "it ran for more than %i seconds" % commandTimeout
+            elif stallTimeout > 0 and now - lastOutput[0] > stallTimeout:
+                reason = "it produced no output for %i seconds" % stallTimeout
+            
+            if self.isStopped() or reason is not None:
+                if reason is not None: logger.error("killing \'" + cmd + "\' because " + reason)
+                killTimer = self._terminateCommand(p)
+                isTerminated, isTimedOut = True, reason is not None
+            elif logger.isPaused():
+                self._signalCommand(p, signal.SIGSTOP)
+                pauseTime = time.time()
+                while logger.isPaused(): time.sleep(1)
+                self._signalCommand(p, signal.SIGCONT)
+                
+                # time spent paused doesn't count towards the timeouts
+                startTime += time.time() - pauseTime
+                lastOutput[0] += time.time() - pauseTime
+        p.returncode = r
+        
+        if isTerminated:
+            # don't leave anything from the process group behind
+            killTimer.cancel()
+            self._signalCommand(p, signal.SIGKILL)
+            # whatever the terminated command still wrote is logged
+            outputDone.wait(COMMAND_POLL_RATE)
+        self.resources.outputPump.remove(p.stdout)
+        p.stdout.close()
+        
+        # return the finished processes returncode
+        logger.info("Command: \'" + cmd + "\' returned \'" + str(r) + "\'")
+        return (r, usage, isTimedOut)
+    
+    def _terminateCommand(self, p):
+        """
+        Asks the command's process group to terminate, killing it if it doesn't
+        exit within COMMAND_KILL_DELAY seconds. This provides the timer doing the
+        latter, which should be canceled once the command has exited.
+        """
+        
+        self._signalCommand(p, signal.SIGTERM)
+        killTimer = threading.Timer(COMMAND_KILL_DELAY, self._signalCommand, [p, signal.SIGKILL])
+        killTimer.setDaemon(True)
+        killTimer.start()
+        return killTimer
+    
+    def _signalCommand(self, p, sig):
+        """
+        Sends a signal to the command's process group, ignoring groups that are
+        already gone.
+        """
+        
+        try: os.killpg(p.pid, sig)
+        except OSError: pass
 
     def stop(self):
         self._stop.set()
+        self.prefetcher.stop()
 
     def isStopped(self):
         return self._stop.isSet()
+    
+    def isSuccessful(self):
+        """
+        True if the setup finished and every step succeeded.
+        """
+        
+        return self.success
     
\ No newline at end of file
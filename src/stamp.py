@@ -0,0 +1,117 @@
+"""
+Remembers which setup steps already succeeded so re-running setup doesn't
+rebuild everything. Each step gets a fingerprint of everything that affects
+what it installs (archive, prefix, flags, compiler, ...), and a stamp holding
+that fingerprint is written once the step succeeds. A step is up to date if
+its stamp has the current fingerprint and the files it installs still exist.
+"""
+
+import os
+import glob
+import json
+import hashlib
+import subprocess
+
+# name of the directory in the cache holding the stamps
+STAMP_DIRECTORY_NAME = "stamps"
+
+# first line of 'cc --version', looked up once
+_COMPILER_VERSION = None
+
+def getCompilerVersion():
+    """
+    Provides the version string of the C compiler used by the builds (CC if it
+    is set, cc otherwise), "unknown" if it can't be determined.
+    """
+
+    global _COMPILER_VERSION
+    if _COMPILER_VERSION is None:
+        compiler = os.environ.get("CC", "cc").split()
+        try:
+            output = subprocess.Popen(compiler + ["--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT).communicate()[0]
+            lines = output.strip().splitlines()
+            _COMPILER_VERSION = lines[0] if lines else "unknown"
+        except OSError:
+            _COMPILER_VERSION = "unknown"
+    return _COMPILER_VERSION
+
+def getFingerprint(inputs):
+    """
+    Provides the SHA-256 hex digest of the given inputs.
+
+    Arguments:
+      inputs - list of strings (or nested lists of strings) the step depends on
+    """
+
+    return hashlib.sha256(json.dumps(inputs)).hexdigest()
+
+class StampStore():
+    """
+    Directory of stamps, one JSON file per setup step.
+    """
+
+    def __init__(self, path):
+        """
+        Creates a store in the given directory.
+
+        Arguments:
+          path - directory holding the stamps
+        """
+
+        self.path = os.path.abspath(path)
+        if not os.path.exists(self.path): os.makedirs(self.path)
+
+    def isCurrent(self, name, fingerprint, prefix, outputs):
+        """
+        True if the named step succeeded with the given fingerprint and all of
+        its outputs are still installed.
+
+        Arguments:
+          name        - name of the setup step
+          fingerprint - current fingerprint of the step
+          prefix      - install prefix the outputs are relative to
+          outputs     - glob patterns of files the step installs, relative to
+                        prefix
+        """
+
+        stamp = self._load(name)
+        if not stamp or stamp.get("fingerprint") != fingerprint: return False
+        for pattern in outputs:
+            if not glob.glob(os.path.join(prefix, pattern)): return False
+        return True
+
+    def write(self, name, fingerprint):
+        """
+        Records that the named step succeeded with the given fingerprint.
+
+        Arguments:
+          name        - name of the setup step
+          fingerprint - fingerprint the step was built with
+        """
+
+        # write and rename so a crash never leaves a truncated stamp behind
+        path = self._getPath(name)
+        with open(path + ".tmp", 'w') as f: json.dump({"fingerprint": fingerprint}, f)
+        os.rename(path + ".tmp", path)
+
+    def remove(self, name):
+        """
+        Forgets about the named step, for instance because it is being rebuilt.
+
+        Arguments:
+          name - name of the setup step
+        """
+
+        path = self._getPath(name)
+        if os.path.exists(path): os.remove(path)
+
+    def _getPath(self, name):
+        return os.path.join(self.path, name + ".json")
+
+    def _load(self, name):
+        path = self._getPath(name)
+        if not os.path.exists(path): return None
+        try:
+            with open(path) as f: return json.load(f)
+        except (IOError, ValueError):
+            return None
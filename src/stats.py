@@ -0,0 +1,201 @@
+"""
+Resource usage of the setup steps. Every command's wall time, user and system
+CPU time and peak memory are recorded (from os.wait4, so concurrently running
+steps don't get mixed up), along with the time spent downloading and
+extracting each step's archive. When setup finishes a summary table is logged
+and a JSON report is written to the cache so runs can be compared across
+hosts.
+"""
+
+import os
+import json
+import time
+import socket
+import platform
+import threading
+
+from tools import *
+
+# name of the directory in the cache holding the reports
+REPORT_DIRECTORY_NAME = "reports"
+
+# columns of the summary table: (title, width)
+SUMMARY_COLUMNS = [("step", 12), ("status", 9), ("wall", 9), ("user", 9), ("sys", 9),
+                   ("peak rss", 10), ("download", 10), ("extract", 9)]
+
+class StepStats():
+    """
+    Resource usage of a single setup step. Commands are added by the thread
+    running the step, while the download may be recorded by a prefetch thread.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.status = "pending"         # pending, skipped, restored, built or failed
+        self.wallTime = 0.0             # seconds from start to end of the step
+        self.commands = []              # dicts describing each command
+        self.downloadBytes = 0          # bytes received from the network
+        self.downloadTime = 0.0
+        self.extractTime = 0.0
+        self._startTime = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Marks the start of the step.
+        """
+
+        self._startTime = time.time()
+
+    def finish(self, status):
+        """
+        Marks the end of the step.
+
+        Arguments:
+          status - 'skipped', 'restored', 'built' or 'failed'
+        """
+
+        self.status = status
+        if self._startTime is not None: self.wallTime = time.time() - self._startTime
+
+    def addCommand(self, cmd, returncode, wallTime, usage):
+        """
+        Records a finished command.
+
+        Arguments:
+          cmd        - command that was run
+          returncode - return code of the command
+          wallTime   - seconds the command took
+          usage      - resource usage of the command from os.wait4, None if
+                       it's unavailable
+        """
+
+        entry = {"command": cmd, "returncode": returncode, "wall": wallTime,
+                 "user": usage.ru_utime if usage else 0.0,
+                 "sys": usage.ru_stime if usage else 0.0,
+                 # kilobytes on linux
+                 "maxrss": usage.ru_maxrss * 1024 if usage else 0}
+        self._lock.acquire()
+        self.commands.append(entry)
+        self._lock.release()
+
+    def addDownload(self, numBytes, seconds):
+        """
+        Records time spent downloading the step's archive.
+
+        Arguments:
+          numBytes - bytes received from the network
+          seconds  - time the download took
+        """
+
+        self._lock.acquire()
+        self.downloadBytes += numBytes
+        self.downloadTime += seconds
+        self._lock.release()
+
+    def addExtraction(self, seconds):
+        """
+        Records time spent extracting the step's archive.
+
+        Arguments:
+          seconds - time the extraction took
+        """
+
+        self._lock.acquire()
+        self.extractTime += seconds
+        self._lock.release()
+
+    def getUserTime(self):
+        return sum([c["user"] for c in self.commands])
+
+    def getSystemTime(self):
+        return sum([c["sys"] for c in self.commands])
+
+    def getMaxRss(self):
+        return max([c["maxrss"] for c in self.commands] + [0])
+
+    def toDict(self):
+        """
+        Provides the step's usage as a JSON serializable dict.
+        """
+
+        self._lock.acquire()
+        try:
+            return {"name": self.name, "status": self.status, "wall": self.wallTime,
+                    "user": self.getUserTime(), "sys": self.getSystemTime(), "maxrss": self.getMaxRss(),
+                    "download_bytes": self.downloadBytes, "download_time": self.downloadTime,
+                    "extract_time": self.extractTime, "commands": list(self.commands)}
+        finally:
+            self._lock.release()
+
+class SetupStats():
+    """
+    Resource usage of all setup steps in one run.
+    """
+
+    def __init__(self):
+        self.steps = []                 # StepStats in the order steps were added
+        self.startTime = time.time()
+        self.endTime = None
+
+    def addStep(self, name):
+        """
+        Provides a new StepStats for the named step.
+
+        Arguments:
+          name - name of the setup step
+        """
+
+        stats = StepStats(name)
+        self.steps.append(stats)
+        return stats
+
+    def finish(self):
+        """
+        Marks the end of the setup run.
+        """
+
+        self.endTime = time.time()
+
+    def getSummary(self):
+        """
+        Provides the lines of a table summarizing each step.
+        """
+
+        row = lambda values: " ".join([str(v).ljust(width) for v, (_, width) in zip(values, SUMMARY_COLUMNS)]).rstrip()
+        seconds = lambda t: "%.1fs" % t
+        lines = [row([title for title, _ in SUMMARY_COLUMNS])]
+        for s in self.steps:
+            download = getSizeLabel(s.downloadBytes, 1) if s.downloadBytes else "-"
+            lines.append(row([s.name, s.status, seconds(s.wallTime), seconds(s.getUserTime()),
+                              seconds(s.getSystemTime()), getSizeLabel(s.getMaxRss(), 1), download,
+                              seconds(s.extractTime)]))
+        if self.endTime is not None: lines.append("total wall time: " + seconds(self.endTime - self.startTime))
+        return lines
+
+    def writeReport(self, directory, info={}, variant=None):
+        """
+        Writes a JSON report of the run to the given directory, providing its
+        path.
+
+        Arguments:
+          directory - directory the report is written to
+          info      - additional fields included in the report, for instance
+                      the configuration
+          variant   - name of the variant of a matrix build, included in the
+                      report's file name
+        """
+
+        if not os.path.exists(directory): os.makedirs(directory)
+        host = socket.gethostname()
+        name = host if variant is None else host + "-" + variant
+        path = os.path.join(directory, "setup-%s-%s.json" % (name, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.startTime))))
+
+        report = {"host": host, "platform": platform.platform(), "start": self.startTime,
+                  "end": self.endTime, "steps": [s.toDict() for s in self.steps]}
+        report.update(info)
+
+        tmpPath = path + ".tmp"
+        with open(tmpPath, 'w') as f: json.dump(report, f, indent=1, sort_keys=True)
+        os.rename(tmpPath, path)
+        return path
@@ -13,7 +13,7 @@ import sys
 import curses
 import time
 import signal
-import subprocess, shlex, urllib2, tarfile
+import subprocess, shlex, urllib2, httplib, tarfile
 
 from curses.ascii import isprint
 from enum import *
@@ -42,6 +42,9 @@ SIZE_UNITS_BYTES = [(1125899906842624.0, " PB", " Petabyte"), (1099511627776.0,
 TIME_UNITS = [(86400.0, "d", " day"), (3600.0, "h", " hour"),
               (60.0, "m", " minute"), (1.0, "s", " second")]
 
+# number of bytes read from the network at a time when downloading
+DOWNLOAD_BUFFER_SIZE = 64 * 1024
+
 Ending = Enum("ELLIPSE", "HYPHEN")
 SCROLL_KEYS = (curses.KEY_UP, curses.KEY_DOWN, curses.KEY_PPAGE, curses.KEY_NPAGE, curses.KEY_HOME, curses.KEY_END)
 CONFIG = {"features.colorInterface": True,
@@ -649,12 +652,188 @@ def getFileErrorMsg(exc):
 
     return excStr
 
-def download(url, target_path):
+def download(url, target_path, callback=None, bufferSize=DOWNLOAD_BUFFER_SIZE, isStopped=None, hasher=None):
+    """
+    Downloads a resource, streaming it to disk in chunks of a fixed size so
+    memory use stays flat no matter how large the resource is. Data is written
+    to a '.part' file next to the target which is only renamed into place once
+    the download is complete. This returns 0 on success and -1 otherwise.
+
+    If the download is interrupted the '.part' file is kept, and the next call
+    resumes it with an HTTP Range request. Servers that don't support ranges
+    simply send the whole resource again, which then replaces the partial file.
+
+    Arguments:
+      url         - location of the resource to be downloaded
+      target_path - path where the resource is saved
+      callback    - function called after each chunk as
+                    callback(bytesRead, bytesTotal, rate), where bytesTotal is
+                    None if the server didn't tell us the size and rate is the
+                    average throughput in bytes per second
+      bufferSize  - number of bytes read at a time
+      isStopped   - function that aborts the download, keeping the partial
+                    file, once it returns True
+      hasher      - hashlib object that is updated with the complete contents
+                    of the resource while it is streamed, including the part
+                    that was already downloaded when resuming
+    """
+
     try:
-        u = urllib2.urlopen(url)
-        localfile = open(target_path, 'w')
-        localfile.write(u.read())
-        localfile.close()
-        return 0
-    except urllib2.URLError:
+        stream = DownloadStream(url, target_path, callback, isStopped, hasher, bufferSize=bufferSize)
+        try:
+            while stream.read(bufferSize): pass
+        finally:
+            stream.close()
+        return 0 if stream.commit() else -1
+    except (IOError, OSError, httplib.HTTPException, ValueError):
         return -1
+
+class DownloadStream():
+    """
+    File-like object for reading a resource while it is downloaded. Everything
+    read from the network is also written to a '.part' file next to the target
+    path, which commit() renames into place once the whole resource was read.
+    This lets consumers (for instance a tarfile in stream mode) process the
+    resource as it arrives while still keeping a copy of it.
+
+    Partial files from earlier attempts are resumed with an HTTP Range request
+    if the server supports it, see download().
+    """
+
+    def __init__(self, url, target_path, callback=None, isStopped=None, hasher=None, replayPartial=False, bufferSize=DOWNLOAD_BUFFER_SIZE):
+        """
+        Opens the connection for the resource. This raises an IOError (or an
+        httplib.HTTPException) if the request fails.
+
+        Arguments:
+          url           - location of the resource to be downloaded
+          target_path   - path where the resource is saved by commit()
+          callback      - progress function, see download()
+          isStopped     - function that aborts the download, see download()
+          hasher        - hashlib object updated with the complete resource
+          replayPartial - when resuming, read() first provides the data that was
+                          already downloaded so that the consumer sees the
+                          whole resource
+          bufferSize    - number of bytes read at a time from the partial file
+        """
+
+        self.url = url
+        self.target_path = target_path
+        self.partPath = target_path + ".part"
+        self.callback = callback
+        self.isStopped = isStopped
+        self.hasher = hasher
+
+        self.bytesTotal = None
+        self.bytesRead = 0                  # bytes of the resource we have so far
+        self.bytesDownloaded = 0            # bytes received from the network
+        self.isComplete = False             # True once the server ended the resource
+        self._replay = None                 # partial file still being replayed
+        self._localfile = None
+        self._u = None
+
+        offset = os.path.getsize(self.partPath) if os.path.exists(self.partPath) else 0
+        request = urllib2.Request(url)
+        if offset > 0: request.add_header("Range", "bytes=%i-" % offset)
+
+        try: self._u = urllib2.urlopen(request)
+        except urllib2.HTTPError, exc:
+            # the partial file doesn't fit the resource anymore, start over
+            if exc.code != 416 or offset == 0: raise exc
+            os.remove(self.partPath)
+            offset = 0
+            self._u = urllib2.urlopen(url)
+
+        contentRange = self._u.info().getheader("Content-Range")
+        if offset > 0 and self._u.getcode() == 206 and contentRange and contentRange.startswith("bytes %i-" % offset):
+            # the server continues where we left off
+            mode = 'ab'
+            total = contentRange[contentRange.rfind("/") + 1:].strip()
+            if total.isdigit(): self.bytesTotal = int(total)
+
+            if replayPartial: self._replay = open(self.partPath, 'rb')
+            elif hasher:
+                # the digest has to cover what we already have
+                partfile = open(self.partPath, 'rb')
+                try:
+                    for chunk in iter(lambda: partfile.read(bufferSize), ""): hasher.update(chunk)
+                finally: partfile.close()
+                self.bytesRead = offset
+            else: self.bytesRead = offset
+        else:
+            # ranges aren't supported, so we get the whole resource
+            mode, offset = 'wb', 0
+            length = self._u.info().getheader("Content-Length")
+            if length is not None: self.bytesTotal = int(length)
+
+        self._offset = offset               # bytes we had before this attempt
+        self._startTime = time.time()
+        self._localfile = open(self.partPath, mode)
+
+    def read(self, size=-1):
+        """
+        Provides up to size bytes of the resource, an empty string once all of
+        it was read. This raises an IOError if the download was stopped.
+
+        Arguments:
+          size - maximum number of bytes to read, everything that is left if -1
+        """
+
+        if size >= 0: return self._readChunk(size)
+
+        return "".join(iter(lambda: self._readChunk(DOWNLOAD_BUFFER_SIZE), ""))
+
+    def _readChunk(self, size):
+        if self.isStopped and self.isStopped(): raise IOError("download of %s was stopped" % self.url)
+
+        if self._replay:
+            chunk = self._replay.read(size)
+            if chunk:
+                if self.hasher: self.hasher.update(chunk)
+                self.bytesRead += len(chunk)
+                return chunk
+            self._replay.close()
+            self._replay = None
+
+        chunk = self._u.read(size)
+        if chunk:
+            self._localfile.write(chunk)
+            if self.hasher: self.hasher.update(chunk)
+            self.bytesRead += len(chunk)
+            self.bytesDownloaded += len(chunk)
+
+            if self.callback:
+                rate = (self.bytesRead - self._offset) / max(time.time() - self._startTime, 0.001)
+                self.callback(self.bytesRead, self.bytesTotal, rate)
+        elif size > 0: self.isComplete = True
+        return chunk
+
+    def close(self):
+        """
+        Closes the connection and partial file, keeping it around for resuming.
+        """
+
+        for f in [self._replay, self._localfile, self._u]:
+            if f: f.close()
+        self._replay = self._localfile = self._u = None
+
+    def commit(self):
+        """
+        Closes the stream and renames the partial file into place if the whole
+        resource was downloaded. This returns True if it was, False otherwise.
+        """
+
+        self.close()
+
+        # stopped or not read to the end, without a Content-Length this is our
+        # only way of telling
+        if not self.isComplete: return False
+
+        if self.bytesTotal is not None:
+            # more data than promised means the partial file was garbage
+            if self.bytesRead > self.bytesTotal: os.remove(self.partPath)
+            # a short read means the connection was dropped, keep it for resuming
+            if self.bytesRead != self.bytesTotal: return False
+
+        os.rename(self.partPath, self.target_path)
+        return True
@@ -0,0 +1,47 @@
+"""
+Unit tests of shadow-cli. Run them from the top of the repository with...
+  python -m unittest discover
+"""
+
+import threading
+
+class RecordingLogger():
+    """
+    Logger keeping the messages it's given, standing in for the log panel.
+    """
+
+    def __init__(self):
+        self.messages = []                  # (level, message) tuples
+        self._lock = threading.Lock()
+
+    def error(self, message):
+        self._add("ERROR", message)
+
+    def info(self, message):
+        self._add("INFO", message)
+
+    def debug(self, message):
+        self._add("DEBUG", message)
+
+    def debugLines(self, messages):
+        for message in messages: self._add("DEBUG", message)
+
+    def isPaused(self):
+        return False
+
+    def getMessages(self, level):
+        """
+        Provides the messages logged at the given level.
+
+        Arguments:
+          level - "ERROR", "INFO" or "DEBUG"
+        """
+
+        self._lock.acquire()
+        try: return [m for l, m in self.messages if l == level]
+        finally: self._lock.release()
+
+    def _add(self, level, message):
+        self._lock.acquire()
+        self.messages.append((level, message))
+        self._lock.release()
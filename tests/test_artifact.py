@@ -0,0 +1,111 @@
+"""
+Tests of finding the files a step installed and of saving and restoring them
+as artifacts.
+"""
+
+import os
+import time
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from src.artifact import *
+
+class TestInstalledFiles(unittest.TestCase):
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        os.makedirs(self.prefix + "/lib")
+        self._write("lib/libevent.a", "archive")
+
+    def tearDown(self):
+        shutil.rmtree(self.prefix)
+
+    def _write(self, path, contents):
+        f = open(os.path.join(self.prefix, path), "w")
+        f.write(contents)
+        f.close()
+
+    def testSnapshot(self):
+        os.symlink("lib", self.prefix + "/lib64")
+        os.symlink("libevent.a", self.prefix + "/lib/libevent.so")
+        self.assertEqual(["lib/libevent.a", "lib/libevent.so", "lib64"], sorted(getPrefixSnapshot(self.prefix)))
+        self.assertEqual({}, getPrefixSnapshot(self.prefix + "/missing"))
+
+    def testInstalledFiles(self):
+        before = getPrefixSnapshot(self.prefix)
+        self.assertEqual([], getInstalledFiles(before, getPrefixSnapshot(self.prefix)))
+
+        os.makedirs(self.prefix + "/include/event2")
+        self._write("include/event2/event.h", "header")
+        self._write("lib/libevent.a", "rebuilt archive")
+        self.assertEqual(["include/event2/event.h", "lib/libevent.a"], getInstalledFiles(before, getPrefixSnapshot(self.prefix)))
+
+    def testReinstalledFile(self):
+        # files installed again with the same size still count
+        before = getPrefixSnapshot(self.prefix)
+        path = self.prefix + "/lib/libevent.a"
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        self.assertEqual(["lib/libevent.a"], getInstalledFiles(before, getPrefixSnapshot(self.prefix)))
+
+    def testRemovedFile(self):
+        before = getPrefixSnapshot(self.prefix)
+        os.remove(self.prefix + "/lib/libevent.a")
+        self.assertEqual([], getInstalledFiles(before, getPrefixSnapshot(self.prefix)))
+
+class TestArtifactCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = self.tmpdir + "/prefix"
+        os.makedirs(self.prefix + "/lib")
+        os.makedirs(self.prefix + "/bin")
+        open(self.prefix + "/lib/libevent.a", "w").write("archive")
+        open(self.prefix + "/bin/event_rpcgen.py", "w").write("#!/usr/bin/env python\n")
+        os.chmod(self.prefix + "/bin/event_rpcgen.py", 0755)
+        os.symlink("libevent.a", self.prefix + "/lib/libevent.so")
+        self.cache = ArtifactCache(self.tmpdir + "/artifacts")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testStoreAndRestore(self):
+        files = ["bin/event_rpcgen.py", "lib/libevent.a", "lib/libevent.so"]
+        self.assertFalse(self.cache.has("libevent", "f00d"))
+        self.cache.store("libevent", "f00d", self.prefix, files)
+        self.assertTrue(self.cache.has("libevent", "f00d"))
+        self.assertFalse(self.cache.has("libevent", "beef"))
+        self.assertEqual([os.path.basename(self.cache.getPath("libevent", "f00d"))], os.listdir(self.cache.path))
+
+        other = self.tmpdir + "/other"
+        self.assertEqual(3, self.cache.restore("libevent", "f00d", other))
+        self.assertEqual("archive", open(other + "/lib/libevent.a").read())
+        self.assertEqual("libevent.a", os.readlink(other + "/lib/libevent.so"))
+        self.assertTrue(os.access(other + "/bin/event_rpcgen.py", os.X_OK))
+
+    def testOnlyGivenFiles(self):
+        self.cache.store("libevent", "f00d", self.prefix, ["lib/libevent.a"])
+        other = self.tmpdir + "/other"
+        self.assertEqual(1, self.cache.restore("libevent", "f00d", other))
+        self.assertEqual(["libevent.a"], os.listdir(other + "/lib"))
+        self.assertFalse(os.path.exists(other + "/bin"))
+
+    def testFailedStore(self):
+        # nothing is left behind, not even a partial artifact
+        self.assertRaises((IOError, OSError), self.cache.store, "libevent", "f00d", self.prefix, ["lib/missing.a"])
+        self.assertFalse(self.cache.has("libevent", "f00d"))
+        self.assertEqual([], os.listdir(self.cache.path))
+
+    def testUnsafeArtifact(self):
+        tar = tarfile.open(self.cache.getPath("libevent", "f00d"), "w:gz")
+        tar.add(self.prefix + "/lib/libevent.a", arcname="../escaped")
+        tar.close()
+
+        self.assertRaises(ValueError, self.cache.restore, "libevent", "f00d", self.tmpdir + "/other")
+        self.assertFalse(os.path.exists(self.tmpdir + "/escaped"))
+
+    def testInvalidArtifact(self):
+        open(self.cache.getPath("libevent", "f00d"), "w").write("not an archive")
+        self.assertRaises(tarfile.TarError, self.cache.restore, "libevent", "f00d", self.tmpdir + "/other")
+
+if __name__ == '__main__':
+    unittest.main()
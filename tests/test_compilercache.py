@@ -0,0 +1,111 @@
+"""
+Tests of picking a compiler cache, wrapping the compilers in it and reading
+its statistics.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import src.compilercache
+from src.compilercache import *
+
+CCACHE3_STATS = """cache directory                     /home/user/.ccache
+primary config                      /home/user/.ccache/ccache.conf
+cache hit (direct)                    12
+cache hit (preprocessed)               3
+cache miss                             7
+files in cache                       120
+"""
+
+CCACHE4_STATS = """Cacheable calls:   22 / 25 (88.00%)
+  Hits:             15 / 22 (68.18%)
+    Direct:         12 / 15 (80.00%)
+    Preprocessed:    3 / 15 (20.00%)
+  Misses:            7 / 22 (31.82%)
+Local storage:
+  Cache size (GB): 0.1 / 5.0 ( 2.00%)
+  Hits:             15 / 22 (68.18%)
+  Misses:            7 / 22 (31.82%)
+"""
+
+SCCACHE_STATS = """Compile requests                     25
+Compile requests executed            22
+Cache hits                           15
+Cache misses                          7
+Cache timeouts                        0
+"""
+
+class TestFindCompilerCache(unittest.TestCase):
+    def setUp(self):
+        self._findExecutable = src.compilercache.find_executable
+        self.installed = []
+        src.compilercache.find_executable = lambda name: "/usr/bin/" + name if name in self.installed else None
+
+    def tearDown(self):
+        src.compilercache.find_executable = self._findExecutable
+
+    def testNoCache(self):
+        self.assertEqual(None, findCompilerCache("auto"))
+        self.assertEqual(None, findCompilerCache("ccache"))
+
+    def testDisabled(self):
+        self.installed = ["ccache", "sccache"]
+        for choice in ("none", "None", "no", "false", "", "  "): self.assertEqual(None, findCompilerCache(choice))
+
+    def testFound(self):
+        self.installed = ["sccache"]
+        self.assertEqual("sccache", findCompilerCache("auto"))
+        self.assertEqual(None, findCompilerCache("ccache"))
+
+        # ccache is preferred when both are installed
+        self.installed = ["ccache", "sccache"]
+        self.assertEqual("ccache", findCompilerCache("auto"))
+        self.assertEqual("sccache", findCompilerCache(" SCCACHE "))
+
+    def testUnsupportedCache(self):
+        self.installed = ["distcc"]
+        self.assertEqual(None, findCompilerCache("distcc"))
+
+class TestCompilerCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = CompilerCache("ccache", self.tmpdir + "/ccache")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testStatistics(self):
+        for output in (CCACHE3_STATS, CCACHE4_STATS, SCCACHE_STATS):
+            self.assertEqual(15, self.cache._getCount(output, HIT_PATTERNS))
+            self.assertEqual(7, self.cache._getCount(output, MISS_PATTERNS))
+
+    def testUnknownStatistics(self):
+        self.assertEqual(None, self.cache._getCount("", HIT_PATTERNS))
+        self.assertEqual(None, self.cache._getCount("cache hit rate 50 %\n", HIT_PATTERNS))
+
+    def testEnvironment(self):
+        env = {"PATH": "/usr/bin"}
+        wrapped = self.cache.getEnvironment(env)
+        self.assertEqual("ccache cc", wrapped["CC"])
+        self.assertEqual("ccache c++", wrapped["CXX"])
+        self.assertEqual(self.cache.path, wrapped["CCACHE_DIR"])
+        self.assertEqual({"PATH": "/usr/bin"}, env)
+
+    def testEnvironmentKeepsCompilers(self):
+        wrapped = self.cache.getEnvironment({"CC": "gcc -m64", "CXX": "/usr/bin/ccache g++"})
+        self.assertEqual("ccache gcc -m64", wrapped["CC"])
+        self.assertEqual("/usr/bin/ccache g++", wrapped["CXX"])
+
+        # wrapping twice doesn't run the cache on itself
+        self.assertEqual(wrapped, self.cache.getEnvironment(wrapped))
+
+    def testSccacheEnvironment(self):
+        cache = CompilerCache("sccache", self.tmpdir + "/sccache")
+        wrapped = cache.getEnvironment({"CC": "clang"})
+        self.assertEqual("sccache clang", wrapped["CC"])
+        self.assertEqual(cache.path, wrapped["SCCACHE_DIR"])
+        self.assertFalse("CCACHE_DIR" in wrapped)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Tests of loading the configuration and of overlaying the variants of a matrix
+build on it.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import src.config
+from src.config import *
+
+class TestLoadConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._configPath = src.config.CONFIG_PATH
+        src.config.CONFIG_PATH = os.path.join(self.tmpdir, "shadow-cli.conf")
+
+    def tearDown(self):
+        src.config.CONFIG_PATH = self._configPath
+        shutil.rmtree(self.tmpdir)
+
+    def _saveConfig(self, options):
+        f = open(src.config.CONFIG_PATH, "w")
+        f.write("[setup]\n")
+        for option, value in options: f.write("%s = %s\n" % (option, value))
+        f.close()
+
+    def testDefaults(self):
+        config = src.config._loadConfig(False)
+        self.assertEqual("~/.local/include;", config.get("setup", "includepaths"))
+
+    def testSavedValues(self):
+        self._saveConfig([("prefix", "/opt/shadow"), ("workers", "2")])
+        config = src.config._loadConfig(True)
+        self.assertEqual("/opt/shadow", config.get("setup", "prefix"))
+        self.assertEqual("2", config.get("setup", "workers"))
+        # defaults the saved configuration lacks are merged in
+        self.assertEqual("~/.shadow/.cache/", config.get("setup", "cache"))
+
+    def testDefaultsUseSavedValues(self):
+        # references in defaults are resolved against the saved values
+        self._saveConfig([("prefix", "/opt/shadow")])
+        config = src.config._loadConfig(True)
+        self.assertEqual("/opt/shadow/include;", config.get("setup", "includepaths"))
+        self.assertEqual("/opt/shadow/lib;", config.get("setup", "librarypaths"))
+
+        # which is also what lets a variant's prefix reach them
+        self._saveConfig([("prefix", "/opt/shadow"), ("variants", "debug")])
+        f = open(src.config.CONFIG_PATH, "a")
+        f.write("[variant.debug]\nprefix = /opt/shadow-debug\n")
+        f.close()
+        variants = getVariantConfigs(src.config._loadConfig(True))
+        self.assertEqual("/opt/shadow-debug/include;", variants[0][1].get("setup", "includepaths"))
+
+class TestVariantConfigs(unittest.TestCase):
+    def setUp(self):
+        self.config = src.config._loadConfig(False)
+        self.config.set("setup", "prefix", "/opt/shadow")
+
+    def _addVariant(self, name, options):
+        section = VARIANT_SECTION_PREFIX + name
+        self.config.add_section(section)
+        for option, value in options: self.config.set(section, option, value)
+
+    def testNoVariants(self):
+        self.assertEqual([], getVariantConfigs(self.config))
+        self.config.remove_option("setup", "variants")
+        self.assertEqual([], getVariantConfigs(self.config))
+
+    def testVariants(self):
+        self._addVariant("debug", [("prefix", "/opt/shadow-debug"), ("shadowdebug", "true")])
+        self._addVariant("release", [])
+        self.config.set("setup", "variants", "debug, release")
+
+        variants = getVariantConfigs(self.config)
+        self.assertEqual(["debug", "release"], [name for name, _ in variants])
+        debug, release = variants[0][1], variants[1][1]
+        self.assertTrue(debug.getboolean("setup", "shadowdebug"))
+        self.assertFalse(release.getboolean("setup", "shadowdebug"))
+
+        # options the variant doesn't set are inherited, and options referring
+        # to the prefix follow the variant's
+        self.assertEqual("/opt/shadow-debug", debug.get("setup", "prefix"))
+        self.assertEqual("/opt/shadow-debug/include;", debug.get("setup", "includepaths"))
+        self.assertEqual("/opt/shadow-debug/lib;", debug.get("setup", "librarypaths"))
+        self.assertEqual("/opt/shadow/include;", release.get("setup", "includepaths"))
+        self.assertEqual(self.config.get("setup", "opensslurl"), debug.get("setup", "opensslurl"))
+        self.assertEqual(self.config.get("general", "loglevel"), debug.get("general", "loglevel"))
+
+        # the variants are copies
+        self.assertEqual("/opt/shadow", self.config.get("setup", "prefix"))
+
+    def testCacheIsShared(self):
+        self._addVariant("debug", [("cache", "/tmp/elsewhere"), ("prefix", "/opt/shadow-debug")])
+        self.config.set("setup", "variants", "debug")
+        debug = getVariantConfigs(self.config)[0][1]
+        self.assertEqual(self.config.get("setup", "cache"), debug.get("setup", "cache"))
+
+    def testUnknownVariant(self):
+        self.config.set("setup", "variants", "debug")
+        self.assertRaises(ValueError, getVariantConfigs, self.config)
+
+    def testDuplicateVariant(self):
+        self._addVariant("debug", [])
+        self.config.set("setup", "variants", "debug debug")
+        self.assertRaises(ValueError, getVariantConfigs, self.config)
+
+    def testInvalidName(self):
+        self._addVariant("../debug", [])
+        self.config.set("setup", "variants", "../debug")
+        self.assertRaises(ValueError, getVariantConfigs, self.config)
+
+if __name__ == '__main__':
+    unittest.main()
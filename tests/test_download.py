@@ -0,0 +1,300 @@
+"""
+Tests of downloading (resuming with HTTP Range requests), of the download cache
+and of fetching archives in the background, against an HTTP server on
+localhost.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+import threading
+import BaseHTTPServer
+
+from src.tools import *
+from src.download import *
+from tests import RecordingLogger
+
+class ResourceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the server's resources, honoring Range requests if the server
+    supports them. Paths starting with '/short' are cut off half way through
+    the response, and ones starting with '/nolength' are sent without a
+    Content-Length.
+    """
+
+    def do_GET(self):
+        server = self.server
+        data = server.resources.get(self.path.split("?")[0])
+        server.requests.append((self.path, self.headers.getheader("Range")))
+        if data is None:
+            self.send_error(404)
+            return
+
+        start = 0
+        rangeHeader = self.headers.getheader("Range")
+        if rangeHeader and server.isRangeSupported:
+            start = int(rangeHeader[len("bytes="):].split("-")[0])
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */%i" % len(data))
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %i-%i/%i" % (start, len(data) - 1, len(data)))
+        else: self.send_response(200)
+
+        body = data[start:]
+        if not self.path.startswith("/nolength"): self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.path.startswith("/short"): body = body[:len(body) / 2]
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class ResourceServer(BaseHTTPServer.HTTPServer):
+    """
+    HTTP server on a free localhost port, serving resources from a dict of
+    paths to their contents.
+    """
+
+    def __init__(self, resources, isRangeSupported=True):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), ResourceHandler)
+        self.resources = resources
+        self.isRangeSupported = isRangeSupported
+        self.requests = []                  # (path, range header) of every request
+
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def getUrl(self, path):
+        return "http://127.0.0.1:%i%s" % (self.server_port, path)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+# resource served by the tests, big enough to take several reads
+RESOURCE = "".join([chr(i % 251) for i in range(300000)])
+RESOURCE_DIGEST = hashlib.sha256(RESOURCE).hexdigest()
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.target = os.path.join(self.tmpdir, "archive")
+        self.partPath = self.target + ".part"
+        self.server = ResourceServer({"/archive": RESOURCE, "/short": RESOURCE, "/nolength": RESOURCE})
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def testDownload(self):
+        hasher = hashlib.sha256()
+        self.assertEqual(0, download(self.server.getUrl("/archive"), self.target, hasher=hasher))
+        self.assertEqual(RESOURCE, open(self.target, "rb").read())
+        self.assertEqual(RESOURCE_DIGEST, hasher.hexdigest())
+        self.assertFalse(os.path.exists(self.partPath))
+
+    def testProgress(self):
+        progress = []
+        callback = lambda bytesRead, bytesTotal, rate: progress.append((bytesRead, bytesTotal))
+        self.assertEqual(0, download(self.server.getUrl("/archive"), self.target, callback, 4096))
+
+        # read in chunks of the given size
+        self.assertEqual((4096, len(RESOURCE)), progress[0])
+        self.assertEqual((len(RESOURCE), len(RESOURCE)), progress[-1])
+        self.assertEqual(sorted(progress), progress)
+
+    def testResumeWithRange(self):
+        open(self.partPath, "wb").write(RESOURCE[:100000])
+
+        progress = []
+        callback = lambda bytesRead, bytesTotal, rate: progress.append((bytesRead, bytesTotal))
+        hasher = hashlib.sha256()
+        self.assertEqual(0, download(self.server.getUrl("/archive"), self.target, callback, hasher=hasher))
+
+        self.assertEqual(("/archive", "bytes=100000-"), self.server.requests[-1])
+        self.assertTrue(progress[0][0] > 100000)
+        self.assertEqual((len(RESOURCE), len(RESOURCE)), progress[-1])
+        self.assertEqual(RESOURCE, open(self.target, "rb").read())
+        # the digest also covers the part we already had
+        self.assertEqual(RESOURCE_DIGEST, hasher.hexdigest())
+
+    def testStream(self):
+        open(self.partPath, "wb").write(RESOURCE[:100000])
+
+        hasher = hashlib.sha256()
+        stream = DownloadStream(self.server.getUrl("/archive"), self.target, hasher=hasher)
+        data = "".join(iter(lambda: stream.read(4096), ""))
+        self.assertTrue(stream.commit())
+
+        # only the rest is provided, but the digest covers all of it
+        self.assertEqual(RESOURCE[100000:], data)
+        self.assertEqual(RESOURCE, open(self.target, "rb").read())
+        self.assertEqual(RESOURCE_DIGEST, hasher.hexdigest())
+
+    def testStreamReplaysPartial(self):
+        open(self.partPath, "wb").write(RESOURCE[:100000])
+
+        hasher = hashlib.sha256()
+        stream = DownloadStream(self.server.getUrl("/archive"), self.target, hasher=hasher, replayPartial=True)
+        data = "".join(iter(lambda: stream.read(4096), ""))
+        self.assertTrue(stream.commit())
+
+        self.assertEqual(("/archive", "bytes=100000-"), self.server.requests[-1])
+        self.assertEqual(RESOURCE, data)
+        self.assertEqual(RESOURCE_DIGEST, hasher.hexdigest())
+
+    def testReadWithoutSize(self):
+        open(self.partPath, "wb").write(RESOURCE[:100000])
+
+        stream = DownloadStream(self.server.getUrl("/archive"), self.target, replayPartial=True)
+        self.assertEqual(RESOURCE, stream.read())
+        self.assertEqual("", stream.read())
+        self.assertTrue(stream.commit())
+
+    def testStreamNotCommittedUntilComplete(self):
+        stream = DownloadStream(self.server.getUrl("/short"), self.target)
+        while stream.read(4096): pass
+        self.assertFalse(stream.commit())
+        self.assertFalse(os.path.exists(self.target))
+        self.assertEqual(len(RESOURCE) / 2, os.path.getsize(self.partPath))
+
+    def testStoppedDownloadIsNotCommitted(self):
+        # without a Content-Length only reaching the end tells us we're done
+        isStopped = [False]
+        stream = DownloadStream(self.server.getUrl("/nolength"), self.target, isStopped=lambda: isStopped[0])
+        stream.read(1000)
+        isStopped[0] = True
+        self.assertRaises(IOError, stream.read, 1000)
+
+        self.assertFalse(stream.commit())
+        self.assertFalse(os.path.exists(self.target))
+        self.assertTrue(os.path.exists(self.partPath))
+
+    def testResumeWithoutRangeSupport(self):
+        self.server.isRangeSupported = False
+        open(self.partPath, "wb").write("garbage that isn't part of the resource")
+
+        self.assertEqual(0, download(self.server.getUrl("/archive"), self.target))
+        self.assertEqual(RESOURCE, open(self.target, "rb").read())
+
+    def testPartialLargerThanResource(self):
+        # the server can't satisfy the range, so we start over
+        open(self.partPath, "wb").write(RESOURCE + "trailing garbage")
+
+        self.assertEqual(0, download(self.server.getUrl("/archive"), self.target))
+        self.assertEqual(RESOURCE, open(self.target, "rb").read())
+
+    def testInterruptedDownloadIsResumed(self):
+        url = self.server.getUrl("/short")
+        self.assertEqual(-1, download(url, self.target))
+        self.assertFalse(os.path.exists(self.target))
+        self.assertEqual(len(RESOURCE) / 2, os.path.getsize(self.partPath))
+
+        # the rest is then requested with a range
+        self.assertEqual(0, download(self.server.getUrl("/archive"), self.target))
+        self.assertEqual("bytes=%i-" % (len(RESOURCE) / 2), self.server.requests[-1][1])
+        self.assertEqual(RESOURCE, open(self.target, "rb").read())
+
+    def testStoppedDownloadIsKept(self):
+        chunks = []
+        callback = lambda bytesRead, bytesTotal, rate: chunks.append(bytesRead)
+        isStopped = lambda: len(chunks) >= 2
+        self.assertEqual(-1, download(self.server.getUrl("/archive"), self.target, callback, 4096, isStopped))
+
+        self.assertFalse(os.path.exists(self.target))
+        self.assertEqual(8192, os.path.getsize(self.partPath))
+
+    def testDownloadWithoutLength(self):
+        self.assertEqual(0, download(self.server.getUrl("/nolength"), self.target))
+        self.assertEqual(RESOURCE, open(self.target, "rb").read())
+
+    def testMissingResource(self):
+        self.assertEqual(-1, download(self.server.getUrl("/missing"), self.target))
+        self.assertFalse(os.path.exists(self.target))
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = DownloadCache(os.path.join(self.tmpdir, "downloads"))
+        self.url = "http://example.com/openssl-1.0.0d.tar.gz"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _addResource(self, url):
+        path = self.cache.getIncomingPath(url)
+        open(path, "wb").write(RESOURCE)
+        return self.cache.add(url, path, RESOURCE_DIGEST)
+
+    def testMiss(self):
+        self.assertEqual(None, self.cache.lookup(self.url))
+        self.assertEqual(None, self.cache.getDigest(self.url))
+
+    def testHit(self):
+        path = self._addResource(self.url)
+        self.assertEqual(self.cache.getPath(RESOURCE_DIGEST), path)
+        self.assertEqual(path, self.cache.lookup(self.url))
+        self.assertEqual(path, self.cache.lookup(self.url, RESOURCE_DIGEST.upper()))
+        self.assertEqual(RESOURCE, open(path, "rb").read())
+
+    def testHitAfterReload(self):
+        path = self._addResource(self.url)
+        cache = DownloadCache(self.cache.path)
+        self.assertEqual(path, cache.lookup(self.url))
+
+        # the index is json, which mustn't leak unicode into our paths
+        self.assertTrue(type(cache.getDigest(self.url)) is str)
+        self.assertTrue(type(cache.lookup(self.url)) is str)
+
+    def testDigestMismatch(self):
+        self._addResource(self.url)
+        self.assertEqual(None, self.cache.lookup(self.url, hashlib.sha256("something else").hexdigest()))
+
+    def testTruncatedArchive(self):
+        path = self._addResource(self.url)
+        open(path, "wb").write(RESOURCE[:10])
+        self.assertEqual(None, self.cache.lookup(self.url))
+
+    def testSharedContent(self):
+        # mirrors serving the same archive are stored once
+        first = self._addResource(self.url)
+        second = self._addResource("http://mirror.example.com/openssl-1.0.0d.tar.gz")
+        self.assertEqual(first, second)
+        self.assertEqual([RESOURCE_DIGEST], [f for f in os.listdir(self.cache.path) if f == RESOURCE_DIGEST])
+
+    def testCorruptIndex(self):
+        self._addResource(self.url)
+        open(self.cache.indexPath, "w").write("{not json")
+        self.assertEqual(None, DownloadCache(self.cache.path).lookup(self.url))
+
+class TestPrefetcher(unittest.TestCase):
+    def testFetchesInBackground(self):
+        fetched = []
+        lock = threading.Lock()
+
+        def fetch(key):
+            lock.acquire()
+            fetched.append(key)
+            lock.release()
+            return None if key == "bad" else "/path/" + key
+
+        prefetcher = Prefetcher(fetch, 2, RecordingLogger())
+        prefetcher.start(["a", "bad", "c"])
+        self.assertEqual("/path/a", prefetcher.get("a"))
+        self.assertEqual(None, prefetcher.get("bad"))
+        self.assertEqual("/path/c", prefetcher.get("c"))
+        # keys that weren't prefetched are fetched by the caller
+        self.assertEqual("/path/d", prefetcher.get("d"))
+        prefetcher.stop()
+
+        # every resource is only fetched once
+        self.assertEqual(sorted(["a", "bad", "c", "d"]), sorted(fetched))
+
+if __name__ == '__main__':
+    unittest.main()
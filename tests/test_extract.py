@@ -0,0 +1,198 @@
+"""
+Tests of unpacking archives, from streams, with their root directory stripped.
+"""
+
+import os
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+from StringIO import StringIO
+from distutils.spawn import find_executable
+
+import src.extract
+from src.extract import *
+from tests import RecordingLogger
+
+class Stream():
+    """
+    File-like object that can only be read front to back, like a download.
+    """
+
+    def __init__(self, data):
+        self._file = StringIO(data)
+
+    def read(self, size=-1):
+        # short reads, like a network connection
+        return self._file.read(min(size, 1000) if size >= 0 else size)
+
+def getTar(files, mode="w:gz"):
+    """
+    Provides the bytes of a tar archive.
+
+    Arguments:
+      files - list of (name, contents) tuples, contents being None for
+              directories
+      mode  - tarfile mode the archive is written with
+    """
+
+    data = StringIO()
+    tar = tarfile.open(fileobj=data, mode=mode)
+    for name, contents in files:
+        info = tarfile.TarInfo(name)
+        if contents is None:
+            info.type, info.mode = tarfile.DIRTYPE, 0755
+            tar.addfile(info)
+        else:
+            info.size, info.mode = len(contents), 0755
+            tar.addfile(info, StringIO(contents))
+    tar.close()
+    return data.getvalue()
+
+def getZip(files):
+    data = StringIO()
+    archive = zipfile.ZipFile(data, "w")
+    for name, contents in files:
+        info = zipfile.ZipInfo(name + "/" if contents is None else name)
+        info.external_attr = (0755 if contents is None else 0644) << 16
+        archive.writestr(info, contents or "")
+    archive.close()
+    return data.getvalue()
+
+def listFiles(path):
+    """
+    Provides the relative paths of the files and directories under path.
+    """
+
+    results = []
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files: results.append(os.path.relpath(os.path.join(root, name), path))
+    return sorted(results)
+
+SOURCE_FILES = [("openssl-1.0.0d", None),
+                ("openssl-1.0.0d/config", "#!/bin/sh\n"),
+                ("openssl-1.0.0d/crypto", None),
+                ("openssl-1.0.0d/crypto/aes.c", "int main() {}\n")]
+
+class TestArchiveNames(unittest.TestCase):
+    def testBaseName(self):
+        self.assertEqual("openssl-1.0.0d", getArchiveBaseName("openssl-1.0.0d.tar.gz"))
+        self.assertEqual("cmake-2.8.8", getArchiveBaseName("cmake-2.8.8.TGZ"))
+        self.assertEqual("scallion", getArchiveBaseName("scallion.zip"))
+        self.assertEqual("README", getArchiveBaseName("README"))
+
+    def testStreamable(self):
+        self.assertTrue(isStreamable("openssl-1.0.0d.tar.xz"))
+        self.assertFalse(isStreamable("scallion.ZIP"))
+
+    def testDetectFormat(self):
+        self.assertEqual(ArchiveFormats.GZIP, detectFormat(getTar(SOURCE_FILES)[:MAGIC_LENGTH]))
+        self.assertEqual(ArchiveFormats.BZIP2, detectFormat(getTar(SOURCE_FILES, "w:bz2")[:MAGIC_LENGTH]))
+        self.assertEqual(ArchiveFormats.TAR, detectFormat(getTar(SOURCE_FILES, "w")[:MAGIC_LENGTH]))
+        self.assertEqual(ArchiveFormats.ZIP, detectFormat(getZip(SOURCE_FILES)[:MAGIC_LENGTH]))
+        self.assertEqual(ArchiveFormats.XZ, detectFormat("\xfd7zXZ\x00\x00\x04"))
+        self.assertEqual(ArchiveFormats.ZSTD, detectFormat("\x28\xb5\x2f\xfd\x04"))
+        self.assertEqual(None, detectFormat("<html>404 not found</html>"))
+        self.assertEqual(None, detectFormat(""))
+
+class TestExtractArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "openssl")
+        os.makedirs(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _extract(self, data, isSeekable=False):
+        return extractArchive(StringIO(data) if isSeekable else Stream(data), self.path, RecordingLogger())
+
+    def _checkSourceFiles(self):
+        self.assertEqual(["config", "crypto", "crypto/aes.c"], listFiles(self.path))
+        self.assertEqual("int main() {}\n", open(os.path.join(self.path, "crypto", "aes.c")).read())
+        self.assertTrue(os.access(os.path.join(self.path, "config"), os.X_OK))
+
+    def testStripsRoot(self):
+        for mode in ("w", "w:gz", "w:bz2"):
+            shutil.rmtree(self.path)
+            os.makedirs(self.path)
+            self.assertTrue(self._extract(getTar(SOURCE_FILES, mode)))
+            self._checkSourceFiles()
+
+    def testRootWithoutEntry(self):
+        # archives don't always have an entry for the root directory itself
+        self.assertTrue(self._extract(getTar(SOURCE_FILES[1:])))
+        self._checkSourceFiles()
+
+    def testRootWithSingleFile(self):
+        self.assertTrue(self._extract(getTar([("pygeoip-0.2.3/pygeoip.py", "import os\n")])))
+        self.assertEqual(["pygeoip.py"], listFiles(self.path))
+
+    def testSeveralRoots(self):
+        files = SOURCE_FILES + [("README", "read me\n"), ("docs", None)]
+        self.assertFalse(self._extract(getTar(files)))
+        self.assertEqual(["README", "docs", "openssl-1.0.0d", "openssl-1.0.0d/config", "openssl-1.0.0d/crypto",
+                          "openssl-1.0.0d/crypto/aes.c"], listFiles(self.path))
+
+    def testSingleFile(self):
+        self.assertFalse(self._extract(getTar([("README", "read me\n")])))
+        self.assertEqual(["README"], listFiles(self.path))
+
+    def testHardLinks(self):
+        data = StringIO()
+        tar = tarfile.open(fileobj=data, mode="w:gz")
+        info = tarfile.TarInfo("openssl-1.0.0d/config")
+        info.size = 5
+        tar.addfile(info, StringIO("hello"))
+        link = tarfile.TarInfo("openssl-1.0.0d/Configure")
+        link.type, link.linkname = tarfile.LNKTYPE, "openssl-1.0.0d/config"
+        tar.addfile(link)
+        tar.close()
+
+        self.assertTrue(self._extract(data.getvalue()))
+        self.assertEqual("hello", open(os.path.join(self.path, "Configure")).read())
+
+    def testZip(self):
+        self.assertTrue(self._extract(getZip(SOURCE_FILES), True))
+        self.assertEqual(["config", "crypto", "crypto/aes.c"], listFiles(self.path))
+
+    def testZipSeveralRoots(self):
+        self.assertFalse(self._extract(getZip(SOURCE_FILES + [("README", "read me\n")]), True))
+        self.assertTrue(os.path.exists(os.path.join(self.path, "openssl-1.0.0d", "crypto", "aes.c")))
+
+    def testZipFromStream(self):
+        self.assertRaises(ValueError, self._extract, getZip(SOURCE_FILES))
+
+    def testUnsafePaths(self):
+        for name in ("../escaped", "openssl-1.0.0d/../../escaped", "/tmp/escaped"):
+            self.assertRaises(ValueError, self._extract, getTar([(name, "gotcha\n")]))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "escaped")))
+
+    def testUnrecognizedFormat(self):
+        self.assertRaises(ValueError, self._extract, "<html>404 not found</html>")
+
+    def testTruncatedArchive(self):
+        # random contents don't compress, so the cut lands inside of that file
+        data = getTar(SOURCE_FILES + [("openssl-1.0.0d/big", os.urandom(100000))])
+        self.assertRaises((tarfile.TarError, IOError, EOFError), self._extract, data[:len(data) / 2])
+
+class TestExternalDecompressor(unittest.TestCase):
+    def setUp(self):
+        if not find_executable("gzip"): self.skipTest("gzip isn't installed")
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testExtract(self):
+        self.assertTrue(src.extract._extractTarWith(["gzip", "-dc"], Stream(getTar(SOURCE_FILES)), self.tmpdir))
+        self.assertEqual(["config", "crypto", "crypto/aes.c"], listFiles(self.tmpdir))
+
+    def testFailure(self):
+        # the tar data is cut short, so gzip complains about the truncated stream
+        data = getTar(SOURCE_FILES + [("openssl-1.0.0d/big", os.urandom(100000))])
+        self.assertRaises((IOError, tarfile.TarError), src.extract._extractTarWith, ["gzip", "-dc"], Stream(data[:len(data) / 2]), self.tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
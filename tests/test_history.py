@@ -0,0 +1,108 @@
+"""
+Tests of the durations kept from earlier setups and of predicting how long a
+setup takes from them.
+"""
+
+import time
+import socket
+import shutil
+import tempfile
+import unittest
+
+from src.history import *
+from src.scheduler import SetupStep
+
+class TestHistoryStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.history = HistoryStore(self.tmpdir + "/shadow/" + HISTORY_FILE_NAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testNoHistory(self):
+        self.assertEqual(None, self.history.getEstimate("openssl", "f00d"))
+
+    def testEstimate(self):
+        self.history.record("openssl", "f00d", "built", 100.0)
+        self.history.record("openssl", "f00d", "built", 200.0)
+        self.history.record("openssl", "f00d", "restored", 4.0)
+        self.assertEqual(150.0, self.history.getEstimate("openssl", "f00d"))
+        self.assertEqual(4.0, self.history.getEstimate("openssl", "f00d", "restored"))
+        self.assertEqual(None, self.history.getEstimate("libevent", "f00d"))
+
+    def testRecentRuns(self):
+        for duration in (1000.0, 10.0, 10.0, 10.0, 10.0, 10.0):
+            self.history.record("openssl", "f00d", "built", duration)
+            time.sleep(0.01)
+        self.assertEqual(10.0, self.history.getEstimate("openssl", "f00d"))
+
+    def testOtherFingerprints(self):
+        # other fingerprints on this host are preferred over other hosts
+        self.history.host = "otherhost"
+        self.history.record("openssl", "f00d", "built", 300.0)
+        self.assertEqual(300.0, self.history.getEstimate("openssl", "beef"))
+
+        self.history.host = socket.gethostname()
+        self.history.record("openssl", "cafe", "built", 100.0)
+        self.assertEqual(100.0, self.history.getEstimate("openssl", "beef"))
+
+        self.history.record("openssl", "beef", "built", 50.0)
+        self.assertEqual(50.0, self.history.getEstimate("openssl", "beef"))
+
+    def testReopened(self):
+        self.history.record("openssl", "f00d", "built", 100.0)
+        self.assertEqual(100.0, HistoryStore(self.history.path).getEstimate("openssl", "f00d"))
+
+STEPS = [SetupStep("openssl", "opensslurl", []),
+         SetupStep("libevent", "libeventurl", []),
+         SetupStep("shadow", "shadowurl", [], ["openssl", "libevent"])]
+
+class TestProgressEstimator(unittest.TestCase):
+    def _getEstimator(self, durations, numWorkers=2):
+        estimator = ProgressEstimator(STEPS, durations, numWorkers)
+        estimator.startTime -= 10
+        return estimator
+
+    def testWithoutHistory(self):
+        durations = dict([(step.name, DEFAULT_DURATIONS["built"]) for step in STEPS])
+        fraction, remaining = self._getEstimator(durations).getProgress()
+        self.assertAlmostEqual(240.0, remaining, 0)
+        self.assertAlmostEqual(10.0 / 250, fraction, 2)
+
+        # steps run one after another on a single worker
+        self.assertAlmostEqual(360.0, self._getEstimator(durations, 1).getProgress()[1], 0)
+
+    def testRunningSteps(self):
+        estimator = self._getEstimator({"openssl": 60.0, "libevent": 30.0, "shadow": 100.0})
+        estimator.start("openssl")
+        estimator._started["openssl"] -= 20
+        estimator.start("libevent")
+        self.assertAlmostEqual(140.0, estimator.getProgress()[1], 0)
+
+        # steps taking longer than expected are about to finish
+        estimator._started["openssl"] -= 100
+        self.assertAlmostEqual(130.0, estimator.getProgress()[1], 0)
+
+    def testSkippedSteps(self):
+        durations = {"openssl": DEFAULT_DURATIONS["skipped"], "libevent": DEFAULT_DURATIONS["restored"], "shadow": 100.0}
+        self.assertAlmostEqual(105.0, self._getEstimator(durations).getProgress()[1], 0)
+
+        # with every step up to date there's nothing left
+        estimator = self._getEstimator(dict([(step.name, 0.0) for step in STEPS]))
+        self.assertEqual((1.0, 0.0), estimator.getProgress())
+
+    def testFinished(self):
+        estimator = self._getEstimator({"openssl": 60.0, "libevent": 30.0, "shadow": 100.0})
+        for step in STEPS: estimator.finish(step.name, True)
+        self.assertEqual((1.0, 0.0), estimator.getProgress())
+
+    def testFailed(self):
+        estimator = self._getEstimator({"openssl": 60.0, "libevent": 30.0, "shadow": 100.0})
+        estimator.finish("openssl", False)
+        fraction, remaining = estimator.getProgress()
+        self.assertEqual(None, remaining)
+        self.assertAlmostEqual(1.0 / 3, fraction)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,370 @@
+"""
+Tests of the log panel's views of each level, its search and its snapshots,
+without a screen to draw on, and of logging to the terminal instead.
+"""
+
+import os
+import re
+import gzip
+import shutil
+import tempfile
+import unittest
+import threading
+
+import src.log
+from src.log import *
+from tests import RecordingLogger
+
+class PopupManager():
+    """
+    Stands in for the popups, keeping the messages shown.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def showMsg(self, msg, maxWait=-1, attr=None):
+        self.messages.append(msg)
+
+class LogPanelTestCase(unittest.TestCase):
+    """
+    Test case with log panels that record what they draw rather than drawing
+    it, curses colors being unavailable without a screen.
+    """
+
+    def setUp(self):
+        self._getColor = src.log.getColor
+        src.log.getColor = lambda color: 0
+        self.tmpdir = tempfile.mkdtemp()
+        self.logFiles = []
+
+    def tearDown(self):
+        src.log.getColor = self._getColor
+        for logFile in self.logFiles: logFile.close()
+        shutil.rmtree(self.tmpdir)
+
+    def getPanel(self, level=LogLevels.DEBUG, capacity=DEFAULT_LOG_CAPACITY, isOnDisk=False):
+        logFile = None
+        if isOnDisk:
+            logFile = LogFile(os.path.join(self.tmpdir, "shadow-cli-%i.log" % len(self.logFiles)))
+            self.logFiles.append(logFile)
+
+        panel = LogPanel(None, level, PopupManager(), capacity, logFile)
+        panel.drawn = []                    # (line, column, message, format) of each addstr()
+        panel.addstr = lambda *args: panel.drawn.append(args)
+        panel.isTitleVisible = lambda: False
+        panel.addScrollBar = lambda *args: None
+        panel.redraw = lambda *args, **kwargs: None
+        return panel
+
+    def getDrawn(self, panel, width=80, height=20):
+        del panel.drawn[:]
+        panel.draw(width, height)
+        return [msg for line, column, msg, format in panel.drawn]
+
+def getMessages(log):
+    return [entry.msg for entry in log]
+
+class TestLogViews(LogPanelTestCase):
+    def _checkViews(self, isOnDisk):
+        panel = self.getPanel(LogLevels.INFO, isOnDisk=isOnDisk)
+        panel.error("an error")
+        panel.info("some info")
+        panel.debugLines(["debug 1", "debug 2"])
+
+        self.assertEqual(["an error"], getMessages(panel.views[LogLevels.ERROR]))
+        self.assertEqual(["some info", "an error"], getMessages(panel.views[LogLevels.INFO]))
+        self.assertEqual(["debug 2", "debug 1", "some info", "an error"], getMessages(panel.views[LogLevels.DEBUG]))
+        self.assertTrue(panel.backlog is panel.views[LogLevels.DEBUG])
+        self.assertEqual(["some info", "an error"], getMessages(panel.msgLog))
+
+        # switching levels just switches views
+        panel.level = LogLevels.DEBUG
+        panel.repopulate()
+        self.assertEqual(4, len(panel.msgLog))
+
+    def testViews(self):
+        self._checkViews(False)
+
+    def testViewsOnDisk(self):
+        self._checkViews(True)
+
+    def testViewsDropEntriesSeparately(self):
+        # debug entries push out older debug entries, but not errors
+        panel = self.getPanel(capacity=3)
+        panel.error("an error")
+        for i in range(5): panel.debug("debug %i" % i)
+
+        self.assertEqual(["an error"], getMessages(panel.views[LogLevels.ERROR]))
+        self.assertEqual(["debug 4", "debug 3", "debug 2"], getMessages(panel.views[LogLevels.DEBUG]))
+        self.assertEqual(3, panel.views[LogLevels.DEBUG].dropped)
+
+    def testSetLevel(self):
+        panel = self.getPanel(LogLevels.ERROR)
+        panel.info("some info")
+        panel.setLevel(LogLevels.INFO)
+        panel.repopulate()
+        self.assertEqual(["some info"], getMessages(panel.msgLog))
+
+    def testClear(self):
+        panel = self.getPanel()
+        for i in range(5): panel.info("entry %i" % i)
+        panel.clear()
+        for view in panel.views.values(): self.assertEqual(0, len(view))
+
+    def testControlCharactersStripped(self):
+        panel = self.getPanel()
+        panel.info("bell\a and escape\x1b[31m")
+        self.assertFalse([c for c in panel.msgLog[0].msg if ord(c) < 32 and c != "\n"])
+
+class TestLogDrawing(LogPanelTestCase):
+    def testNewestFirst(self):
+        panel = self.getPanel()
+        for i in range(5): panel.info("entry %i" % i)
+        drawn = self.getDrawn(panel)
+        self.assertEqual(5, len(drawn))
+        self.assertTrue(drawn[0].endswith("entry 4"))
+        self.assertTrue(drawn[-1].endswith("entry 0"))
+
+    def testScrolling(self):
+        panel = self.getPanel()
+        for i in range(100): panel.info("entry %i" % i)
+        self.getDrawn(panel)
+        self.assertEqual(100, panel.lastContentHeight)
+
+        panel.scroll = 10
+        drawn = self.getDrawn(panel, height=5)
+        self.assertEqual(4, len(drawn))
+        self.assertTrue(drawn[0].endswith("entry 89"))
+
+    def testEntryHeights(self):
+        # heights from measures match how entries are laid out
+        panel = self.getPanel()
+        messages = ["", "short", "x" * 60, "x" * 200, "two\nlines", "three\nlines\nhere", "word " * 30, " padded " * 5]
+        for width in (20, 40, 70, 76, 77, 78, 80, 200):
+            for msgIndent in (1, 3):
+                for msg in messages:
+                    entry = LogEntry(1300000000.0, LogLevels.INFO, msg, "green")
+                    expected = panel._getEntryLayout(entry, width, msgIndent)[1]
+                    self.assertEqual(expected, panel._getEntryHeight(getEntryMeasure(entry), width, msgIndent))
+
+    def testHeightsOnDisk(self):
+        panels = [self.getPanel(), self.getPanel(isOnDisk=True)]
+        for panel in panels:
+            for i in range(50): panel.info("entry %i %s" % (i, "x" * (i * 3)))
+        for width in (80, 120):
+            drawn = [self.getDrawn(panel, width) for panel in panels]
+            self.assertEqual(drawn[0], drawn[1])
+            self.assertEqual(panels[0].lastContentHeight, panels[1].lastContentHeight)
+
+class TestLogSearch(LogPanelTestCase):
+    def _getSearchedPanel(self, capacity=DEFAULT_LOG_CAPACITY):
+        panel = self.getPanel(capacity=capacity)
+        for i in range(100): panel.info("entry %i %s" % (i, "hit" if i % 10 == 3 else "miss"))
+        self.getDrawn(panel)
+        panel.setSearch("hit")
+        return panel
+
+    def _getSelected(self, panel):
+        return panel.msgLog[panel.msgLog.getIndex(panel._searchMatch)].msg
+
+    def testSelectMatches(self):
+        panel = self._getSearchedPanel()
+        self.assertTrue(panel.selectMatch(True))
+        self.assertEqual("entry 93 hit", self._getSelected(panel))
+        self.assertTrue(panel.selectMatch(True))
+        self.assertEqual("entry 83 hit", self._getSelected(panel))
+        self.assertEqual(panel.msgLog.getIndex(panel._searchMatch), panel.scroll)
+        self.assertTrue(panel.selectMatch(False))
+        self.assertEqual("entry 93 hit", self._getSelected(panel))
+        self.assertFalse(panel.selectMatch(False))
+
+    def testFiltered(self):
+        panel = self._getSearchedPanel()
+        panel.setFiltered(True)
+        drawn = self.getDrawn(panel)
+        self.assertEqual(10, len(drawn))
+        self.assertFalse([msg for msg in drawn if not msg.endswith("hit")])
+
+        # new matches are found as they're logged
+        panel.info("entry 100 hit")
+        self.assertEqual(11, len(self.getDrawn(panel)))
+
+    def testClearSearch(self):
+        panel = self._getSearchedPanel()
+        panel.setFiltered(True)
+        panel.setSearch("")
+        self.assertFalse(panel.isFiltered)
+        self.assertFalse(panel.selectMatch(True))
+        self.assertEqual(19, len(self.getDrawn(panel)))
+
+    def testInvalidPattern(self):
+        panel = self.getPanel()
+        self.assertRaises(re.error, panel.setSearch, "(")
+
+    def testDroppedMatch(self):
+        # the selected match is pushed out of the log by newer entries
+        panel = self._getSearchedPanel(capacity=100)
+        while panel.selectMatch(True): pass
+        self.assertEqual("entry 3 hit", self._getSelected(panel))
+
+        for i in range(100, 120): panel.info("entry %i miss" % i)
+        panel.setFiltered(True)
+        self.assertEqual("entry 23 hit", self._getSelected(panel))
+        self.assertEqual(7, panel.scroll)
+        self.getDrawn(panel)
+
+    def testAllMatchesDropped(self):
+        panel = self._getSearchedPanel(capacity=100)
+        panel.selectMatch(True)
+        panel.clear()
+        panel.setFiltered(True)
+        self.assertEqual(None, panel._searchMatch)
+        self.assertEqual([], self.getDrawn(panel))
+
+    def testLevelChangeDropsSelection(self):
+        panel = self._getSearchedPanel()
+        panel.selectMatch(True)
+        panel.level = LogLevels.ERROR
+        panel.repopulate()
+        self.assertEqual(None, panel._searchMatch)
+
+class RecordingFile():
+    """
+    File noting what's in each write, and whether it was flushed afterward.
+    """
+
+    def __init__(self):
+        self.writes = []                    # [data, isFlushed] of each write
+
+    def write(self, data):
+        self.writes.append([data, False])
+
+    def flush(self):
+        if self.writes: self.writes[-1][1] = True
+
+    def getLines(self):
+        return "".join([data for data, _ in self.writes]).splitlines()
+
+class TestStreamLogger(unittest.TestCase):
+    def setUp(self):
+        self.out, self.err = RecordingFile(), RecordingFile()
+        self.logger = StreamLogger(LogLevels.INFO, self.out, self.err)
+
+    def testLevels(self):
+        self.logger.error("an error")
+        self.logger.info("some info")
+        self.logger.debug("left out")
+
+        self.assertEqual(1, len(self.err.writes))
+        self.assertTrue(self.err.getLines()[0].endswith("[Error] an error"))
+        self.assertEqual(1, len(self.out.writes))
+        self.assertTrue(self.out.getLines()[0].endswith("[Info] some info"))
+
+    def testLineBuffered(self):
+        # every write is whole lines, flushed right away
+        self.logger.info("first")
+        self.logger.info("two\nlines")
+        self.logger.info("bell\a")
+        for data, isFlushed in self.out.writes:
+            self.assertTrue(data.endswith("\n"))
+            self.assertTrue(isFlushed)
+        self.assertEqual(4, len(self.out.getLines()))
+        self.assertFalse([c for c in "".join(self.out.getLines()) if ord(c) < 32])
+
+    def testDebugLines(self):
+        # lines of a command's output are written together
+        logger = StreamLogger(LogLevels.DEBUG, self.out, self.err)
+        logger.debugLines(["line %i" % i for i in range(5)])
+        self.assertEqual(1, len(self.out.writes))
+        self.assertEqual(5, len(self.out.getLines()))
+        self.assertTrue(self.out.getLines()[4].endswith("[Debug] line 4"))
+
+    def testConcurrentLines(self):
+        def log(name):
+            for i in range(200): self.logger.info("%s %i %s" % (name, i, name * 20))
+        threads = [threading.Thread(target=log, args=(name,)) for name in ("a", "b", "c")]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        lines = self.out.getLines()
+        self.assertEqual(600, len(lines))
+        for line in lines:
+            name = line.split()[-1][0]
+            self.assertTrue(line.endswith(name * 20))
+
+class TestSnapshots(LogPanelTestCase):
+    def _checkSnapshot(self, filename, isOnDisk):
+        panel = self.getPanel(LogLevels.INFO, isOnDisk=isOnDisk)
+        panel.debug("left out")
+        for i in range(5000): panel.info("entry %i" % i)
+        expected = "".join([entry.getDisplayMessage(True) + "\n" for entry in reversed(panel.msgLog)])
+
+        path = os.path.join(self.tmpdir, "snapshots", filename)
+        writer = panel.saveSnapshot(path)
+        writer.join(10)
+
+        self.assertEqual(None, writer.error)
+        self.assertEqual(1.0, writer.getProgress())
+        openFile = gzip.open if filename.endswith(".gz") else open
+        self.assertEqual(expected, openFile(path, "rb").read())
+
+    def testSnapshot(self):
+        self._checkSnapshot("log", False)
+
+    def testSnapshotOnDisk(self):
+        self._checkSnapshot("log", True)
+
+    def testCompressedSnapshot(self):
+        self._checkSnapshot("log.gz", False)
+
+    def testCompressedSnapshotOnDisk(self):
+        self._checkSnapshot("log.gz", True)
+
+    def testSnapshotExcludesNewEntries(self):
+        log = LogStore()
+        for i in range(10): log.append(LogEntry(1300000000.0, LogLevels.INFO, "entry %i" % i, "green"))
+
+        path = os.path.join(self.tmpdir, "log")
+        lock = threading.RLock()
+        logger = RecordingLogger()
+        writer = SnapshotWriter(path, log, lock, logger)
+        log.append(LogEntry(1300000000.0, LogLevels.INFO, "entry 10", "green"))
+        writer.start()
+        writer.join(10)
+
+        self.assertEqual(10, len(open(path).readlines()))
+        self.assertEqual(["saved log as '%s'" % path], logger.getMessages("INFO"))
+
+    def testDroppedEntriesSkipped(self):
+        log = LogStore(10)
+        for i in range(10): log.append(LogEntry(1300000000.0, LogLevels.INFO, "entry %i" % i, "green"))
+
+        path = os.path.join(self.tmpdir, "log")
+        writer = SnapshotWriter(path, log, threading.RLock())
+        for i in range(10, 14): log.append(LogEntry(1300000000.0, LogLevels.INFO, "entry %i" % i, "green"))
+        writer.run()
+
+        self.assertEqual(4, writer.skipped)
+        self.assertEqual(["entry %i" % i for i in range(4, 10)], [line.split(" ", 3)[3].strip() for line in open(path)])
+
+    def testMissingCompressor(self):
+        try:
+            import zstandard
+            self.skipTest("zstandard is installed")
+        except ImportError: pass
+
+        path = os.path.join(self.tmpdir, "log.zst")
+        self.assertRaises(ValueError, SnapshotWriter, path, LogStore(), threading.RLock())
+        self.assertFalse(os.path.exists(path))
+
+    def testOneSnapshotAtATime(self):
+        panel = self.getPanel()
+        panel._snapshotWriter = threading.Thread(target=lambda: threading.Event().wait(0.2))
+        panel._snapshotWriter.start()
+        self.assertTrue(panel.isSavingSnapshot())
+        self.assertRaises(ValueError, panel.saveSnapshot, os.path.join(self.tmpdir, "log"))
+        panel._snapshotWriter.join()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+"""
+Tests of the log panel's storage: the ring buffer, the disk-backed store and
+the height and search indices over them.
+"""
+
+import os
+import re
+import copy
+import shutil
+import random
+import tempfile
+import unittest
+
+from src.log import *
+from src.logstore import *
+
+def getEntry(msg, level=LogLevels.INFO, timestamp=1300000000.0):
+    return LogEntry(timestamp, level, msg, LogColors[level])
+
+def getMessages(store):
+    """
+    Provides the messages of a store's entries, newest first.
+    """
+
+    return [entry.msg for entry in store]
+
+class TestLogStore(unittest.TestCase):
+    def testOrder(self):
+        store = LogStore(10)
+        store.extend([getEntry("first"), getEntry("second"), getEntry("third")])
+        self.assertEqual(["third", "second", "first"], getMessages(store))
+        self.assertEqual(["first", "second", "third"], [entry.msg for entry in reversed(store)])
+        self.assertEqual("third", store[0].msg)
+        self.assertEqual("first", store[-1].msg)
+        self.assertRaises(IndexError, store.__getitem__, 3)
+
+    def testEviction(self):
+        store = LogStore(3)
+        for i in range(5): store.append(getEntry("entry %i" % i))
+
+        self.assertEqual(3, len(store))
+        self.assertEqual(2, store.dropped)
+        self.assertEqual(5, store.total)
+        self.assertEqual(["entry 4", "entry 3", "entry 2"], getMessages(store))
+        self.assertEqual(["entry 2", "entry 3", "entry 4"], [entry.msg for entry in reversed(store)])
+
+    def testSequenceNumbers(self):
+        store = LogStore(3)
+        for i in range(5): store.append(getEntry("entry %i" % i))
+
+        # entries keep their sequence number however many were dropped
+        for index in range(len(store)):
+            seq = store.getSequence(index)
+            self.assertEqual("entry %i" % seq, store[index].msg)
+            self.assertEqual(index, store.getIndex(seq))
+        self.assertEqual(["entry 2", "entry 3"], [entry.msg for entry in store.getEntries(2, 4)])
+
+    def testClear(self):
+        store = LogStore(3)
+        for i in range(5): store.append(getEntry("entry %i" % i))
+        revision = store.revision
+        store.clear()
+
+        self.assertEqual(0, len(store))
+        self.assertEqual(0, store.dropped)
+        self.assertEqual(5, store.total)
+        self.assertTrue(store.revision > revision)
+
+        store.append(getEntry("entry 5"))
+        self.assertEqual(5, store.getSequence(0))
+
+    def testCopy(self):
+        store = LogStore(3)
+        for i in range(4): store.append(getEntry("entry %i" % i))
+        snapshot = copy.copy(store)
+        for i in range(4, 6): store.append(getEntry("entry %i" % i))
+
+        self.assertEqual(["entry 3", "entry 2", "entry 1"], getMessages(snapshot))
+        self.assertEqual(1, snapshot.dropped)
+        self.assertEqual(["entry 5", "entry 4", "entry 3"], getMessages(store))
+
+class TestDiskLogStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logFile = LogFile(os.path.join(self.tmpdir, "logs", "shadow-cli.log"))
+
+    def tearDown(self):
+        self.logFile.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _getStore(self, capacity=DEFAULT_LOG_CAPACITY):
+        return DiskLogStore(self.logFile, encodeLogEntry, decodeLogEntry, capacity, getEntryMeasure)
+
+    def testRoundTrip(self):
+        store = self._getStore()
+        entries = [getEntry("plain message"),
+                   getEntry("error message", LogLevels.ERROR, 1300000001.5),
+                   getEntry("debug message  with  spaces ", LogLevels.DEBUG),
+                   getEntry("message\nspanning lines"),
+                   getEntry("")]
+        store.extend(entries)
+
+        self.assertEqual(len(entries), len(store))
+        for original, stored in zip(entries, reversed(store)):
+            self.assertEqual(original.msg, stored.msg)
+            self.assertEqual(original.level, stored.level)
+            self.assertEqual(original.color, stored.color)
+            self.assertEqual(original.timestamp, stored.timestamp)
+            self.assertEqual(original.getDisplayMessage(), stored.getDisplayMessage())
+
+    def testFileIsPlainLog(self):
+        store = self._getStore()
+        entries = [getEntry("entry %i" % i) for i in range(3)]
+        store.extend(entries)
+
+        expected = "".join([entry.getDisplayMessage(True) + "\n" for entry in entries])
+        # reading flushes the file
+        self.assertEqual(expected, store.readRange(0, 3))
+        self.assertEqual(expected, open(self.logFile.path).read())
+
+    def testEntriesWrittenOnce(self):
+        # the views of all levels share the file
+        debugView, infoView = self._getStore(), self._getStore()
+        entry = getEntry("shared")
+        debugView.append(entry)
+        infoView.append(entry)
+        debugView.append(getEntry("debug only", LogLevels.DEBUG))
+
+        self.logFile.read(0, 1)             # flushes the file
+        self.assertEqual(2, open(self.logFile.path).read().count("\n"))
+        self.assertEqual(["shared"], getMessages(infoView))
+        self.assertEqual(["debug only", "shared"], getMessages(debugView))
+
+    def testEviction(self):
+        store = self._getStore(3)
+        for i in range(10): store.append(getEntry("entry %i" % i))
+
+        self.assertEqual(3, len(store))
+        self.assertEqual(7, store.dropped)
+        self.assertEqual(["entry 9", "entry 8", "entry 7"], getMessages(store))
+        self.assertEqual("entry 8", store[store.getIndex(8)].msg)
+        self.assertEqual("".join([store[i].getDisplayMessage(True) + "\n" for i in (1, 0)]), store.readRange(8, 10))
+
+    def testMeasures(self):
+        store = self._getStore(2)
+        for msg in ["short", "two\nlines", "x" * 100]: store.append(getEntry(msg))
+
+        self.assertEqual(getEntryMeasure(getEntry("x" * 100)), store.getMeasure(0))
+        self.assertEqual(-1, store.getMeasure(1))
+        self.assertRaises(IndexError, store.getMeasure, 2)
+
+    def testClearAndCopy(self):
+        store = self._getStore(5)
+        for i in range(4): store.append(getEntry("entry %i" % i))
+        snapshot = copy.copy(store)
+        store.clear()
+        store.append(getEntry("entry 4"))
+
+        self.assertEqual(["entry 4"], getMessages(store))
+        self.assertEqual(["entry 3", "entry 2", "entry 1", "entry 0"], getMessages(snapshot))
+
+class TestHeightIndex(unittest.TestCase):
+    def _check(self, store, index):
+        heights = [store.getMeasure(i) for i in range(len(store))]
+        self.assertEqual(sum(heights), index.getTotal())
+
+        line = 0
+        for i, height in enumerate(heights):
+            self.assertEqual(line, index.getTop(i))
+            for offset in range(height): self.assertEqual(i, index.find(line + offset))
+            line += height
+        self.assertEqual(len(store), index.find(line))
+
+    def testAgainstHeights(self):
+        # the measure of these entries is the number of lines they take
+        random.seed(7)
+        store = LogStore(50, lambda entry: entry.timestamp)
+        index = HeightIndex(store, lambda measure: measure)
+
+        for round in range(30):
+            for i in range(random.choice([0, 1, 7, 40, 120])):
+                store.append(getEntry("entry", timestamp=random.randint(1, 3)))
+            if round == 20: store.clear()
+            index.update()
+            self._check(store, index)
+
+    def testEntriesDroppedBeforeIndexing(self):
+        store = LogStore(5, lambda entry: 2)
+        index = HeightIndex(store, lambda measure: measure)
+        for i in range(20): store.append(getEntry("entry %i" % i))
+        index.update()
+
+        self.assertEqual(10, index.getTotal())
+        self._check(store, index)
+
+class TestSearchIndex(unittest.TestCase):
+    def testMatches(self):
+        store = LogStore(100)
+        for i in range(10): store.append(getEntry("entry %i %s" % (i, "hit" if i % 3 == 0 else "miss")))
+        index = SearchIndex(store, re.compile("hit"), lambda entry: entry.msg)
+        index.update()
+
+        self.assertEqual(4, len(index))
+        self.assertEqual(["entry 9 hit", "entry 6 hit", "entry 3 hit", "entry 0 hit"], getMessages(index))
+        self.assertEqual(9, index.getSequence(0))
+        self.assertEqual(1, index.getIndex(6))
+
+        self.assertEqual(3, index.getMatchBefore(6))
+        self.assertEqual(None, index.getMatchBefore(0))
+        self.assertEqual(9, index.getMatchAfter(6))
+        self.assertEqual(None, index.getMatchAfter(9))
+
+    def testIncremental(self):
+        store = LogStore(100)
+        matched = []
+        index = SearchIndex(store, re.compile("hit"), lambda entry: matched.append(entry.msg) or entry.msg)
+
+        store.append(getEntry("first hit"))
+        index.update()
+        store.append(getEntry("second"))
+        index.update()
+        index.update()
+
+        # every entry is only matched once
+        self.assertEqual(["first hit", "second"], matched)
+        self.assertEqual(1, len(index))
+
+    def testDroppedMatches(self):
+        store = LogStore(5)
+        index = SearchIndex(store, re.compile("hit"), lambda entry: entry.msg)
+        for i in range(30):
+            store.append(getEntry("entry %i %s" % (i, "hit" if i % 2 == 0 else "miss")))
+            index.update()
+
+        self.assertEqual(["entry 28 hit", "entry 26 hit"], getMessages(index))
+        self.assertEqual(None, index.getMatchBefore(26))
+        self.assertEqual(26, index.getMatchAfter(0))
+        self.assertEqual(15, index.total)
+
+    def testHeightsOfMatches(self):
+        # the index is drawn like a store, so it can be given a HeightIndex
+        store = LogStore(100, lambda entry: len(entry.msg))
+        for msg in ["hit", "miss", "a hit", "miss"]: store.append(getEntry(msg))
+        index = SearchIndex(store, re.compile("hit"), lambda entry: entry.msg)
+        index.update()
+        heights = HeightIndex(index, lambda measure: measure)
+        heights.update()
+
+        self.assertEqual(8, heights.getTotal())
+        self.assertEqual(5, heights.getTop(1))
+        self.assertEqual(1, heights.find(6))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+Tests of pumping the output of commands to their callbacks.
+"""
+
+import os
+import time
+import threading
+import unittest
+
+from src.process import *
+
+class RecordingCallback():
+    """
+    Callback keeping the batches of lines it's given.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def __call__(self, lines):
+        self._lock.acquire()
+        self.batches.append(lines)
+        self._lock.release()
+
+    def getLines(self):
+        self._lock.acquire()
+        try: return sum(self.batches, [])
+        finally: self._lock.release()
+
+class TestOutputPump(unittest.TestCase):
+    def setUp(self):
+        self.pump = OutputPump()
+        self.pipes = []
+
+    def tearDown(self):
+        for fd in self.pipes:
+            try: os.close(fd)
+            except OSError: pass
+
+    def _getPipe(self):
+        readEnd, writeEnd = os.pipe()
+        self.pipes += [readEnd, writeEnd]
+        return readEnd, writeEnd
+
+    def _waitFor(self, callback, count):
+        for i in range(100):
+            if len(callback.getLines()) >= count: return
+            time.sleep(0.01)
+
+    def testPartialLines(self):
+        readEnd, writeEnd = self._getPipe()
+        callback = RecordingCallback()
+        done = self.pump.add(readEnd, callback)
+
+        os.write(writeEnd, "first li")
+        time.sleep(0.05)
+        self.assertEqual([], callback.getLines())
+
+        # lines are only handed on once they're complete
+        os.write(writeEnd, "ne\r\nsecond line\nthi")
+        self._waitFor(callback, 2)
+        self.assertEqual(["first line", "second line"], callback.getLines())
+
+        os.write(writeEnd, "rd line\n")
+        self._waitFor(callback, 3)
+        self.assertEqual(["first line", "second line", "third line"], callback.getLines())
+        self.assertFalse(done.isSet())
+
+    def testBatches(self):
+        readEnd, writeEnd = self._getPipe()
+        callback = RecordingCallback()
+        os.write(writeEnd, "".join(["line %i\n" % i for i in range(1000)]))
+        self.pump.add(readEnd, callback)
+        self._waitFor(callback, 1000)
+
+        # all that is read at once is a single batch
+        self.assertEqual(["line %i" % i for i in range(1000)], callback.getLines())
+        self.assertTrue(len(callback.batches) < 10)
+
+    def testDrainAtEnd(self):
+        readEnd, writeEnd = self._getPipe()
+        callback = RecordingCallback()
+        done = self.pump.add(readEnd, callback)
+        os.write(writeEnd, "line\nunfinished")
+        os.close(writeEnd)
+
+        # the unfinished last line is handed on before the pipe is done
+        done.wait(5)
+        self.assertTrue(done.isSet())
+        self.assertEqual(["line", "unfinished"], callback.getLines())
+
+    def testSeveralPipes(self):
+        callbacks, writeEnds, events = [], [], []
+        for i in range(3):
+            readEnd, writeEnd = self._getPipe()
+            callbacks.append(RecordingCallback())
+            events.append(self.pump.add(readEnd, callbacks[-1]))
+            writeEnds.append(writeEnd)
+
+        for i in range(10):
+            for index, writeEnd in enumerate(writeEnds): os.write(writeEnd, "pipe %i line %i\n" % (index, i))
+        for writeEnd in writeEnds: os.close(writeEnd)
+        for event in events: event.wait(5)
+
+        for index, callback in enumerate(callbacks):
+            self.assertEqual(["pipe %i line %i" % (index, i) for i in range(10)], callback.getLines())
+
+    def testRemove(self):
+        readEnd, writeEnd = self._getPipe()
+        callback = RecordingCallback()
+        done = self.pump.add(readEnd, callback)
+        os.write(writeEnd, "line\nunfinished")
+        self._waitFor(callback, 1)
+
+        # a pipe that is still held open elsewhere can be given up on
+        self.pump.remove(readEnd)
+        self.assertTrue(done.isSet())
+        self.assertEqual(["line", "unfinished"], callback.getLines())
+
+        os.write(writeEnd, "ignored\n")
+        time.sleep(0.05)
+        self.assertEqual(["line", "unfinished"], callback.getLines())
+
+if __name__ == '__main__':
+    unittest.main()
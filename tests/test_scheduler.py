@@ -0,0 +1,205 @@
+"""
+Tests of running setup steps as a dependency graph and of sharing the compile
+job budget between them.
+"""
+
+import time
+import unittest
+import threading
+
+from src.scheduler import *
+from tests import RecordingLogger
+
+class StepRunner():
+    """
+    Runner for the scheduler, recording when each step started and finished.
+    Steps fail if they're listed in failures.
+    """
+
+    def __init__(self, failures=(), duration=0.01):
+        self.failures = set(failures)
+        self.duration = duration
+        self.events = []                    # ("start" or "end", step name)
+        self.maxRunning = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, step):
+        self._lock.acquire()
+        self.events.append(("start", step.name))
+        self._running += 1
+        self.maxRunning = max(self.maxRunning, self._running)
+        self._lock.release()
+
+        time.sleep(self.duration)
+
+        self._lock.acquire()
+        self.events.append(("end", step.name))
+        self._running -= 1
+        self._lock.release()
+        return step.name not in self.failures
+
+    def getStarted(self):
+        return [name for event, name in self.events if event == "start"]
+
+    def getIndex(self, event, name):
+        return self.events.index((event, name))
+
+def getSteps():
+    """
+    Provides steps shaped like the real setup: independent dependencies, then
+    shadow, then scallion.
+    """
+
+    return [SetupStep("openssl", "opensslurl", []),
+            SetupStep("libevent", "libeventurl", []),
+            SetupStep("cmake", "cmakeurl", []),
+            SetupStep("shadow", "shadowurl", [], ["openssl", "libevent", "cmake"]),
+            SetupStep("scallion", "scallionurl", [], ["shadow", "openssl"])]
+
+class TestStepScheduler(unittest.TestCase):
+    def testDependencyOrder(self):
+        runner = StepRunner()
+        self.assertTrue(StepScheduler(getSteps(), runner, 4, RecordingLogger()).run())
+        self.assertEqual(5, len(runner.getStarted()))
+
+        for step in getSteps():
+            for dependency in step.depends:
+                self.assertTrue(runner.getIndex("end", dependency) < runner.getIndex("start", step.name))
+
+    def testIndependentStepsRunTogether(self):
+        runner = StepRunner(duration=0.1)
+        self.assertTrue(StepScheduler(getSteps(), runner, 4, RecordingLogger()).run())
+        self.assertEqual(3, runner.maxRunning)
+
+    def testWorkerLimit(self):
+        runner = StepRunner(duration=0.05)
+        self.assertTrue(StepScheduler(getSteps(), runner, 2, RecordingLogger()).run())
+        self.assertEqual(2, runner.maxRunning)
+
+    def testFailurePropagation(self):
+        runner = StepRunner(failures=["libevent"])
+        self.assertFalse(StepScheduler(getSteps(), runner, 4, RecordingLogger()).run())
+
+        # nothing depending on the failed step is started
+        started = runner.getStarted()
+        self.assertTrue("libevent" in started)
+        self.assertFalse("shadow" in started)
+        self.assertFalse("scallion" in started)
+
+    def testFailureStopsNewSteps(self):
+        # with a single worker the steps after the failure never start
+        runner = StepRunner(failures=["openssl"])
+        self.assertFalse(StepScheduler(getSteps(), runner, 1, RecordingLogger()).run())
+        self.assertEqual(["openssl"], runner.getStarted())
+
+    def testRunningStepsFinishAfterFailure(self):
+        runner = StepRunner(failures=["openssl"], duration=0.05)
+        self.assertFalse(StepScheduler(getSteps(), runner, 4, RecordingLogger()).run())
+        for name in ["openssl", "libevent", "cmake"]:
+            self.assertTrue(("end", name) in runner.events)
+
+    def testMissingDependenciesAreIgnored(self):
+        # scallion's dependency on a disabled step doesn't hold it back
+        steps = [SetupStep("shadow", "shadowurl", []), SetupStep("scallion", "scallionurl", [], ["shadow", "pygeoip"])]
+        runner = StepRunner()
+        self.assertTrue(StepScheduler(steps, runner, 2, RecordingLogger()).run())
+        self.assertEqual(["shadow", "scallion"], runner.getStarted())
+
+    def testRunnerException(self):
+        def runner(step):
+            if step.name == "cmake": raise ValueError("broken step")
+            return True
+
+        logger = RecordingLogger()
+        scheduler = StepScheduler(getSteps(), runner, 1, logger)
+        self.assertRaises(ValueError, scheduler._work)
+        self.assertTrue(scheduler._failed)
+
+    def testStopped(self):
+        runner = StepRunner()
+        logger = RecordingLogger()
+        self.assertFalse(StepScheduler(getSteps(), runner, 4, logger, lambda: True).run())
+        self.assertEqual([], runner.getStarted())
+        # stopping isn't a dependency problem
+        self.assertEqual([], logger.getMessages("ERROR"))
+
+class TestJobBudget(unittest.TestCase):
+    def testSingleClient(self):
+        budget = JobBudget(8)
+        budget.addClient()
+        self.assertEqual(8, budget.acquire())
+        budget.release(8)
+        self.assertEqual(8, budget.acquire())
+
+    def testShareOfFreeJobs(self):
+        # a step building alone gets every job, steps starting after it get the
+        # jobs that it hands back
+        budget = JobBudget(8)
+        budget.addClient()
+        self.assertEqual(8, budget.acquire())
+
+        acquired = []
+        budget.addClient()
+        thread = threading.Thread(target=lambda: acquired.append(budget.acquire()))
+        thread.setDaemon(True)
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual([], acquired)
+
+        budget.release(8)
+        thread.join(5)
+        self.assertEqual([4], acquired)
+        self.assertEqual(4, budget.acquire())
+
+    def testSharesOfWaitingClients(self):
+        # the free jobs are split between the steps that don't hold any
+        budget = JobBudget(8)
+        for i in range(3): budget.addClient()
+        self.assertEqual(2, budget.acquire())
+        self.assertEqual(3, budget.acquire())
+        self.assertEqual(3, budget.acquire())
+
+    def testSharesSplitBetweenClients(self):
+        budget = JobBudget(8)
+        budget.addClient()
+        budget.addClient()
+        self.assertEqual(4, budget.acquire())
+        self.assertEqual(4, budget.acquire())
+
+    def testAtLeastOneJob(self):
+        budget = JobBudget(2)
+        for i in range(4): budget.addClient()
+        self.assertEqual(1, budget.acquire())
+        self.assertEqual(1, budget.acquire())
+
+    def testAcquireBlocksUntilRelease(self):
+        budget = JobBudget(1)
+        budget.addClient()
+        self.assertEqual(1, budget.acquire())
+
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(budget.acquire()))
+        thread.setDaemon(True)
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual([], acquired)
+
+        budget.release(1)
+        thread.join(5)
+        self.assertEqual([1], acquired)
+
+    def testReleaseNeverExceedsTotal(self):
+        budget = JobBudget(4)
+        budget.release(10)
+        budget.addClient()
+        self.assertEqual(4, budget.acquire())
+
+class TestPathLocks(unittest.TestCase):
+    def testSameLockPerPath(self):
+        locks = PathLocks()
+        self.assertTrue(locks.get("/tmp/build/openssl") is locks.get("/tmp/build/../build/openssl/"))
+        self.assertFalse(locks.get("/tmp/build/openssl") is locks.get("/tmp/build/libevent"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,439 @@
+"""
+Tests of the setup thread's helpers, run without building anything.
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import signal
+import shutil
+import tempfile
+import unittest
+import threading
+from StringIO import StringIO
+
+import src.config
+import src.setup
+from src.setup import *
+from tests import RecordingLogger
+
+STEPS = [SetupStep("openssl", "opensslurl", ["./config", "make"]),
+         SetupStep("shadow", "shadowurl", ["python setup.py build"], ["openssl"]),
+         SetupStep("scallion", "scallionurl", ["python setup.py build"], ["shadow", "openssl"])]
+
+class SetupTestCase(unittest.TestCase):
+    """
+    Test case with a setup thread whose cache and prefix are in a temporary
+    directory.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = src.config._loadConfig(False)
+        self.config.set("setup", "cache", self.tmpdir + "/cache")
+        self.config.set("setup", "prefix", self.tmpdir + "/prefix")
+        self.config.set("setup", "jobs", "4")
+        self.logger = RecordingLogger()
+        self.thread = SetupThread(self.config, self.logger)
+        self.thread.env = dict(os.environ)
+        self.thread.prefix = self.tmpdir + "/prefix"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+class TestCreateSetupThread(SetupTestCase):
+    def testWithoutVariants(self):
+        self.assertTrue(isinstance(src.setup._createSetupThread(self.config, self.logger), SetupThread))
+
+    def testVariants(self):
+        self.config.add_section(VARIANT_SECTION_PREFIX + "debug")
+        self.config.set("setup", "variants", "debug")
+        setupThread = src.setup._createSetupThread(self.config, self.logger)
+        self.assertTrue(isinstance(setupThread, MatrixSetupThread))
+        self.assertEqual(["debug"], [v.variant for v in setupThread.variants])
+
+    def testInvalidVariants(self):
+        self.config.set("setup", "variants", "debug")
+        self.assertEqual(None, src.setup._createSetupThread(self.config, self.logger))
+        self.assertEqual(["problem with the setup variants: variant 'debug' has no [variant.debug] section"], self.logger.getMessages("ERROR"))
+
+class TestFingerprints(SetupTestCase):
+    def _getFingerprints(self, prefix="/opt/shadow", includeFlags="-I/opt/shadow/include"):
+        return self.thread._getFingerprints(self.config, STEPS, prefix, includeFlags, "-L/opt/shadow/lib")
+
+    def testUnchanged(self):
+        self.assertEqual(self._getFingerprints(), self._getFingerprints())
+
+    def testInputsChanged(self):
+        fingerprints = self._getFingerprints()
+        for changed in (self._getFingerprints(prefix="/opt/other"), self._getFingerprints(includeFlags="")):
+            for step in STEPS: self.assertNotEqual(fingerprints[step.name], changed[step.name])
+
+    def testDependencyChanged(self):
+        fingerprints = self._getFingerprints()
+        self.config.set("setup", "opensslurl", "http://www.openssl.org/source/openssl-1.0.1.tar.gz")
+        changed = self._getFingerprints()
+        for step in STEPS: self.assertNotEqual(fingerprints[step.name], changed[step.name])
+
+    def testDebugOnlyChangesShadow(self):
+        fingerprints = self._getFingerprints()
+        self.config.set("setup", "shadowdebug", "yes" if not self.config.getboolean("setup", "shadowdebug") else "no")
+        changed = self._getFingerprints()
+
+        self.assertEqual(fingerprints["openssl"], changed["openssl"])
+        self.assertNotEqual(fingerprints["shadow"], changed["shadow"])
+        self.assertNotEqual(fingerprints["scallion"], changed["scallion"])
+
+class TestBuildDirectory(SetupTestCase):
+    def setUp(self):
+        SetupTestCase.setUp(self)
+        self.source = self.tmpdir + "/cache/source/libevent-2.0.19-stable"
+        os.makedirs(self.source)
+        script = open(self.source + "/configure", "w")
+        script.write("#!/bin/sh\necho \"$@\" > configured\n")
+        script.close()
+        os.chmod(self.source + "/configure", 0755)
+
+        # the archive is already downloaded and extracted
+        self.thread.stepStats["libeventurl"] = self.thread.stats.addStep("libevent")
+        self.thread._downloadHelper = lambda config, key, logger: self.tmpdir + "/libevent-2.0.19-stable.tar.gz"
+        self.thread._extractHelper = lambda config, archive, url, logger: self.source
+
+    def _getBuildPath(self, fingerprint="fingerprint"):
+        return self.thread._getBuildPath(self.config, self.source, fingerprint)
+
+    def testOutOfTree(self):
+        cmdlist = [SOURCE_TAG + "/configure --prefix=/opt/shadow", "touch built-" + JOBS_TAG]
+        self.assertTrue(self.thread._setupStepHelper(self.config, "libeventurl", cmdlist, "fingerprint", None, self.logger))
+
+        # the build directory starts out empty, and the commands refer to the sources
+        buildPath = self._getBuildPath()
+        self.assertEqual(["built-4", "configured"], sorted(os.listdir(buildPath)))
+        self.assertEqual("--prefix=/opt/shadow\n", open(buildPath + "/configured").read())
+        self.assertEqual(["configure"], os.listdir(self.source))
+
+    def testInTree(self):
+        cmdlist = ["./configure", "touch built-" + JOBS_TAG]
+        self.assertTrue(self.thread._setupStepHelper(self.config, "libeventurl", cmdlist, "fingerprint", None, self.logger))
+
+        # the build directory is a copy of the sources, which are left alone
+        self.assertEqual(["built-4", "configure", "configured"], sorted(os.listdir(self._getBuildPath())))
+        self.assertEqual(["configure"], os.listdir(self.source))
+
+    def testBuildDirectoryPerFingerprint(self):
+        cmdlist = ["./configure"]
+        first = self.thread._buildDirectoryHelper(self.config, self.source, cmdlist, "release", self.logger)
+        second = self.thread._buildDirectoryHelper(self.config, self.source, cmdlist, "debug", self.logger)
+        self.assertNotEqual(first, second)
+        self.assertEqual(self._getBuildPath("release"), first)
+
+        # existing build directories are reused as they are
+        open(first + "/built", "w").close()
+        self.assertEqual(first, self.thread._buildDirectoryHelper(self.config, self.source, cmdlist, "release", self.logger))
+        self.assertTrue(os.path.exists(first + "/built"))
+        self.assertEqual(["using existing build directory '%s'" % first], self.logger.getMessages("INFO")[-1:])
+
+    def testLeftoverStagingDirectory(self):
+        # an interrupted copy is started over
+        os.makedirs(self._getBuildPath() + ".staging/partial")
+        path = self.thread._buildDirectoryHelper(self.config, self.source, ["./configure"], "fingerprint", self.logger)
+        self.assertEqual(["configure"], os.listdir(path))
+        self.assertFalse(os.path.exists(path + ".staging"))
+
+class RecordingLock():
+    """
+    Lock noting whether it's held while each command runs.
+    """
+
+    def __init__(self):
+        self.isHeld = False
+
+    def acquire(self):
+        self.isHeld = True
+
+    def release(self):
+        self.isHeld = False
+
+class TestInstall(SetupTestCase):
+    def setUp(self):
+        SetupTestCase.setUp(self)
+        os.makedirs(self.thread.prefix)
+        self.lock = RecordingLock()
+        self.thread._getInstallLock = lambda: self.lock
+
+        # notes if the install lock is held while each command runs
+        self.held = []
+        executeCommand = self.thread._executeCommand
+        def execute(cmd, workingDirectory, logger):
+            self.held.append((cmd, self.lock.isHeld))
+            return executeCommand(cmd, workingDirectory, logger)
+        self.thread._executeCommand = execute
+
+    def testInstallLockWithoutArtifacts(self):
+        self.assertTrue(self.thread._executeHelper(["true build", "true install"], self.tmpdir, self.logger))
+        self.assertEqual([("true build", False), ("true install", True)], self.held)
+        self.assertFalse(self.lock.isHeld)
+
+    def testInstalledFiles(self):
+        installed = []
+        cmdlist = ["touch lib", "sh -c 'touch %s/libevent.a' install" % self.thread.prefix]
+        self.assertTrue(self.thread._executeHelper(cmdlist, self.tmpdir, self.logger, installed))
+        self.assertEqual(["libevent.a"], installed)
+        self.assertTrue(self.held[1][1])
+
+    def testLockReleasedOnFailure(self):
+        self.assertFalse(self.thread._executeHelper(["false install"], self.tmpdir, self.logger, []))
+        self.assertFalse(self.lock.isHeld)
+
+class TestCommandUsage(SetupTestCase):
+    def testOverlappingSteps(self):
+        # one step keeps the cpu busy and uses memory while the other sleeps.
+        # each only gets the usage of its own commands.
+        busy = "%s -c \"import time; data = ' ' * 50000000; end = time.time() + 0.5; [0 for i in iter(lambda: time.time() < end, False)]\"" % sys.executable
+        idle = "%s -c \"import time; time.sleep(0.5)\"" % sys.executable
+        busyStats, idleStats = self.thread.stats.addStep("busy"), self.thread.stats.addStep("idle")
+
+        threads = []
+        for cmd, stats in ((busy, busyStats), (idle, idleStats)):
+            threads.append(threading.Thread(target=self.thread._executeHelper, args=([cmd], self.tmpdir, self.logger, None, stats)))
+        for thread in threads: thread.start()
+        for thread in threads: thread.join(10)
+
+        self.assertEqual([busy], [command["command"] for command in busyStats.commands])
+        self.assertEqual([idle], [command["command"] for command in idleStats.commands])
+        self.assertTrue(busyStats.getUserTime() > 0.3)
+        self.assertTrue(idleStats.getUserTime() < 0.2)
+        self.assertTrue(busyStats.getMaxRss() > 50000000)
+        self.assertTrue(idleStats.getMaxRss() < 40000000)
+
+class TestWatchdog(SetupTestCase):
+    def setUp(self):
+        SetupTestCase.setUp(self)
+        self._pollRate = src.setup.COMMAND_POLL_RATE
+        src.setup.COMMAND_POLL_RATE = 0.05
+        self.stats = self.thread.stats.addStep("openssl")
+
+    def tearDown(self):
+        src.setup.COMMAND_POLL_RATE = self._pollRate
+        SetupTestCase.tearDown(self)
+
+    def _execute(self, cmd):
+        startTime = time.time()
+        result = self.thread._executeCommand(cmd, self.tmpdir, self.logger)
+        return result, time.time() - startTime
+
+    def _isRunning(self, pidPath):
+        """
+        True if the process whose pid is in the given file is still running,
+        rather than gone or a zombie waiting for init to reap it.
+        """
+
+        pid = int(open(pidPath).read())
+        for i in range(20):
+            try: os.kill(pid, 0)
+            except OSError, exc:
+                if exc.errno == errno.ESRCH: return False
+            statPath = "/proc/%i/stat" % pid
+            if os.path.exists(statPath) and open(statPath).read().split(")")[-1].split()[0] == "Z": return False
+            time.sleep(0.05)
+        return True
+
+    def testExitCode(self):
+        (r, usage, isTimedOut), _ = self._execute("sh -c 'echo output; exit 3'")
+        self.assertEqual((3, False), (r, isTimedOut))
+        self.assertTrue(usage is not None)
+        self.assertEqual(["output"], self.logger.getMessages("DEBUG"))
+
+    def testCommandTimeout(self):
+        # everything the command started is killed along with it
+        self.config.set("setup", "commandtimeout", "1")
+        (r, usage, isTimedOut), seconds = self._execute("sh -c 'sleep 30 & echo $! > pid; echo started; wait'")
+        self.assertEqual((-signal.SIGTERM, True), (r, isTimedOut))
+        self.assertTrue(seconds < 5)
+        self.assertFalse(self._isRunning(self.tmpdir + "/pid"))
+        self.assertEqual(["killing 'sh -c 'sleep 30 & echo $! > pid; echo started; wait'' because it ran for more than 1 seconds"],
+                         self.logger.getMessages("ERROR"))
+
+    def testStallTimeout(self):
+        self.config.set("setup", "stalltimeout", "1")
+        (r, usage, isTimedOut), seconds = self._execute("sh -c 'echo started; sleep 30'")
+        self.assertEqual((-signal.SIGTERM, True), (r, isTimedOut))
+        self.assertTrue(seconds < 5)
+        self.assertTrue(self.logger.getMessages("ERROR")[0].endswith("because it produced no output for 1 seconds"))
+
+    def testTimeoutAfterOutputCloses(self):
+        # commands closing their output are still watched until they exit
+        self.config.set("setup", "commandtimeout", "1")
+        (r, usage, isTimedOut), seconds = self._execute("sh -c 'exec > /dev/null 2>&1; sleep 30'")
+        self.assertEqual((-signal.SIGTERM, True), (r, isTimedOut))
+        self.assertTrue(seconds < 5)
+
+    def testStopAfterOutputCloses(self):
+        threading.Timer(0.5, self.thread.stop).start()
+        (r, usage, isTimedOut), seconds = self._execute("sh -c 'exec > /dev/null 2>&1; sleep 30'")
+        self.assertEqual((-signal.SIGTERM, False), (r, isTimedOut))
+        self.assertTrue(seconds < 5)
+        self.assertEqual([], self.logger.getMessages("ERROR"))
+
+    def testRetry(self):
+        self.config.set("setup", "stalltimeout", "1")
+        self.config.set("setup", "commandretries", "2")
+        cmd = "sh -c 'echo attempt >> attempts; sleep 30'"
+        self.assertFalse(self.thread._executeHelper([cmd], self.tmpdir, self.logger, None, self.stats))
+
+        self.assertEqual(3, len(open(self.tmpdir + "/attempts").readlines()))
+        self.assertEqual([-signal.SIGTERM] * 3, [command["returncode"] for command in self.stats.commands])
+        self.assertEqual(["retrying '%s' (attempt 2 of 3)" % cmd, "retrying '%s' (attempt 3 of 3)" % cmd],
+                         [msg for msg in self.logger.getMessages("INFO") if msg.startswith("retrying")])
+
+    def testRetrySucceeds(self):
+        self.config.set("setup", "stalltimeout", "1")
+        self.config.set("setup", "commandretries", "1")
+        cmd = "sh -c 'if [ -e attempted ]; then exit 0; fi; touch attempted; sleep 30'"
+        self.assertTrue(self.thread._executeHelper([cmd], self.tmpdir, self.logger, None, self.stats))
+        self.assertEqual([-signal.SIGTERM, 0], [command["returncode"] for command in self.stats.commands])
+
+    def testFailuresAreNotRetried(self):
+        self.config.set("setup", "commandretries", "2")
+        self.assertFalse(self.thread._executeHelper(["sh -c 'echo attempt >> attempts; exit 1'"], self.tmpdir, self.logger, None, self.stats))
+        self.assertEqual(1, len(open(self.tmpdir + "/attempts").readlines()))
+        self.assertEqual(1, len(self.stats.commands))
+
+class ProgressThread():
+    """
+    Stands in for a setup thread, with the given progress.
+    """
+
+    def __init__(self, progress, isAlive=True, isSuccessful=False):
+        self.progress = progress
+        self.alive = isAlive
+        self.successful = isSuccessful
+
+    def getProgress(self):
+        return self.progress
+
+    def isAlive(self):
+        return self.alive
+
+    def isSuccessful(self):
+        return self.successful
+
+class TestProgress(SetupTestCase):
+    def setUp(self):
+        SetupTestCase.setUp(self)
+        self._configBase = src.setup.CONFIG_BASE
+        src.setup.CONFIG_BASE = self.tmpdir + "/shadow"
+
+    def tearDown(self):
+        src.setup.CONFIG_BASE = self._configBase
+        SetupTestCase.tearDown(self)
+
+    def _startProgress(self, current=[], restorable=[]):
+        fingerprints = dict([(step.name, step.name + "-fingerprint") for step in STEPS])
+        self.thread._startProgressHelper(STEPS, set(current), set(restorable), fingerprints, 1, self.logger)
+        return self.thread.progress.durations
+
+    def testWithoutHistory(self):
+        self.assertEqual(None, self.thread.getProgress())
+        durations = self._startProgress(["openssl"], ["shadow"])
+        self.assertEqual({"openssl": 0.0, "shadow": 5.0, "scallion": 120.0}, durations)
+        self.assertAlmostEqual(125.0, self.thread.getProgress()[1], 0)
+
+    def testWithHistory(self):
+        self._startProgress()
+        self.thread.history.record("shadow", "shadow-fingerprint", "built", 300.0)
+        self.thread.history.record("openssl", "openssl-fingerprint", "built", 60.0)
+
+        # steps that are up to date take no time whatever their history
+        durations = self._startProgress(["openssl"])
+        self.assertEqual({"openssl": 0.0, "shadow": 300.0, "scallion": 120.0}, durations)
+
+    def testLabels(self):
+        self.assertEqual(TOOLBAR_MESSAGE, src.setup._getProgressLabel(ProgressThread(None)))
+
+        label = src.setup._getProgressLabel(ProgressThread((0.25, 90.0)))
+        self.assertEqual("[#####---------------] 25% ETA 01:30 - " + TOOLBAR_MESSAGE, label)
+
+        # a failed step is shown before the setup ends
+        label = src.setup._getProgressLabel(ProgressThread((0.5, None)))
+        self.assertTrue(label.startswith("[##########----------] 50% failed - "))
+
+    def testFinishedLabels(self):
+        label = src.setup._getProgressLabel(ProgressThread((1.0, 0.0), False, True))
+        self.assertTrue(label.startswith("[####################] 100% finished - "))
+
+        # setups ending early aren't finished, even if no step failed
+        label = src.setup._getProgressLabel(ProgressThread((0.5, 10.0), False, False))
+        self.assertTrue(label.startswith("[##########----------] 50% failed - "))
+
+class TestBatch(SetupTestCase):
+    """
+    Runs batch setups of just shadow, whose step is replaced by one that
+    doesn't build anything.
+    """
+
+    def setUp(self):
+        SetupTestCase.setUp(self)
+        for option in ("doopenssl", "dolibevent", "doglib", "docmake", "doscallion"): self.config.set("setup", option, "false")
+        self.config.set("setup", "compilercache", "none")
+        self.config.set("setup", "prefetch", "0")
+        self.status = "built"
+        self.isStoppedDuringStep = False
+        self.out, self.err = StringIO(), StringIO()
+
+        self._patched = {}
+        self._patch("CONFIG_BASE", self.tmpdir + "/shadow")
+        self._patch("getConfig", lambda: self.config)
+        self._patch("StreamLogger", lambda level: StreamLogger(level, self.out, self.err))
+        self._patch("_createSetupThread", self._createSetupThread)
+
+    def tearDown(self):
+        for name, value in self._patched.items(): setattr(src.setup, name, value)
+        SetupTestCase.tearDown(self)
+
+    def _patch(self, name, value):
+        self._patched[name] = getattr(src.setup, name)
+        setattr(src.setup, name, value)
+
+    def _createSetupThread(self, config, logger):
+        self.setupThread = self._patched["_createSetupThread"](config, logger)
+        if self.setupThread is None: return None
+        def installStep(config, step, isCurrent, stamps, fingerprint, logger):
+            if self.isStoppedDuringStep: self.setupThread.stop()
+            return self.status
+        self.setupThread._installStepHelper = installStep
+        return self.setupThread
+
+    def _getReport(self):
+        directory = self.tmpdir + "/cache/" + REPORT_DIRECTORY_NAME
+        return json.load(open(os.path.join(directory, os.listdir(directory)[0])))
+
+    def testSuccess(self):
+        self.assertTrue(src.setup.startBatch())
+        self.assertTrue("setup succeeded!" in self.out.getvalue())
+        self.assertEqual("", self.err.getvalue())
+        self.assertTrue(self._getReport()["success"])
+
+    def testFailure(self):
+        self.status = "failed"
+        self.assertFalse(src.setup.startBatch())
+        self.assertTrue("setup failed... please check the log file." in self.out.getvalue())
+        self.assertFalse(self._getReport()["success"])
+
+    def testStoppedDuringLastStep(self):
+        # the step still succeeds, but the setup was stopped
+        self.isStoppedDuringStep = True
+        self.assertFalse(src.setup.startBatch())
+        self.assertFalse("setup succeeded!" in self.out.getvalue())
+        self.assertTrue("setup stopped before it finished." in self.out.getvalue())
+        self.assertFalse(self._getReport()["success"])
+
+    def testInvalidVariants(self):
+        self.config.set("setup", "variants", "debug")
+        self.assertFalse(src.setup.startBatch())
+        self.assertTrue("problem with the setup variants" in self.err.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Tests of the stamps that let setup skip the steps that are up to date.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.stamp import *
+
+INPUTS = ["http://www.openssl.org/source/openssl-1.0.0d.tar.gz", "", "/opt/shadow", "-I/opt/shadow/include",
+          "-L/opt/shadow/lib", "gcc (GCC) 4.6.3", ["./config --prefix=/opt/shadow", "make"], []]
+
+class TestStampStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmpdir, "prefix")
+        os.makedirs(os.path.join(self.prefix, "lib"))
+        open(os.path.join(self.prefix, "lib", "libssl.a"), "w").close()
+        self.stamps = StampStore(os.path.join(self.tmpdir, "stamps"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _isCurrent(self, inputs, outputs=["lib/libssl.*"]):
+        return self.stamps.isCurrent("openssl", getFingerprint(inputs), self.prefix, outputs)
+
+    def testCurrent(self):
+        self.assertFalse(self._isCurrent(INPUTS))
+        self.stamps.write("openssl", getFingerprint(INPUTS))
+        self.assertTrue(self._isCurrent(INPUTS))
+        self.assertTrue(self._isCurrent(list(INPUTS)))
+
+        # other steps have stamps of their own
+        self.assertFalse(self.stamps.isCurrent("libevent", getFingerprint(INPUTS), self.prefix, []))
+
+    def testInputChanged(self):
+        self.stamps.write("openssl", getFingerprint(INPUTS))
+        for i in range(len(INPUTS)):
+            inputs = list(INPUTS)
+            inputs[i] = inputs[i] + ["changed"] if isinstance(inputs[i], list) else inputs[i] + " changed"
+            self.assertFalse(self._isCurrent(inputs))
+        self.assertTrue(self._isCurrent(INPUTS))
+
+    def testMissingOutputs(self):
+        self.stamps.write("openssl", getFingerprint(INPUTS))
+        self.assertFalse(self._isCurrent(INPUTS, ["lib/libssl.*", "lib/libcrypto.*"]))
+
+    def testRemove(self):
+        self.stamps.write("openssl", getFingerprint(INPUTS))
+        self.stamps.remove("openssl")
+        self.assertFalse(self._isCurrent(INPUTS))
+        self.stamps.remove("openssl")
+
+    def testCorruptStamp(self):
+        open(os.path.join(self.stamps.path, "openssl.json"), "w").write("{\"finger")
+        self.assertFalse(self._isCurrent(INPUTS))
+
+if __name__ == '__main__':
+    unittest.main()
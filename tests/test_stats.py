@@ -0,0 +1,105 @@
+"""
+Tests of recording the resource usage of setup steps, its summary table and
+the JSON report.
+"""
+
+import os
+import json
+import time
+import socket
+import shutil
+import tempfile
+import unittest
+import resource
+
+from src.stats import *
+
+def getUsage(user, system, maxrss):
+    """
+    Provides resource usage as os.wait4 would, maxrss being in kilobytes.
+    """
+
+    return resource.struct_rusage((user, system, maxrss) + (0,) * 13)
+
+class TestStepStats(unittest.TestCase):
+    def testCommands(self):
+        stats = StepStats("openssl")
+        stats.addCommand("./config", 0, 2.0, getUsage(1.5, 0.5, 2048))
+        stats.addCommand("make -j4", 0, 10.0, getUsage(30.0, 3.0, 8192))
+        stats.addCommand("make install", 2, 1.0, None)
+
+        self.assertEqual(31.5, stats.getUserTime())
+        self.assertEqual(3.5, stats.getSystemTime())
+        self.assertEqual(8192 * 1024, stats.getMaxRss())
+        self.assertEqual(2, stats.toDict()["commands"][2]["returncode"])
+
+    def testWallTime(self):
+        stats = StepStats("openssl")
+        stats.finish("skipped")
+        self.assertEqual(0.0, stats.wallTime)
+
+        stats.start()
+        time.sleep(0.05)
+        stats.finish("built")
+        self.assertEqual("built", stats.status)
+        self.assertTrue(stats.wallTime >= 0.05)
+
+class TestSetupStats(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stats = SetupStats()
+        self.stats.startTime = 1300000000.0
+
+        openssl = self.stats.addStep("openssl")
+        openssl.addCommand("make -j4", 0, 10.0, getUsage(30.0, 3.0, 8192))
+        openssl.addDownload(4 * 1024 * 1024, 2.0)
+        openssl.addExtraction(0.5)
+        openssl.finish("built")
+        openssl.wallTime = 12.3
+        self.stats.addStep("libevent").finish("skipped")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testSummary(self):
+        lines = self.stats.getSummary()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(["step", "status", "wall", "user", "sys", "peak", "rss", "download", "extract"], lines[0].split())
+        self.assertEqual(["openssl", "built", "12.3s", "30.0s", "3.0s", "8.0", "MB", "4.0", "MB", "0.5s"], lines[1].split())
+        self.assertEqual(["libevent", "skipped", "0.0s", "0.0s", "0.0s", "0.0", "B", "-", "0.0s"], lines[2].split())
+
+        # columns line up
+        self.assertEqual(lines[0].index("status"), lines[1].index("built"))
+        self.assertEqual(lines[0].index("download"), lines[2].index("-"))
+
+        self.stats.endTime = self.stats.startTime + 75
+        self.assertEqual("total wall time: 75.0s", self.stats.getSummary()[-1])
+
+    def testReport(self):
+        self.stats.finish()
+        path = self.stats.writeReport(self.tmpdir + "/reports", {"success": True})
+        expectedName = "setup-%s-%s.json" % (socket.gethostname(), time.strftime("%Y%m%d-%H%M%S", time.localtime(1300000000.0)))
+        self.assertEqual(os.path.join(self.tmpdir, "reports", expectedName), path)
+        self.assertEqual([expectedName], os.listdir(self.tmpdir + "/reports"))
+
+        report = json.load(open(path))
+        self.assertEqual(True, report["success"])
+        self.assertEqual(socket.gethostname(), report["host"])
+        self.assertEqual(1300000000.0, report["start"])
+        self.assertEqual(self.stats.endTime, report["end"])
+        self.assertEqual(["openssl", "libevent"], [step["name"] for step in report["steps"]])
+
+        openssl = report["steps"][0]
+        self.assertEqual("built", openssl["status"])
+        self.assertEqual(30.0, openssl["user"])
+        self.assertEqual(8192 * 1024, openssl["maxrss"])
+        self.assertEqual(4 * 1024 * 1024, openssl["download_bytes"])
+        self.assertEqual(["make -j4"], [command["command"] for command in openssl["commands"]])
+
+    def testVariantReport(self):
+        path = self.stats.writeReport(self.tmpdir, variant="debug")
+        self.assertTrue(os.path.basename(path).startswith("setup-%s-debug-" % socket.gethostname()))
+        self.assertEqual(None, json.load(open(path))["end"])
+
+if __name__ == '__main__':
+    unittest.main()